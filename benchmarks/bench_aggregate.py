@@ -0,0 +1,115 @@
+"""Time fleet-level views over a scored fleet: per-drive Python loops against the column-wise ``Fleet``.
+
+Run with ``python benchmarks/bench_aggregate.py [--n-drives 500000]``.
+
+The fleet is scored once with ``predict_batch``; its rows are resampled from a synthetic fleet, so the scores are
+those of real leaves. Each view is computed both ways and the results are checked against each other, then the
+fleet endpoints are timed through Flask's test client, reading the scores from a result file as a deployment does.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from hdd_lifetime_prediction import parse_smartctl
+from hdd_lifetime_prediction.fleet.aggregate import Fleet, vendor
+from hdd_lifetime_prediction.fleet.backblaze import CSVResultWriter, PASSTHROUGH_COLUMNS, PREDICTION_COLUMNS
+
+from fleet import load_models, random_fleet, smartctl_text
+
+
+def best_of(function, runs: int = 5) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def loop_summary(records: list[dict]) -> dict:
+    """Mean and median expected lifetime per vendor, as the per-drive loops computed them."""
+    by_vendor = defaultdict(list)
+    for record in records:
+        by_vendor[vendor(record["model"])].append(record["expected_lifetime"])
+    return {name: (statistics.fmean(values), statistics.median(values)) for name, values in by_vendor.items()}
+
+
+def loop_top_k(records: list[dict], k: int) -> list[str]:
+    return [record["serial_number"] for record in sorted(records, key=lambda record: record["lower_lifetime"])[:k]]
+
+
+def loop_leaf_counts(records: list[dict]) -> Counter:
+    return Counter(record["node"] for record in records)
+
+
+def main(n_drives: int = 500_000, k: int = 100):
+    model = load_models()["long-term"]
+    drives = random_fleet(2000, models={"long-term": model})
+    X = model.feature_matrix([parse_smartctl(smartctl_text(drive)) for drive in drives])
+    rng = np.random.default_rng(0)
+    sample = rng.integers(0, len(drives), size=n_drives)
+    prediction = model.predict_batch(X[sample])
+    serials = [f"ZB{i:08d}" for i in range(n_drives)]
+    models = [drives[i].model for i in sample.tolist()]
+
+    start = time.perf_counter()
+    fleet = Fleet.from_prediction(prediction, serial_number=serials, model=models)
+    print(f"{n_drives} drives, Fleet built in {time.perf_counter() - start:.2f}s\n")
+    records = [
+        {"serial_number": serial, "model": drive_model, "node": node, "expected_lifetime": expected,
+         "lower_lifetime": lower}
+        for serial, drive_model, node, expected, lower in zip(
+            serials, models, prediction.node.tolist(), prediction.expected_lifetime.tolist(),
+            prediction.lower_lifetime.tolist(),
+        )
+    ]
+
+    summary = fleet.summary("expected_lifetime", by="vendor", q=(50.0,))
+    for name, (mean, median) in loop_summary(records).items():
+        assert np.isclose(summary[name]["mean"], mean) and np.isclose(summary[name]["percentiles"]["50.0"], median)
+    assert [row["serial_number"] for row in fleet.top_k("lower_lifetime", k)] == loop_top_k(records, k)
+    assert {int(node): count for node, count in fleet.leaf_counts()["all"].items()} == loop_leaf_counts(records)
+
+    print(f"{'view':<32} {'loops':>9} {'Fleet':>9}")
+    for label, loop, vectorized in (
+        ("summary by vendor", lambda: loop_summary(records), lambda: fleet.summary(by="vendor")),
+        (f"top {k} by lower_lifetime", lambda: loop_top_k(records, k), lambda: fleet.top_k("lower_lifetime", k)),
+        ("leaf counts", lambda: loop_leaf_counts(records), lambda: fleet.leaf_counts()),
+        ("histogram by model", None, lambda: fleet.histogram(bins=50, by="model")),
+        ("summary by node, one vendor", None, lambda: fleet.where(vendor="HGST").summary(by="node")),
+    ):
+        loop_time = f"{best_of(loop, 3) * 1e3:7.1f}ms" if loop else f"{'-':>9}"
+        print(f"{label:<32} {loop_time} {best_of(vectorized) * 1e3:7.1f}ms")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "scores.csv")
+        writer = CSVResultWriter(path)
+        columns = {"serial_number": serials, "model": models}
+        columns.update((name, getattr(prediction, name).tolist()) for name in PREDICTION_COLUMNS)
+        writer.write({name: columns[name] for name in (*PASSTHROUGH_COLUMNS, *PREDICTION_COLUMNS) if name in columns})
+        writer.close()
+        os.environ["HDD_LIFETIME_FLEET"] = path
+        from hdd_lifetime_prediction.app.app import app
+
+        client = app.test_client()
+        start = time.perf_counter()
+        client.get("/hdd-lifetime-prediction/fleet/leaves")
+        print(f"\nresult file read by the first request in {time.perf_counter() - start:.2f}s")
+        queries = ("summary?by=vendor", f"top?k={k}", "histogram?by=model&bins=50", "percentiles?by=node&vendor=HGST")
+        for query in queries:
+            url = f"/hdd-lifetime-prediction/fleet/{query}"
+            elapsed = best_of(lambda: client.get(url))
+            print(f"GET .../fleet/{query:<38} {elapsed * 1e3:7.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-drives", type=int, default=500_000)
+    parser.add_argument("-k", type=int, default=100)
+    args = parser.parse_args()
+    main(args.n_drives, args.k)
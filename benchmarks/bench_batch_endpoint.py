@@ -0,0 +1,59 @@
+"""Compare N single-drive POSTs against one batch POST of N drives.
+
+Run with ``python benchmarks/bench_batch_endpoint.py [--n-drives N] [--url http://host:port]``. Without ``--url``
+requests go through Flask's test client, so the numbers measure the application and leave out the network round
+trips, which only widen the gap in production.
+"""
+import argparse
+import json
+import time
+import urllib.request
+
+from hdd_lifetime_prediction.app.app import app
+
+from fleet import random_fleet, smartctl_text
+
+
+def make_poster(url: str | None):
+    """Return ``post(path, body) -> (status, json)`` against ``url``, or against the app in-process."""
+    if url is None:
+        client = app.test_client()
+
+        def post(path, body):
+            response = client.post(path, data=body, content_type="text/plain")
+            return response.status_code, response.json
+        return post
+
+    def post(path, body):
+        req = urllib.request.Request(url + path, data=body.encode(), headers={"Content-Type": "text/plain"})
+        with urllib.request.urlopen(req) as response:
+            return response.status, json.loads(response.read())
+    return post
+
+
+def main(n_drives: int = 2000, url: str | None = None):
+    dumps = {f"/dev/sd{i}": smartctl_text(drive) for i, drive in enumerate(random_fleet(n_drives))}
+    post = make_poster(url)
+
+    start = time.perf_counter()
+    for dump in dumps.values():
+        assert post("/hdd-lifetime-prediction/", dump)[0] == 200
+    single = time.perf_counter() - start
+
+    body = "".join(f"==> {key} <==\n{dump}\n" for key, dump in dumps.items())
+    start = time.perf_counter()
+    status, result = post("/hdd-lifetime-prediction/batch/", body)
+    batch = time.perf_counter() - start
+    assert status == 200 and len(result["results"]) == n_drives
+
+    print(f"{n_drives} single requests: {single:.3f}s ({n_drives / single:,.0f} drives/s)")
+    print(f"1 batch request:     {batch:.3f}s ({n_drives / batch:,.0f} drives/s)")
+    print(f"speedup: {single / batch:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-drives", type=int, default=2000)
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    args = parser.parse_args()
+    main(args.n_drives, args.url)
@@ -0,0 +1,85 @@
+"""Check the cold start of ``hdd-lifetime-predict`` against a budget, and that it leaves the heavy modules alone.
+
+Run with ``python benchmarks/bench_cli.py [--budget-ms 100] [--runs 15]``.
+
+The command is started afresh for every run, as cron starts it, with one ``smartctl -A`` output on stdin. Its wall
+time is compared with that of a bare ``python -c pass`` on the same machine, and the script exits with status 1 when
+the difference is over the budget, or when ``python -X importtime`` shows that any of ``HEAVY`` was imported.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from fleet import random_fleet, smartctl_text
+
+COMMAND = [sys.executable, "-m", "hdd_lifetime_prediction.cli"]
+# the modules the command must not import while the model file is up to date
+HEAVY = ("numpy", "yaml", "flask", "werkzeug", "hdd_lifetime_prediction.model.model")
+
+
+def wall_times(argv: list[str], stdin: bytes, runs: int) -> list[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, input=stdin, capture_output=True, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times(stdin: bytes) -> dict[str, int]:
+    """Cumulative microseconds per module imported by the command, from ``-X importtime``."""
+    result = subprocess.run([sys.executable, "-X", "importtime", *COMMAND[1:]], input=stdin, capture_output=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def main(budget_ms: float = 100.0, runs: int = 15) -> int:
+    one = smartctl_text(random_fleet(1)[0]).encode()
+    many = "".join(f"==> /dev/sd{i} <==\n{smartctl_text(drive)}\n" for i, drive in enumerate(random_fleet(100)))
+
+    print(f"{'':<40} {'min':>9} {'median':>9}")
+    timings = {}
+    for label, argv, stdin in (
+        ("python -c pass", [sys.executable, "-c", "pass"], b""),
+        ("hdd-lifetime-predict, 1 drive", COMMAND, one),
+        ("hdd-lifetime-predict, 100 drives", COMMAND, many.encode()),
+        ("import TreeModel, for reference", [sys.executable, "-c", "from hdd_lifetime_prediction import TreeModel"],
+         b""),
+    ):
+        times = timings[label] = wall_times(argv, stdin, runs)
+        print(f"{label:<40} {min(times) * 1e3:7.1f}ms {statistics.median(times) * 1e3:7.1f}ms")
+
+    status = 0
+    startup = statistics.median(timings["hdd-lifetime-predict, 1 drive"]) - statistics.median(timings["python -c pass"])
+    print(f"\ncold start over a bare interpreter: {startup * 1e3:.1f}ms (budget {budget_ms:.0f}ms)")
+    if startup * 1e3 > budget_ms:
+        print("over budget")
+        status = 1
+
+    imports = import_times(one)
+    heavy = sorted(module for module in imports if module.split(".")[0] in HEAVY or module in HEAVY)
+    print("\nslowest imports (cumulative):")
+    top_level = {module: t for module, t in imports.items() if "." not in module or module.startswith("hdd_")}
+    for module, t in sorted(top_level.items(), key=lambda item: -item[1])[:8]:
+        print(f"  {module:<38} {t / 1e3:7.1f}ms")
+    if heavy:
+        print(f"\nimported on the fast path: {', '.join(heavy)}")
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=100.0,
+                        help="the most the command may add to a bare interpreter start (default: 100)")
+    parser.add_argument("--runs", type=int, default=15)
+    args = parser.parse_args()
+    sys.exit(main(args.budget_ms, args.runs))
@@ -0,0 +1,79 @@
+"""Time ``TreeModel`` predictions with the generated predictors (see ``model/codegen.py``) against the tree walks.
+
+Run with ``python benchmarks/bench_codegen.py [--n-drives N] [--missing-rate R] [--batch-rows N]``.
+
+Every drive of the fleet is first predicted both ways and the script exits with status 1 on any disagreement, so the
+timings are only printed for predictors that match the interpreter exactly, missing attributes included.
+"""
+import argparse
+import sys
+import timeit
+
+import numpy as np
+
+from hdd_lifetime_prediction import parse_smartctl
+from hdd_lifetime_prediction.model import codegen
+from hdd_lifetime_prediction.utils import metrics
+
+from fleet import load_models, random_fleet, smartctl_text
+
+
+def best_of(func, n_items: int, repeat: int) -> tuple[float, float]:
+    """Best seconds per item of ``func`` walking the tree and with the generated predictors, interleaved."""
+    walked, generated = [], []
+    func()
+    for _ in range(repeat):
+        for enabled, times in ((False, walked), (True, generated)):
+            codegen.set_enabled(enabled)
+            times.append(timeit.timeit(func, number=1) / n_items)
+    codegen.set_enabled(False)
+    return min(walked), min(generated)
+
+
+def main(n_drives: int = 2000, missing_rate: float = 0.1, batch_rows: int = 100_000, repeat: int = 7) -> int:
+    # node hits cost the same either way, leave them out of the comparison
+    metrics.set_enabled(False)
+    models = load_models()
+    drives = random_fleet(n_drives, models=models, missing_rate=missing_rate)
+    parsed = [parse_smartctl(smartctl_text(drive)) for drive in drives]
+
+    print(f"{'':<40} {'walk':>12} {'generated':>12} {'speedup':>8}")
+    for name, model in models.items():
+        generated = model.generated
+        values = [model.project(smart_attributes) for smart_attributes in parsed]
+        X = model.feature_matrix(parsed)
+        X_large = X[np.arange(batch_rows) % len(X)]
+
+        codegen.set_enabled(False)
+        expected = [model.predict_full(smart_attributes) for smart_attributes in parsed]
+        codegen.set_enabled(True)
+        mismatches = {
+            "predict_full": sum(a is not b for a, b in zip(expected, map(model.predict_full, parsed))),
+            "node_id": sum(model.config[generated.node_id(v)] is not e for v, e in zip(values, expected)),
+            "apply": int((generated.apply(X) != model.compiled.apply(X)).sum()),
+        }
+        codegen.set_enabled(False)
+        if any(mismatches.values()):
+            print(f"{name}: the generated predictors disagree with the tree walk: {mismatches}")
+            return 1
+
+        for label, func, n_items in (
+            ("predict_full", lambda: [model.predict_full(sa) for sa in parsed], n_drives),
+            ("predict_node_id", lambda: [model.predict_node_id(v) for v in values], n_drives),
+            (f"predict_batch, {n_drives} rows", lambda: model.predict_batch(X), n_drives),
+            (f"predict_batch, {batch_rows} rows", lambda: model.predict_batch(X_large), batch_rows),
+        ):
+            before, after = best_of(func, n_items, repeat)
+            print(f"{f'{name} {label}':<40} {before * 1e9:10.0f}ns {after * 1e9:10.0f}ns {before / after:7.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-drives", type=int, default=2000)
+    parser.add_argument("--missing-rate", type=float, default=0.1,
+                        help="the share of attributes left out of each drive (default: 0.1)")
+    parser.add_argument("--batch-rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+    sys.exit(main(args.n_drives, args.missing_rate, args.batch_rows, args.repeat))
@@ -0,0 +1,67 @@
+"""Compare a serial smartctl sweep with the concurrent collector, on a host simulated with a fake smartctl.
+
+Run with ``python benchmarks/bench_collector.py [--n-devices 90] [--delay 0.2] [--timeout 2] [-j 16]``.
+
+The fake smartctl prints a synthetic ``smartctl -A`` output per device after ``--delay`` seconds, as reading the
+attributes of a busy disk takes. One extra device hangs, as a failing disk can, and one cannot be opened, so both
+sweeps also show how they cope with those.
+"""
+import argparse
+import os
+import stat
+import tempfile
+import time
+from pathlib import Path
+
+from hdd_lifetime_prediction.fleet.collector import collect, score
+
+from fleet import random_fleet, smartctl_text
+
+FAKE_SMARTCTL = """#!/bin/sh
+# a stand-in for smartctl -A: prints $FAKE_SMARTCTL_DIR/<device name>.txt after $FAKE_SMARTCTL_DELAY seconds
+for device; do :; done
+name=$(basename "$device")
+case "$name" in
+    hung*) exec sleep 3600 ;;
+    missing*) echo "Smartctl open device: $device failed: No such device" >&2; exit 2 ;;
+esac
+sleep "$FAKE_SMARTCTL_DELAY"
+cat "$FAKE_SMARTCTL_DIR/$name.txt"
+"""
+
+
+def fake_host(directory: Path, n_devices: int, delay: float) -> tuple[str, list[str]]:
+    """Write the fake smartctl and its outputs to ``directory``. Returns the script and the device paths."""
+    devices = []
+    for i, drive in enumerate(random_fleet(n_devices)):
+        name = f"sd{i}"
+        (directory / f"{name}.txt").write_text(smartctl_text(drive))
+        devices.append(f"/dev/{name}")
+    devices += ["/dev/hung0", "/dev/missing0"]
+
+    smartctl = directory / "smartctl"
+    smartctl.write_text(FAKE_SMARTCTL)
+    smartctl.chmod(smartctl.stat().st_mode | stat.S_IXUSR)
+    os.environ["FAKE_SMARTCTL_DIR"] = str(directory)
+    os.environ["FAKE_SMARTCTL_DELAY"] = str(delay)
+    return str(smartctl), devices
+
+
+def main(n_devices: int = 90, delay: float = 0.2, timeout: float = 2.0, workers: int = 16):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        smartctl, devices = fake_host(Path(tmpdir), n_devices, delay)
+        for label, n_workers in (("serial", 1), (f"{workers} workers", workers)):
+            start = time.perf_counter()
+            result = score(collect(devices, smartctl, timeout, n_workers))
+            elapsed = time.perf_counter() - start
+            print(f"{label:<12} {elapsed:6.2f}s  {len(result['results'])} scored, errors: {result['errors']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-devices", type=int, default=90)
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds smartctl takes per device")
+    parser.add_argument("--timeout", type=float, default=2.0, help="seconds per device before it is given up on")
+    parser.add_argument("-j", "--workers", type=int, default=16)
+    args = parser.parse_args()
+    main(args.n_devices, args.delay, args.timeout, args.workers)
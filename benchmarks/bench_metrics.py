@@ -0,0 +1,108 @@
+"""Measure the overhead of the instrumentation, and check it against a budget.
+
+Run with ``python benchmarks/bench_metrics.py [--n-drives 200] [--rounds 101] [--budget 0.05]``.
+
+Single-drive requests through Flask's test client, batch requests and bare predictions are timed with metrics on and
+off. The script exits with status 1 when the end-to-end overhead on a single-drive request exceeds the budget. Machine
+noise is larger than the overhead itself, so each round times both settings back to back, in alternating order, and
+the overhead is the median over the rounds of their ratio. The cost of the instrumentation of a single-drive request
+(the request hooks, the stage laps and the node hit count), timed on its own, is printed alongside.
+"""
+import argparse
+import statistics
+import sys
+import timeit
+
+from flask import Response, g
+
+from hdd_lifetime_prediction import parse_smartctl
+from hdd_lifetime_prediction.app.app import app, record_request, response_cache, start_stopwatch
+from hdd_lifetime_prediction.utils import metrics
+
+from fleet import load_models, random_fleet, smartctl_text
+
+STAGES = ("decode", "parse", "load", "predict", "serialize")
+
+
+def paired(func, n_items: int, rounds: int) -> tuple[float, float, float]:
+    """Median seconds per item of ``func`` with metrics on and off, and the median of their ratio per round, less 1."""
+    on, off, ratios = [], [], []
+    for i in range(rounds):
+        times = {}
+        for enabled in ((True, False) if i % 2 == 0 else (False, True)):
+            metrics.set_enabled(enabled)
+            times[enabled] = timeit.timeit(func, number=1) / n_items
+        metrics.set_enabled(True)
+        on.append(times[True])
+        off.append(times[False])
+        ratios.append(times[True] / times[False])
+    return statistics.median(on), statistics.median(off), statistics.median(ratios) - 1
+
+
+def instrumentation_cost(model, rounds: int) -> tuple[float, float]:
+    """Seconds per request spent in the instrumentation of a single-drive request, with metrics (on, off)."""
+    response = Response("{}")
+
+    def instrument():
+        start_stopwatch()
+        stopwatch = g.stopwatch
+        for stage in STAGES:
+            stopwatch.lap(stage)
+        model.node_hits.add(1)
+        record_request(response)
+
+    with app.test_request_context("/hdd-lifetime-prediction/", method="POST"):
+        on, off, _ = paired(lambda: [instrument() for _ in range(1000)], 1000, rounds)
+        return on, off
+
+
+def main(n_drives: int = 200, rounds: int = 101, budget: float = 0.05) -> int:
+    models = load_models()
+    model = models["long-term"]
+    texts = [smartctl_text(drive) for drive in random_fleet(n_drives, models=models)]
+    parsed = [parse_smartctl(text) for text in texts]
+    client = app.test_client()
+
+    def single():
+        response_cache.clear()
+        for text in texts:
+            client.post("/hdd-lifetime-prediction/", data=text, content_type="text/plain")
+
+    batch_body = "".join(f"==> /dev/sd{i} <==\n{text}\n" for i, text in enumerate(texts))
+
+    def batch():
+        client.post("/hdd-lifetime-prediction/batch/", data=batch_body, content_type="text/plain")
+
+    def predict_full():
+        for smart_attributes in parsed:
+            model.predict_full(smart_attributes)
+
+    print(f"{'':<32} {'metrics on':>12} {'metrics off':>12} {'overhead':>9}")
+    overheads = {}
+    for label, func, n_items in (
+        ("endpoint.single[text]", single, n_drives),
+        ("endpoint.batch[text] per drive", batch, n_drives),
+        ("TreeModel.predict_full", predict_full, n_drives),
+    ):
+        func()
+        on, off, overheads[label] = paired(func, n_items, rounds)
+        print(f"{label:<32} {on * 1e6:10.2f}us {off * 1e6:10.2f}us {overheads[label]:8.1%}")
+
+    on, off = instrumentation_cost(model, rounds)
+    print(f"\ninstrumentation of a single-drive request on its own: {(on - off) * 1e6:.2f}us")
+    share = overheads["endpoint.single[text]"]
+    print(f"end-to-end overhead on a single-drive request: {share:.1%} (budget {budget:.0%})")
+    if share > budget:
+        print("over budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-drives", type=int, default=200, help="drives per timed run (default: %(default)s)")
+    parser.add_argument("--rounds", type=int, default=101, help="paired runs per measurement (default: %(default)s)")
+    parser.add_argument("--budget", type=float, default=0.05,
+                        help="the largest acceptable overhead on a single-drive request (default: 0.05, i.e. 5%%)")
+    args = parser.parse_args()
+    sys.exit(main(args.n_drives, args.rounds, args.budget))
@@ -0,0 +1,134 @@
+"""Time the extraction of params from a tree visualisation page, against the previous brace-counting extraction.
+
+Run with ``python benchmarks/bench_nodeparser.py [--curve-points N] [--padding-mb M] [--html page.html]``.
+
+Without ``--html``, a page in the format of the paper's supplementary material is generated from the shipped long-term
+tree: every node gets a lifetime curve of ``--curve-points`` points, and ``--padding-mb`` of script precedes the
+tree, as the bundled visualisation libraries do in the real pages. The previous extraction is timed from the
+``<script>`` contents, as BeautifulSoup handed them to it, plus the BeautifulSoup parse itself when it is installed.
+"""
+import argparse
+import json
+import random
+import re
+import tempfile
+import time
+from importlib.resources import files
+from pathlib import Path
+
+from hdd_lifetime_prediction import TreeModel
+from hdd_lifetime_prediction.utils.nodeparser import extract_params, extract_treeinfo, parse_curves, parse_nodes
+
+FEATURES = [f"smart_{i}_{column}" for i in (1, 3, 4, 5, 7, 9, 10, 12, 187, 188, 190, 194, 197, 198, 199)
+            for column in ("raw", "normalized")]
+
+
+def synthetic_page(curve_points: int, padding_mb: float, seed: int = 0) -> str:
+    """A page holding the shipped long-term tree as ``var treeinfo = {...}``, with full lifetime curves."""
+    rng = random.Random(seed)
+    model = TreeModel(files("hdd_lifetime_prediction.model").joinpath("long-term-params.yaml"))
+    nodes = []
+    for node_id, node in model.config.items():
+        times = sorted(rng.uniform(0, 3 * node.upper_lifetime + 1) for _ in range(curve_points))
+        coefs = sorted(rng.random() for _ in range(curve_points))
+        # leaves have a split on feature 0, i.e. none
+        feature = FEATURES.index(node.split_feature) + 1 if node.split_feature is not None else 0
+        split = {"parallel_split": {"feature": feature, "threshold": node.split_threshold}}
+        nodes.append({
+            "id": node_id,
+            "lower_child": node.lower_node if node.lower_node is not None else -2,
+            "upper_child": node.upper_node if node.upper_node is not None else -2,
+            "split_mixed": split,
+            "n_node_samples": node.n_samples,
+            "fit": {"curve": {"times": times, "coefs": coefs, "expected_time": node.expected_lifetime}},
+        })
+    treeinfo = {"lnr": {"tree_": {"nodes": nodes}, "prb_": {"data": {"features": {"feature_names": FEATURES}}}}}
+
+    # minified library code, braces and all
+    chunk = "function f(a){return a.map(function(b){return{x:b.x,y:[b.y,{z:1}]}})};var s='}{';"
+    padding = chunk * int(padding_mb * 2**20 / len(chunk))
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<script>{padding}</script></head><body><div id='tree'></div>"
+        f"<script>var treeinfo = {json.dumps(treeinfo)};\nrender(treeinfo);</script></body></html>"
+    )
+
+
+def legacy_find_matching_brace(s, start_index):
+    open_braces = 0
+    for i in range(start_index, len(s)):
+        if s[i] == '{':
+            open_braces += 1
+        elif s[i] == '}':
+            open_braces -= 1
+            if open_braces == 0:
+                return i
+    return -1
+
+
+def legacy_extract(script_contents: list[str], path: tuple[str, ...]):
+    """``extract_nodes_from_script``/``extract_features_from_script`` before the single scan, given the scripts."""
+    result = []
+    for script_content in script_contents:
+        if script_content and 'var treeinfo =' not in script_content:
+            continue
+        json_start = script_content.index('var treeinfo =') + len('var treeinfo =')
+        json_str_start = script_content.index('{', json_start)
+        json_str_end = legacy_find_matching_brace(script_content, json_str_start) + 1
+        if json_str_end != 0:
+            result = json.loads(script_content[json_str_start:json_str_end])
+            for key in path:
+                result = result.get(key, {})
+    return result
+
+
+def best(func, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(curve_points: int = 2000, padding_mb: float = 4.0, html: Path | None = None):
+    page = html.read_text() if html else synthetic_page(curve_points, padding_mb)
+    print(f"page: {len(page) / 2**20:.1f} MB")
+
+    nodes, features = extract_treeinfo(page.encode())
+    scripts = re.findall(r"<script[^>]*>(.*?)</script>", page, flags=re.S)
+    assert legacy_extract(scripts, ("lnr", "tree_", "nodes")) == nodes
+    assert legacy_extract(scripts, ("lnr", "prb_", "data", "features", "feature_names")) == features
+
+    legacy = best(lambda: (legacy_extract(scripts, ("lnr", "tree_", "nodes")),
+                           legacy_extract(scripts, ("lnr", "prb_", "data", "features", "feature_names"))), 1)
+    print(f"{'legacy extraction (brace counting, 2x)':<44} {legacy:8.3f}s")
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        print(f"{'BeautifulSoup parse':<44} {'(not installed)':>9}")
+    else:
+        soup_seconds = best(lambda: BeautifulSoup(page, "html.parser").find_all("script"), 1)
+        print(f"{'BeautifulSoup parse + find_all(script), 2x':<44} {2 * soup_seconds:8.3f}s")
+
+    data = page.encode()
+    single = best(lambda: extract_treeinfo(data))
+    print(f"{'extract_treeinfo':<44} {single:8.3f}s  ({legacy / single:.0f}x faster than brace counting)")
+    parse = best(lambda: (parse_nodes(nodes, features), parse_curves(nodes)))
+    print(f"{'parse_nodes + parse_curves':<44} {parse:8.3f}s")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        page_path = Path(tmpdir) / "page.html"
+        page_path.write_bytes(data)
+        config_yaml = Path(tmpdir) / "params.yaml"
+        end_to_end = best(lambda: extract_params(page_path, config_yaml))
+        print(f"{'extract_params (yaml + model file, verified)':<44} {end_to_end:8.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--curve-points", type=int, default=2000, help="lifetime curve points per node")
+    parser.add_argument("--padding-mb", type=float, default=4.0, help="MB of script before the tree")
+    parser.add_argument("--html", type=Path, help="time a real page instead of a generated one")
+    args = parser.parse_args()
+    main(args.curve_points, args.padding_mb, args.html)
@@ -0,0 +1,115 @@
+"""Microbenchmarks of ``parse_smartctl`` and ``TreeModel.get_attribute`` against the previous implementations.
+
+Run with ``python benchmarks/bench_parse_smartctl.py``.
+"""
+import re
+import timeit
+from dataclasses import dataclass
+from importlib.resources import files
+
+from hdd_lifetime_prediction import TreeModel, parse_smartctl
+
+from fleet import random_dumps
+
+
+@dataclass
+class LegacySMARTAttribute:
+    id: str
+    name: str
+    raw: str
+    normalized: str
+    worst: str
+
+
+@dataclass
+class LegacySMARTAttributes:
+    attributes: list[LegacySMARTAttribute]
+
+
+def legacy_parse_smartctl(smartctl_output: str) -> LegacySMARTAttributes:
+    """``parse_smartctl`` before the header cache: a regex per line and column boundaries rebuilt per call."""
+    lines = smartctl_output.splitlines()
+    relevant_lines = []
+    _relevant = False
+    header = ""
+    for line in lines:
+        if re.match(r"ID#.*ATTRIBUTE_NAME.*VALUE.*RAW_VALUE", line):
+            _relevant = True
+            header = line
+            continue
+        if not _relevant:
+            continue
+        if not line:
+            break
+        relevant_lines.append(line)
+
+    if not header:
+        raise ValueError("Could not parse SMART data")
+
+    colnames = header.split()
+    column_indices = {}
+    for i, colname in enumerate(colnames):
+        start = header.index(colname)
+        next_colname = colnames[i + 1] if i + 1 < len(colnames) else None
+        stop = header.index(next_colname) - 1 if next_colname else None
+        column_indices[colname] = (start, stop)
+
+    attributes = []
+    for line in relevant_lines:
+        attributes += [LegacySMARTAttribute(
+            id=line[slice(*column_indices["ID#"])].strip(),
+            name=line[slice(*column_indices["ATTRIBUTE_NAME"])].strip(),
+            raw=line[slice(*column_indices["RAW_VALUE"])].strip(),
+            normalized=line[slice(*column_indices["VALUE"])].strip(),
+            worst=line[slice(*column_indices["WORST"])].strip(),
+        )]
+    return LegacySMARTAttributes(attributes)
+
+
+def legacy_get_attribute(attr_name, smart_attributes: LegacySMARTAttributes):
+    """``TreeModel.get_attribute`` before the ID index: a linear scan returning the unparsed string."""
+    smart_flag_id = attr_name.split("_")[1]
+    smart_flag_key = attr_name.split("_")[2]
+    for attr in smart_attributes.attributes:
+        if attr.id == smart_flag_id:
+            return getattr(attr, smart_flag_key)
+    return None
+
+
+def bench(label: str, func, per: int) -> float:
+    """Best of five runs of ``func``, divided by the ``per`` items it processes."""
+    seconds = min(timeit.repeat(func, number=1, repeat=5)) / per
+    print(f"{label:<40} {seconds * 1e6:9.2f} us")
+    return seconds
+
+
+def main(n_dumps: int = 1000):
+    dumps = random_dumps(n_dumps)
+    for dump in dumps:
+        parsed, legacy = parse_smartctl(dump), legacy_parse_smartctl(dump)
+        assert [(a.id, a.name, a.raw, a.normalized, a.worst) for a in parsed.attributes] == \
+            [(a.id, a.name, a.raw, a.normalized, a.worst) for a in legacy.attributes]
+
+    print(f"per dump, averaged over {n_dumps} dumps:")
+    old = bench("legacy parse_smartctl", lambda: [legacy_parse_smartctl(d) for d in dumps], n_dumps)
+    new = bench("parse_smartctl", lambda: [parse_smartctl(d) for d in dumps], n_dumps)
+    print(f"{'speedup':<40} {old / new:9.2f} x")
+
+    model = TreeModel(files("hdd_lifetime_prediction.model").joinpath("long-term-params.yaml"))
+    legacy_attributes = [legacy_parse_smartctl(d) for d in dumps]
+    attributes = [parse_smartctl(d) for d in dumps]
+    names = model.feature_names
+
+    def legacy_lookup(name, attributes):
+        value = legacy_get_attribute(name, attributes)
+        return None if value is None else float(value)
+
+    print(f"\nlooking up all {len(names)} split features, per dump:")
+    old = bench("legacy get_attribute", lambda: [legacy_lookup(n, a) for a in legacy_attributes for n in names],
+                n_dumps)
+    new = bench("get_attribute", lambda: [model.get_attribute(n, a) for a in attributes for n in names], n_dumps)
+    print(f"{'speedup':<40} {old / new:9.2f} x")
+
+
+if __name__ == "__main__":
+    main()
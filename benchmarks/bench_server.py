@@ -0,0 +1,182 @@
+"""Load-test the pre-forking server: throughput against the number of workers, then reloads and shutdown under load.
+
+Run with ``python benchmarks/bench_server.py [--workers 1,2,4] [--duration 5] [--clients 8]``.
+
+For each worker count the server is started afresh and ``--clients`` client processes post single-drive smartctl
+outputs, one request per connection, for ``--duration`` seconds. Throughput is compared with that of one worker:
+it should grow close to linearly up to the number of cores, which the clients share with the server, so leave some
+cores to the clients (e.g. ``--workers 1,2,4`` on 8 cores).
+
+Then, at the largest worker count, with workers recycled every 200 requests, the server is sent SIGHUP twice during
+the load; no request may fail. Last, a large batch request is sent SIGTERM while it is being served; it must still
+complete. The script exits with status 1 if either check fails.
+"""
+import argparse
+import http.client
+import multiprocessing
+import multiprocessing.pool
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from fleet import random_fleet, smartctl_text
+
+PATH = "/hdd-lifetime-prediction/"
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, *args: str) -> tuple[subprocess.Popen, int]:
+    """Start the server and wait until it answers."""
+    port = free_port()
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, (SOURCE, os.environ.get("PYTHONPATH"))))}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "hdd_lifetime_prediction.app.server", "-b", f"127.0.0.1:{port}", "-w", str(workers),
+         *args],
+        env=env, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            post(port, b"")
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("the server did not start")
+
+
+def stop_server(process: subprocess.Popen):
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=60)
+
+
+def post(port: int, body: bytes, timeout: float = 30.0) -> int:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        connection.request("POST", PATH if not body.startswith(b"==>") else PATH + "batch/", body,
+                           {"Content-Type": "text/plain"})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def client(port: int, bodies: list[bytes], duration: float, offset: int) -> tuple[list[float], int]:
+    """Post bodies round robin for ``duration`` seconds. Returns the latency of each successful request, and the
+    number of failed ones."""
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    i = offset
+    while (start := time.perf_counter()) < deadline:
+        try:
+            status = post(port, bodies[i % len(bodies)])
+        except OSError:
+            status = None
+        i += 1
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors += 1
+    return latencies, errors
+
+
+def start_load(pool, port: int, bodies: list[bytes], duration: float, clients: int):
+    """Start the clients, each on its own process of ``pool``. ``collect`` waits for them."""
+    return pool.starmap_async(client, [(port, bodies, duration, i * 97) for i in range(clients)])
+
+
+def collect(results) -> tuple[list[float], int]:
+    """The latencies of every client's successful requests, and the number of failed ones."""
+    latencies, errors = [], 0
+    for client_latencies, client_errors in results.get():
+        latencies += client_latencies
+        errors += client_errors
+    return latencies, errors
+
+
+def scaling(pool, bodies, worker_counts, duration, clients):
+    print(f"{'workers':>7} {'req/s':>9} {'speedup':>8} {'p50':>8} {'p99':>8} {'errors':>7}")
+    baseline = None
+    for workers in worker_counts:
+        process, port = start_server(workers, "--max-requests", "0")
+        try:
+            latencies, errors = collect(start_load(pool, port, bodies, duration, clients))
+        finally:
+            stop_server(process)
+        throughput = len(latencies) / duration
+        baseline = baseline or throughput
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"{workers:>7} {throughput:>9.0f} {throughput / baseline:>7.2f}x {quantiles[49] * 1e3:>6.1f}ms "
+              f"{quantiles[98] * 1e3:>6.1f}ms {errors:>7}")
+
+
+def reloads(pool, bodies, workers, duration, clients) -> bool:
+    process, port = start_server(workers, "--max-requests", "200")
+    try:
+        results = start_load(pool, port, bodies, duration, clients)
+        for _ in range(2):
+            time.sleep(duration / 3)
+            process.send_signal(signal.SIGHUP)
+        latencies, errors = collect(results)
+    finally:
+        stop_server(process)
+    print(f"\n{workers} workers recycled every 200 requests, 2 reloads: {len(latencies)} requests, {errors} failed")
+    return errors == 0
+
+
+def drain(batch: bytes) -> bool:
+    process, port = start_server(1)
+    try:
+        with multiprocessing.pool.ThreadPool(1) as threads:
+            start = time.perf_counter()
+            result = threads.apply_async(post, (port, batch))
+            time.sleep(0.2)
+            process.send_signal(signal.SIGTERM)
+            status = result.get()
+            elapsed = time.perf_counter() - start
+        code = process.wait(timeout=60)
+    finally:
+        if process.poll() is None:
+            process.kill()
+    print(f"batch request in flight at SIGTERM: status {status} after {elapsed:.1f}s, server exited with {code}")
+    return status == 200 and code == 0
+
+
+def main(worker_counts: list[int], duration: float = 5.0, clients: int = 8, batch_size: int = 5000) -> int:
+    drives = random_fleet(max(batch_size, 1000))
+    bodies = [smartctl_text(drive).encode() for drive in drives[:1000]]
+    batch = "".join(f"==> {drive.serial} <==\n{smartctl_text(drive)}\n" for drive in drives[:batch_size]).encode()
+    print(f"{os.cpu_count()} cores, {clients} client processes, {duration:g}s per run\n")
+
+    with multiprocessing.Pool(clients) as pool:
+        scaling(pool, bodies, worker_counts, duration, clients)
+        reloaded = reloads(pool, bodies, max(worker_counts), duration, clients)
+    drained = drain(batch)
+    return 0 if reloaded and drained else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=None,
+                        help="comma separated worker counts (default: 1, 2, 4, ... up to half the cores)")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    parser.add_argument("--clients", type=int, default=8, help="client processes")
+    parser.add_argument("--batch-size", type=int, default=5000, help="drives in the batch request of the drain check")
+    args = parser.parse_args()
+    if args.workers:
+        counts = [int(n) for n in args.workers.split(",")]
+    else:
+        counts = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= max(1, (os.cpu_count() or 2) // 2)]
+    sys.exit(main(counts, args.duration, args.clients, args.batch_size))
@@ -0,0 +1,91 @@
+"""Compare rescoring a whole fleet every day with rescoring only the drives whose split features changed.
+
+Run with ``python benchmarks/bench_state.py [--n-drives 200000] [--change-rate 0.02] [--days 3]``.
+
+Day 0 scores the fleet into an empty ``DriveStateStore``. On each following day a ``--change-rate`` share of the
+drives takes the split features of another random drive, as ageing drives cross thresholds, and the rest report the
+same values again. The full sweep evaluates every drive and writes every drive's state; the incremental one evaluates
+and writes the changed drives only, after reading the stored state as a fresh process does. Both report the same
+drives as moved, which is checked against the nodes of a full evaluation of both days.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from hdd_lifetime_prediction import parse_smartctl
+from hdd_lifetime_prediction.fleet.state import DriveStateStore, feature_blobs
+from hdd_lifetime_prediction.model.registry import load_model
+
+from fleet import DEFAULT_PARAMS, load_models, random_fleet, smartctl_text
+
+
+def full_sweep(store: DriveStateStore, loaded, serials: list[str], X: np.ndarray) -> dict[str, tuple[int, int]]:
+    """Evaluate and store every drive, as a sweep without the incremental check would."""
+    previous = dict(store.connection.execute("SELECT serial, node FROM drives WHERE model_version = ?",
+                                             (loaded.version,)))
+    nodes = loaded.model.predict_batch(X).node.tolist()
+    now = time.time()
+    with store.connection:
+        store.connection.executemany(
+            "INSERT OR REPLACE INTO drives (serial, model_version, features, node, updated) VALUES (?, ?, ?, ?, ?)",
+            [(serial, loaded.version, blob, node, now) for serial, blob, node in zip(serials, feature_blobs(X), nodes)],
+        )
+    return {
+        serial: (previous[serial], node)
+        for serial, node in zip(serials, nodes)
+        if serial in previous and previous[serial] != node
+    }
+
+
+def main(n_drives: int = 200_000, change_rate: float = 0.02, days: int = 3):
+    loaded = load_model(DEFAULT_PARAMS["long-term"])
+    model = loaded.model
+    drives = random_fleet(n_drives, models={"long-term": load_models()["long-term"]})
+    serials = [drive.serial for drive in drives]
+    X = model.feature_matrix([parse_smartctl(smartctl_text(drive)) for drive in drives])
+    rng = np.random.default_rng(0)
+    # the nodes of the previous day's sweep
+    previous_nodes = None
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        full = DriveStateStore(Path(tmpdir) / "full.sqlite")
+        print(f"{n_drives} drives, {change_rate:.1%} changing per day")
+        print(f"{'day':<5} {'full':>9} {'incremental':>12} {'evaluated':>10} {'moved':>7}")
+        for day in range(days):
+            if day:
+                changed = rng.choice(n_drives, size=int(n_drives * change_rate), replace=False)
+                X = X.copy()
+                X[changed] = X[rng.integers(0, n_drives, size=len(changed))]
+            expected = model.predict_batch(X).node
+
+            start = time.perf_counter()
+            moved_full = full_sweep(full, loaded, serials, X)
+            full_elapsed = time.perf_counter() - start
+
+            # reopened every day, as a daily job would, so reading the stored state is part of the sweep
+            start = time.perf_counter()
+            with DriveStateStore(Path(tmpdir) / "incremental.sqlite") as incremental:
+                result = incremental.rescore(loaded, serials, X)
+            incremental_elapsed = time.perf_counter() - start
+
+            if day:
+                moved = {serials[i] for i in np.flatnonzero(expected != previous_nodes)}
+                assert set(result.moved) == set(moved_full) == moved, "moved drives differ"
+            assert all(result.evaluated[serials[i]] == expected[i] for i in range(n_drives)
+                       if serials[i] in result.evaluated), "evaluated nodes differ"
+            previous_nodes = expected
+            print(f"{day:<5} {full_elapsed:8.3f}s {incremental_elapsed:11.3f}s {len(result.evaluated):>10} "
+                  f"{len(result.moved):>7}")
+        full.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-drives", type=int, default=200_000)
+    parser.add_argument("--change-rate", type=float, default=0.02, help="share of drives changing per day")
+    parser.add_argument("--days", type=int, default=3)
+    args = parser.parse_args()
+    main(args.n_drives, args.change_rate, args.days)
@@ -0,0 +1,264 @@
+"""A synthetic fleet of drives for the benchmarks.
+
+Each drive's SMART values are drawn so that it lands in a chosen leaf of one of the shipped trees: the path from the
+root to the leaf gives an interval per split feature, a value is drawn from each interval, and the remaining
+attributes get values typical of healthy and ageing drives. Drives are assigned leaves round robin over every leaf
+of every tree, so any fleet at least as large as the total number of leaves reaches all of them.
+
+The drives can be rendered as ``smartctl -A`` text (default and brief layouts), ``smartctl -A -j`` documents and
+Backblaze daily CSV rows. Run ``python benchmarks/fleet.py`` to print the leaf coverage of a fleet.
+"""
+import csv
+import math
+import random
+from dataclasses import dataclass, field
+
+from hdd_lifetime_prediction import TreeModel
+from hdd_lifetime_prediction.model.engine import DEFAULT_PARAMS
+from hdd_lifetime_prediction.model.smartctl import split_feature_name
+
+PREAMBLE = """smartctl 7.2 2020-12-30 r5155 [x86_64-linux-5.15.0-130-generic] (local build)
+Copyright (C) 2002-20, Bruce Allen, Christian Franke, www.smartmontools.org
+
+=== START OF READ SMART DATA SECTION ===
+SMART Attributes Data Structure revision number: 10
+Vendor Specific SMART Attributes with Thresholds:
+"""
+# the two layouts smartctl emits: the default one, and the one from `smartctl -A -f brief`
+HEADER = "ID# ATTRIBUTE_NAME          FLAG     VALUE WORST THRESH TYPE      UPDATED  WHEN_FAILED RAW_VALUE"
+BRIEF_HEADER = "ID# ATTRIBUTE_NAME          FLAGS    VALUE WORST THRESH FAIL RAW_VALUE"
+BRIEF_FOOTER = """                            ||||||_ K auto-keep
+                            |||||__ C event count
+                            ||||___ R error rate
+                            |||____ S speed/performance
+                            ||_____ O updated online
+                            |______ P prefailure warning
+"""
+
+# id, name, flag, brief flags, type, updated
+ATTRIBUTES = [
+    ("1", "Raw_Read_Error_Rate", "0x000f", "POSR--", "Pre-fail", "Always"),
+    ("3", "Spin_Up_Time", "0x0003", "PO----", "Pre-fail", "Always"),
+    ("4", "Start_Stop_Count", "0x0032", "-O--CK", "Old_age", "Always"),
+    ("5", "Reallocated_Sector_Ct", "0x0033", "PO--CK", "Pre-fail", "Always"),
+    ("7", "Seek_Error_Rate", "0x000f", "POSR--", "Pre-fail", "Always"),
+    ("9", "Power_On_Hours", "0x0032", "-O--CK", "Old_age", "Always"),
+    ("10", "Spin_Retry_Count", "0x0013", "PO--C-", "Pre-fail", "Always"),
+    ("12", "Power_Cycle_Count", "0x0032", "-O--CK", "Old_age", "Always"),
+    ("184", "End-to-End_Error", "0x0032", "-O--CK", "Old_age", "Always"),
+    ("187", "Reported_Uncorrect", "0x0032", "-O--CK", "Old_age", "Always"),
+    ("188", "Command_Timeout", "0x0032", "-O--CK", "Old_age", "Always"),
+    ("189", "High_Fly_Writes", "0x003a", "-O-RCK", "Old_age", "Always"),
+    ("190", "Airflow_Temperature_Cel", "0x0022", "-O---K", "Old_age", "Always"),
+    ("191", "G-Sense_Error_Rate", "0x0032", "-O--CK", "Old_age", "Always"),
+    ("192", "Power-Off_Retract_Count", "0x0032", "-O--CK", "Old_age", "Always"),
+    ("193", "Load_Cycle_Count", "0x0032", "-O--CK", "Old_age", "Always"),
+    ("194", "Temperature_Celsius", "0x0022", "-O---K", "Old_age", "Always"),
+    ("197", "Current_Pending_Sector", "0x0012", "-O--C-", "Old_age", "Always"),
+    ("198", "Offline_Uncorrectable", "0x0010", "----C-", "Old_age", "Offline"),
+    ("199", "UDMA_CRC_Error_Count", "0x003e", "-OSRCK", "Old_age", "Always"),
+]
+TEMPERATURE_ATTRIBUTES = ("190", "194")
+DRIVE_MODELS = ("ST4000DM000", "ST8000NM0055", "ST12000NM0008", "HGST HMS5C4040BLE640", "TOSHIBA MG07ACA14TA")
+# how far past its last threshold an unbounded value is drawn, by column
+SPREAD = {"raw_value": 10**6, "normalized_value": 20}
+
+
+@dataclass
+class Drive:
+    """One drive of the fleet. ``attributes`` maps SMART ids to ``(value, worst, raw)`` and ``target`` is the
+    ``(tree name, leaf node id)`` the values were drawn for."""
+    serial: str
+    model: str
+    attributes: dict[str, tuple[int, int, int]] = field(default_factory=dict)
+    target: tuple[str, int] | None = None
+
+    def raw_string(self, attr_id: str) -> str:
+        value, worst, raw = self.attributes[attr_id]
+        if attr_id in TEMPERATURE_ATTRIBUTES:
+            return f"{raw} (Min/Max {max(raw - 8, 0)}/{raw + 6})"
+        return str(raw)
+
+
+def random_values(rng: random.Random, attr_id: str) -> tuple[int, int, int]:
+    """(value, worst, raw) for an attribute, roughly as healthy and ageing drives report them."""
+    value = rng.randint(80, 100)
+    worst = rng.randint(min(value, 60), value)
+    if attr_id in ("5", "187", "197", "198"):
+        raw = rng.choice([0, 0, 0, 0, 1, 8, 120, 4000])
+        if attr_id == "187":
+            value = worst = max(1, 100 - raw)
+    elif attr_id in ("1", "7"):
+        raw = rng.randint(0, 10**9)
+    elif attr_id in TEMPERATURE_ATTRIBUTES:
+        raw = rng.randint(20, 50)
+        value = worst = 100 - raw
+    else:
+        raw = rng.randint(0, 70000)
+    return value, worst, raw
+
+
+def leaf_intervals(model: TreeModel) -> dict[int, dict[str, tuple[float, float]]]:
+    """For every leaf, the ``[low, high)`` interval of each split feature on the path to it, by leaf node id."""
+    intervals = {}
+    stack = [(1, {})]
+    while stack:
+        node_id, bounds = stack.pop()
+        node = model.config[node_id]
+        if node.split_feature is None:
+            intervals[node_id] = bounds
+            continue
+        low, high = bounds.get(node.split_feature, (-math.inf, math.inf))
+        stack.append((node.lower_node, {**bounds, node.split_feature: (low, min(high, node.split_threshold))}))
+        stack.append((node.upper_node, {**bounds, node.split_feature: (max(low, node.split_threshold), high)}))
+    return intervals
+
+
+def draw(rng: random.Random, low: float, high: float, spread: int, floor: int = 0, ceiling: float = math.inf) -> int:
+    """An integer ``v`` with ``low <= v < high``, clipped to ``[floor, ceiling]``."""
+    first = max(floor, math.ceil(low) if low > -math.inf else floor)
+    last = math.ceil(high) - 1 if high < math.inf else first + spread
+    return rng.randint(first, max(first, min(last, ceiling)))
+
+
+def drive_for_leaf(rng: random.Random, serial: str, bounds: dict[str, tuple[float, float]],
+                   target: tuple[str, int] | None = None) -> Drive:
+    """A drive whose split features fall within ``bounds``; every other attribute is random."""
+    drive = Drive(serial=serial, model=rng.choice(DRIVE_MODELS), target=target)
+    for attr_id, *_ in ATTRIBUTES:
+        drive.attributes[attr_id] = random_values(rng, attr_id)
+    for name, (low, high) in bounds.items():
+        attr_id, key = split_feature_name(name)
+        value, worst, raw = drive.attributes[attr_id]
+        if key == "raw_value":
+            raw = draw(rng, low, high, SPREAD[key])
+        else:
+            value = draw(rng, low, high, SPREAD[key], floor=1, ceiling=253)
+            worst = min(worst, value)
+        drive.attributes[attr_id] = (value, worst, raw)
+    return drive
+
+
+def load_models() -> dict[str, TreeModel]:
+    return {name: TreeModel(path) for name, path in DEFAULT_PARAMS.items()}
+
+
+def random_fleet(n: int, seed: int = 0, models: dict[str, TreeModel] | None = None,
+                 missing_rate: float = 0.02) -> list[Drive]:
+    """``n`` drives covering the leaves of ``models`` (the shipped trees by default) round robin.
+
+    A ``missing_rate`` share of the drives lacks one of its attributes, so the fleet also exercises walks that stop
+    early at an inner node.
+    """
+    rng = random.Random(seed)
+    models = models if models is not None else load_models()
+    leaves = [
+        ((name, leaf), bounds)
+        for name, model in models.items()
+        for leaf, bounds in sorted(leaf_intervals(model).items())
+    ]
+    drives = []
+    for i in range(n):
+        target, bounds = leaves[i % len(leaves)]
+        drive = drive_for_leaf(rng, f"ZA{seed:02d}{i:07d}", bounds, target)
+        if rng.random() < missing_rate:
+            del drive.attributes[rng.choice(list(drive.attributes))]
+        drives.append(drive)
+    rng.shuffle(drives)
+    return drives
+
+
+def smartctl_text(drive: Drive, brief: bool = False) -> str:
+    """The drive as ``smartctl -A`` prints it, or ``smartctl -A -f brief`` with ``brief``."""
+    lines = [BRIEF_HEADER if brief else HEADER]
+    for attr_id, name, flag, brief_flags, kind, updated in ATTRIBUTES:
+        if attr_id not in drive.attributes:
+            continue
+        value, worst, _ = drive.attributes[attr_id]
+        raw = drive.raw_string(attr_id)
+        if brief:
+            lines.append(f"{attr_id:>3} {name:<23} {brief_flags}   {value:03d}   {worst:03d}   000    -    {raw}")
+        else:
+            lines.append(
+                f"{attr_id:>3} {name:<23} {flag}   {value:03d}   {worst:03d}   000    {kind:<9} {updated:<8}     -"
+                f"       {raw}"
+            )
+    return PREAMBLE + "\n".join(lines) + "\n" + (BRIEF_FOOTER if brief else "") + "\n"
+
+
+def smartctl_json(drive: Drive) -> dict:
+    """The drive as a ``smartctl -A -j`` document, as smartmontools 7 emits it."""
+    table = []
+    for attr_id, name, flag, brief_flags, kind, updated in ATTRIBUTES:
+        if attr_id not in drive.attributes:
+            continue
+        value, worst, raw = drive.attributes[attr_id]
+        table.append({
+            "id": int(attr_id),
+            "name": name,
+            "value": value,
+            "worst": worst,
+            "thresh": 0,
+            "when_failed": "",
+            "flags": {"value": int(flag, 16), "string": brief_flags + " ", "prefailure": kind == "Pre-fail"},
+            "raw": {"value": raw, "string": drive.raw_string(attr_id)},
+        })
+    return {
+        "json_format_version": [1, 0],
+        "smartctl": {"version": [7, 2], "exit_status": 0},
+        "device": {"name": f"/dev/disk/by-id/ata-{drive.serial}", "type": "sat", "protocol": "ATA"},
+        "model_name": drive.model,
+        "serial_number": drive.serial,
+        "ata_smart_attributes": {"revision": 10, "table": table},
+    }
+
+
+BACKBLAZE_COLUMNS = ["date", "serial_number", "model", "capacity_bytes", "failure"] + [
+    f"smart_{attr_id}_{column}" for attr_id, *_ in ATTRIBUTES for column in ("normalized", "raw")
+]
+
+
+def backblaze_row(drive: Drive, date: str = "2024-01-01") -> list[str]:
+    """The drive as a row of a Backblaze daily CSV with ``BACKBLAZE_COLUMNS``. Missing attributes are empty."""
+    row = [date, drive.serial, drive.model, "4000787030016", "0"]
+    for attr_id, *_ in ATTRIBUTES:
+        if attr_id in drive.attributes:
+            value, _, raw = drive.attributes[attr_id]
+            row += [str(value), str(raw)]
+        else:
+            row += ["", ""]
+    return row
+
+
+def write_backblaze_csv(path, drives, date: str = "2024-01-01"):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(BACKBLAZE_COLUMNS)
+        writer.writerows(backblaze_row(drive, date) for drive in drives)
+
+
+def random_dumps(n: int, seed: int = 0) -> list[str]:
+    """``smartctl -A`` text for ``n`` drives of a fleet, a quarter of them in the brief layout."""
+    rng = random.Random(seed)
+    return [smartctl_text(drive, brief=rng.random() < 0.25) for drive in random_fleet(n, seed)]
+
+
+def coverage(drives, models: dict[str, TreeModel]) -> dict[str, tuple[int, int]]:
+    """``(leaves reached, leaves)`` per tree when the drives' text dumps are parsed and predicted."""
+    from hdd_lifetime_prediction import parse_smartctl
+
+    reached = {name: set() for name in models}
+    for drive in drives:
+        smart_attributes = parse_smartctl(smartctl_text(drive))
+        for name, model in models.items():
+            node_id = model.predict_node_id(model.project(smart_attributes))
+            if model.config[node_id].split_feature is None:
+                reached[name].add(node_id)
+    return {name: (len(reached[name]), len(leaf_intervals(model))) for name, model in models.items()}
+
+
+if __name__ == "__main__":
+    models = load_models()
+    n_leaves = sum(len(leaf_intervals(model)) for model in models.values())
+    for name, (hit, total) in coverage(random_fleet(n_leaves, models=models, missing_rate=0), models).items():
+        print(f"{name}: {hit}/{total} leaves")
@@ -0,0 +1,288 @@
+"""The benchmark suite: parsing, attribute lookup, prediction, model loading and the Flask endpoints end-to-end.
+
+Run with ``python benchmarks/run.py [-o results.json] [--compare baseline.json] [-k substring]``. Every benchmark
+runs over the same synthetic fleet (see ``fleet``), which reaches every leaf of both shipped trees.
+
+Times are per item (a dump, a drive, a request, a load) and are written as JSON with ``-o``. With ``--compare``, the
+best time of each benchmark is checked against a previous results file and the run exits with status 1 when any is
+slower by more than ``--tolerance``, so a dependency upgrade can be checked by running the suite before and after.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from functools import cached_property
+from importlib.metadata import version
+from pathlib import Path
+
+from hdd_lifetime_prediction import parse_smartctl, parse_smartctl_json, predict_batch, MultiModelEngine, TreeModel
+from hdd_lifetime_prediction.model.build import binary_path
+from hdd_lifetime_prediction.model.engine import DEFAULT_PARAMS
+from hdd_lifetime_prediction.model.registry import load_model
+
+from fleet import random_fleet, smartctl_json, smartctl_text, write_backblaze_csv
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, per: str):
+    """Register ``setup(fleet) -> (func, n_items)`` under ``name``. ``func`` is timed, and its time is divided by the
+    ``n_items`` ``per`` units it processes."""
+    def register(setup):
+        BENCHMARKS[name] = (setup, per)
+        return setup
+    return register
+
+
+class Fleet:
+    """The inputs shared by the benchmarks, each built on first use."""
+
+    def __init__(self, n_drives: int, seed: int, tmpdir: Path):
+        self.n_drives = n_drives
+        self.seed = seed
+        self.tmpdir = tmpdir
+
+    @cached_property
+    def models(self) -> dict[str, TreeModel]:
+        return {name: TreeModel(path) for name, path in DEFAULT_PARAMS.items()}
+
+    @cached_property
+    def drives(self):
+        return random_fleet(self.n_drives, self.seed, self.models)
+
+    @cached_property
+    def texts(self) -> list[str]:
+        return [smartctl_text(drive) for drive in self.drives]
+
+    @cached_property
+    def brief_texts(self) -> list[str]:
+        return [smartctl_text(drive, brief=True) for drive in self.drives]
+
+    @cached_property
+    def json_texts(self) -> list[str]:
+        return [json.dumps(smartctl_json(drive)) for drive in self.drives]
+
+    @cached_property
+    def parsed(self):
+        return [parse_smartctl(text) for text in self.texts]
+
+    @cached_property
+    def client(self):
+        from hdd_lifetime_prediction.app.app import app
+        return app.test_client()
+
+
+for layout in ("text", "brief", "json"):
+    @benchmark(f"parse_smartctl[{layout}]", per="dump")
+    def _(fleet, layout=layout):
+        if layout == "json":
+            return (lambda: [parse_smartctl_json(doc) for doc in fleet.json_texts]), fleet.n_drives
+        texts = fleet.brief_texts if layout == "brief" else fleet.texts
+        return (lambda: [parse_smartctl(text) for text in texts]), fleet.n_drives
+
+
+for tree in DEFAULT_PARAMS:
+    @benchmark(f"get_attribute[{tree}]", per="drive")
+    def _(fleet, tree=tree):
+        model = fleet.models[tree]
+        names = model.feature_names
+        return (lambda: [model.get_attribute(name, sa) for sa in fleet.parsed for name in names]), fleet.n_drives
+
+    @benchmark(f"predict[{tree}]", per="drive")
+    def _(fleet, tree=tree):
+        model = fleet.models[tree]
+        return (lambda: [model.predict(sa) for sa in fleet.parsed]), fleet.n_drives
+
+    @benchmark(f"predict_full[{tree}]", per="drive")
+    def _(fleet, tree=tree):
+        model = fleet.models[tree]
+        return (lambda: [model.predict_full(sa) for sa in fleet.parsed]), fleet.n_drives
+
+    @benchmark(f"predict_batch[{tree}]", per="drive")
+    def _(fleet, tree=tree):
+        model = fleet.models[tree]
+        return (lambda: predict_batch(fleet.parsed, model)), fleet.n_drives
+
+    @benchmark(f"codegen.scalar[{tree}]", per="drive")
+    def _(fleet, tree=tree):
+        generated = fleet.models[tree].generated
+        return (lambda: [generated.node_id_from_attributes(sa.by_id) for sa in fleet.parsed]), fleet.n_drives
+
+    @benchmark(f"codegen.batch[{tree}]", per="drive")
+    def _(fleet, tree=tree):
+        model = fleet.models[tree]
+        X = model.feature_matrix(fleet.parsed)
+        return (lambda: model.generated.predict_batch(X)), fleet.n_drives
+
+    @benchmark(f"load[{tree}.yaml]", per="load")
+    def _(fleet, tree=tree):
+        return (lambda: [TreeModel(DEFAULT_PARAMS[tree]) for _ in range(10)]), 10
+
+    @benchmark(f"load[{tree}.bin]", per="load")
+    def _(fleet, tree=tree):
+        path = binary_path(DEFAULT_PARAMS[tree])
+        return (lambda: [TreeModel.from_binary(path) for _ in range(10)]), 10
+
+    @benchmark(f"load_model[{tree}]", per="load")
+    def _(fleet, tree=tree):
+        return (lambda: [load_model(DEFAULT_PARAMS[tree]) for _ in range(10)]), 10
+
+
+@benchmark("engine.predict_full", per="drive")
+def _(fleet):
+    engine = MultiModelEngine(fleet.models)
+    return (lambda: [engine.predict_full(sa) for sa in fleet.parsed]), fleet.n_drives
+
+
+def posts(client, path: str, bodies, content_type: str):
+    def post_all():
+        from hdd_lifetime_prediction.app.app import response_cache
+        response_cache.clear()
+        for body in bodies:
+            response = client.post(path, data=body, content_type=content_type)
+            assert response.status_code == 200, response.get_data(as_text=True)
+    return post_all
+
+
+@benchmark("endpoint.single[text]", per="request")
+def _(fleet):
+    return posts(fleet.client, "/hdd-lifetime-prediction/", fleet.texts, "text/plain"), fleet.n_drives
+
+
+@benchmark("endpoint.single[json]", per="request")
+def _(fleet):
+    return posts(fleet.client, "/hdd-lifetime-prediction/", fleet.json_texts, "application/json"), fleet.n_drives
+
+
+@benchmark("endpoint.combined[text]", per="request")
+def _(fleet):
+    return posts(fleet.client, "/hdd-lifetime-prediction/combined/", fleet.texts, "text/plain"), fleet.n_drives
+
+
+@benchmark("endpoint.batch[text]", per="drive")
+def _(fleet):
+    body = "".join(f"==> /dev/sd{i} <==\n{text}\n" for i, text in enumerate(fleet.texts))
+    return posts(fleet.client, "/hdd-lifetime-prediction/batch/", [body], "text/plain"), fleet.n_drives
+
+
+@benchmark("endpoint.batch[json]", per="drive")
+def _(fleet):
+    body = "[" + ",".join(fleet.json_texts) + "]"
+    return posts(fleet.client, "/hdd-lifetime-prediction/batch/", [body], "application/json"), fleet.n_drives
+
+
+@benchmark("endpoint.stream[ndjson]", per="drive")
+def _(fleet):
+    body = "".join(text + "\n" for text in fleet.json_texts)
+
+    def stream():
+        response = fleet.client.post("/hdd-lifetime-prediction/stream/", data=body,
+                                     content_type="application/x-ndjson")
+        assert response.get_data().count(b"\n") == fleet.n_drives
+    return stream, fleet.n_drives
+
+
+@benchmark("backblaze.score_file", per="row")
+def _(fleet):
+    from hdd_lifetime_prediction.fleet.backblaze import score_file
+
+    # repeat the fleet so the file is large enough for per-row costs to dominate
+    path = fleet.tmpdir / "2024-01-01.csv"
+    write_backblaze_csv(path, fleet.drives * 20)
+    n_rows = len(fleet.drives) * 20
+    return (lambda: score_file(path, fleet.tmpdir / "scored.csv", DEFAULT_PARAMS["long-term"])), n_rows
+
+
+def measure(func, n_items: int, repeat: int) -> dict:
+    """Run ``func`` once to warm up, then ``repeat`` more times, and summarise the seconds per item."""
+    func()
+    times = [t / n_items for t in timeit.repeat(func, number=1, repeat=repeat)]
+    return {
+        "n_items": n_items,
+        "repeat": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        **{package: version(package) for package in ("numpy", "flask", "werkzeug", "pyyaml")},
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """The benchmarks whose best time is more than ``tolerance`` (a fraction) slower than in ``baseline``."""
+    regressions = []
+    print(f"\n{'benchmark':<32} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["min"] / baseline[name]["min"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<32} {baseline[name]['min'] * 1e6:10.2f}us {result['min'] * 1e6:10.2f}us {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", type=Path, help="write the results as JSON to this file")
+    parser.add_argument("--compare", type=Path, help="a results file from an earlier run to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="how much slower than the baseline counts as a regression (default: 0.2, i.e. 20%%)")
+    parser.add_argument("-k", "--filter", default="", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--n-drives", type=int, default=1000, help="fleet size (default: 1000)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark (default: 5)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    results = {}
+    print(f"{'benchmark':<32} {'min':>12} {'median':>12}")
+    with tempfile.TemporaryDirectory(prefix="hdd-lifetime-bench-") as tmpdir:
+        fleet = Fleet(args.n_drives, args.seed, Path(tmpdir))
+        for name in names:
+            setup, per = BENCHMARKS[name]
+            func, n_items = setup(fleet)
+            results[name] = {"per": per, **measure(func, n_items, args.repeat)}
+            print(f"{name:<32} {results[name]['min'] * 1e6:10.2f}us {results[name]['median'] * 1e6:10.2f}us /{per}")
+
+    if args.output:
+        report = {"environment": environment(), "n_drives": args.n_drives, "seed": args.seed, "results": results}
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text())["results"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
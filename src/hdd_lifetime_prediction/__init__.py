@@ -1,12 +1,31 @@
-from .model.infer import predict_lifetime, predict_full
-from .model.model import TreeModel
-from .model.smartctl import parse_smartctl
+from . import model, utils  # noqa: F401 (both are cheap to import, and stay attributes of the package)
+from .utils.lazy import lazy_exports
+
+# as typing.TYPE_CHECKING, which type checkers recognise under this name, without importing typing
+TYPE_CHECKING = False
 
 __version__ = "0.1.0"
 
-__all__ = [
-    "TreeModel",
-    "parse_smartctl",
-    "predict_full",
-    "predict_lifetime",
-]
+# the public names and the modules defining them. They are imported on first use (PEP 562), so importing the
+# package, or a lightweight module of it such as ``cli``, does not load NumPy and PyYAML.
+_EXPORTS = {
+    "BatchPrediction": ".model.compiled",
+    "MultiModelEngine": ".model.engine",
+    "TreeModel": ".model.model",
+    "parse_smartctl": ".model.smartctl",
+    "parse_smartctl_json": ".model.smartctl",
+    "predict_batch": ".model.infer",
+    "predict_full": ".model.infer",
+    "predict_lifetime": ".model.infer",
+}
+
+__all__ = sorted(_EXPORTS)
+
+if TYPE_CHECKING:
+    from .model.compiled import BatchPrediction  # noqa: F401
+    from .model.engine import MultiModelEngine  # noqa: F401
+    from .model.infer import predict_batch, predict_full, predict_lifetime  # noqa: F401
+    from .model.model import TreeModel  # noqa: F401
+    from .model.smartctl import parse_smartctl, parse_smartctl_json  # noqa: F401
+
+__getattr__, __dir__ = lazy_exports(globals(), _EXPORTS)
@@ -1,29 +1,433 @@
-from flask import Flask, request, jsonify
+import json
+import os
+from dataclasses import asdict
+from time import perf_counter
+
+from flask import Flask, g, request, jsonify, stream_with_context
 from importlib.resources import files
-from hdd_lifetime_prediction import parse_smartctl, TreeModel, predict_lifetime, predict_full
+from hdd_lifetime_prediction import parse_smartctl, predict_full
+from hdd_lifetime_prediction.app.cache import ResponseCache
+from hdd_lifetime_prediction.fleet.aggregate import DEFAULT_PERCENTILES, Fleet
+from hdd_lifetime_prediction.model.engine import DEFAULT_PARAMS as ENGINE_PARAMS, MultiModelEngine
+from hdd_lifetime_prediction.model.infer import batch_results
+from hdd_lifetime_prediction.model.registry import registry
+from hdd_lifetime_prediction.model.smartctl import (
+    iter_smartctl_json, parse_smartctl_json, smartctl_json_key, split_smartctl_documents
+)
+from hdd_lifetime_prediction.utils import metrics
+from hdd_lifetime_prediction.utils.metrics import ERRORS, REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, Family
 
 app = Flask(__name__)
 
+LONG_TERM_PARAMS = files('hdd_lifetime_prediction.model').joinpath("long-term-params.yaml")
+
+# single-drive responses, serialized exactly as jsonify would
+response_cache = ResponseCache(
+    lambda payload: app.json.response(payload).get_data(),
+    maxsize=int(os.environ.get("HDD_LIFETIME_RESPONSE_CACHE_SIZE", 4096)),
+)
+
+
+def route() -> str:
+    """The route of the current request, as used to label its metrics."""
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def count_error(error: Exception, endpoint: str | None = None):
+    ERRORS.inc((endpoint or route(), type(error).__name__))
+
+
+@app.before_request
+def start_stopwatch():
+    # views time their stages with ``g.stopwatch.lap(stage)``, each lap ending the stage
+    g.stopwatch = STAGE_SECONDS.stopwatch((route(),) if metrics.ENABLED else ())
+
+
+@app.after_request
+def record_request(response):
+    stopwatch = g.get("stopwatch")
+    if stopwatch is not None and stopwatch.recording:
+        stopwatch.stop()
+        endpoint = stopwatch.labels[0]
+        REQUEST_SECONDS.observe(perf_counter() - stopwatch.start, (endpoint,))
+        REQUESTS.inc((endpoint, str(response.status_code)))
+    return response
+
+
 @app.route('/hdd-lifetime-prediction/', methods=['POST'])
 def predict():
-    smart_output = request.data.decode('utf-8')
+    stopwatch = g.stopwatch
+    try:
+        is_json = request.mimetype == "application/json"
+        data = request.get_data() if is_json else request.data.decode('utf-8')
+        stopwatch.lap("decode")
+        smart_attributes = parse_smartctl_json(data) if is_json else parse_smartctl(data)
+        stopwatch.lap("parse")
+        loaded = registry.get(LONG_TERM_PARAMS)
+        stopwatch.lap("load")
+        body = response_cache.response(loaded, smart_attributes)
+        stopwatch.lap("predict")
+        response = app.response_class(body, mimetype=app.json.mimetype, headers={"X-Model-Version": loaded.version})
+        stopwatch.lap("serialize")
+        return response
+
+    except Exception as e:
+        count_error(e)
+        return jsonify({"error": str(e)}), 400
+
+
+_engine = (None, None)
+
 
+def combined_engine() -> tuple[MultiModelEngine, str]:
+    """The engine over the shipped trees and its version, rebuilt only when the registry reloads a tree."""
+    global _engine
+    loaded = {name: registry.get(path) for name, path in ENGINE_PARAMS.items()}
+    version = ",".join(m.version for m in loaded.values())
+    engine, engine_version = _engine
+    if engine_version != version:
+        engine = MultiModelEngine({name: m.model for name, m in loaded.items()})
+        _engine = (engine, version)
+    return engine, version
+
+
+@app.route('/hdd-lifetime-prediction/combined/', methods=['POST'])
+def predict_combined():
+    """Like the single-drive endpoint, with the prediction of every shipped tree keyed by tree name."""
+    stopwatch = g.stopwatch
     try:
-        smart_attributes = parse_smartctl(smart_output)
-        model = TreeModel(
-            files('hdd_lifetime_prediction.model').joinpath("long-term-params.yaml")
-        )
-        predicted_lifetime = predict_lifetime(smart_attributes, model)
-        prediction_stats = predict_full(smart_attributes, model)
-
-        response = {
-            "predicted_lifetime": predicted_lifetime,
-            "predicted_stats": prediction_stats
-        }
-        return jsonify(response)
+        is_json = request.mimetype == "application/json"
+        data = request.get_data() if is_json else request.data.decode('utf-8')
+        stopwatch.lap("decode")
+        smart_attributes = parse_smartctl_json(data) if is_json else parse_smartctl(data)
+        stopwatch.lap("parse")
+        engine, version = combined_engine()
+        stopwatch.lap("load")
+        nodes = engine.predict_full(smart_attributes)
+        stopwatch.lap("predict")
+        response = jsonify({
+            name: {"predicted_lifetime": node.expected_lifetime, "predicted_stats": node}
+            for name, node in nodes.items()
+        })
+        stopwatch.lap("serialize")
+        return response, {"X-Model-Version": version}
 
     except Exception as e:
-        return jsonify({"error": e}), 400
+        count_error(e)
+        return jsonify({"error": str(e)}), 400
+
+
+def is_smartctl_json(document) -> bool:
+    return isinstance(document, dict) and ("json_format_version" in document or "ata_smart_attributes" in document)
+
+
+def iter_batch_documents():
+    """Decode a batch request body into ``(drive key, smartctl output)`` pairs.
+
+    The smartctl output is either text, or a decoded ``smartctl -A -j`` document. Accepted bodies, by Content-Type:
+        application/json or application/x-ndjson: one or more JSON values, as an array or one after another. Each is
+            a smartctl JSON document keyed by its serial number or device path, an ``{"id": ..., "smartctl": ...}``
+            record, or an object mapping drive keys to smartctl outputs.
+        anything else: concatenated smartctl text outputs, each introduced by a ``==> key <==`` line.
+
+    A JSON value that cannot be decoded, or is not one of the above, is yielded keyed by its position in the body with
+    the ``ValueError`` in place of its output, so that it is reported with the other drives that could not be scored.
+    """
+    if request.mimetype not in ("application/json", "application/x-ndjson"):
+        yield from split_smartctl_documents(request.get_data(as_text=True)).items()
+        return
+
+    for i, document in enumerate(iter_smartctl_json(request.stream, skip_invalid=True)):
+        if isinstance(document, ValueError):
+            yield str(i), document
+            continue
+        try:
+            record = record_document(document, str(i))
+        except ValueError as e:
+            yield str(i), e
+            continue
+        if record is None:
+            yield from document.items()
+        else:
+            yield record
+
+
+def record_document(record, default_key: str) -> tuple[str, str | dict] | None:
+    """``(drive key, smartctl output)`` for a smartctl JSON document or an ``{"id": ..., "smartctl": ...}`` record.
+
+    Returns None for any other JSON object.
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f"Expected a JSON object, got {type(record).__name__}")
+    if is_smartctl_json(record):
+        return smartctl_json_key(record, default_key), record
+    if "id" in record and "smartctl" in record:
+        return str(record["id"]), record["smartctl"]
+    return None
+
+
+def check_output(document) -> str | dict:
+    """``document`` if it is smartctl output, as text or a JSON object, else raises ValueError."""
+    if isinstance(document, ValueError):
+        raise document
+    if not isinstance(document, (str, dict)):
+        raise ValueError(f"Expected smartctl output as text or a JSON object, got {type(document).__name__}")
+    return document
+
+
+def document_features(model, document):
+    if isinstance(check_output(document), dict):
+        return model.features_from_json(document)
+    return model.features(parse_smartctl(document))
+
+
+@app.route('/hdd-lifetime-prediction/batch/', methods=['POST'])
+def predict_many():
+    stopwatch = g.stopwatch
+    loaded = registry.get(LONG_TERM_PARAMS)
+    model = loaded.model
+    stopwatch.lap("load")
+
+    # Reduce each document to its feature row as soon as it is decoded, so only the rows are kept. Decoding happens
+    # lazily in the loop, so the decode stage is the time in the loop not spent parsing.
+    features = {}
+    errors = {}
+    parse_seconds = 0.0
+    try:
+        for key, smart_output in iter_batch_documents():
+            parse_start = perf_counter()
+            try:
+                features[key] = document_features(model, smart_output)
+                errors.pop(key, None)
+            except Exception as e:
+                features.pop(key, None)
+                errors[key] = str(e)
+                count_error(e)
+            parse_seconds += perf_counter() - parse_start
+    except Exception as e:
+        count_error(e)
+        return jsonify({"error": str(e)}), 400
+    stopwatch.add("parse", parse_seconds)
+    stopwatch.lap("decode", excluding=parse_seconds)
+    keys = list(features)
+    rows = list(features.values())
+
+    results = {}
+    if rows:
+        prediction = model.predict_batch(rows)
+        stopwatch.lap("predict")
+        results = batch_results(keys, prediction, model)
+
+    response = {
+        "model_version": loaded.version,
+        "results": results,
+        "errors": errors,
+    }
+    response = jsonify(response)
+    stopwatch.lap("serialize")
+    return response, {"X-Model-Version": loaded.version}
+
+
+MAX_RECORD_BYTES = 1 << 20
+# small reads keep latency low: a result is never held back by more than this much unread input
+STREAM_READ_SIZE = 4096
+
+
+def iter_lines(stream, max_bytes: int = MAX_RECORD_BYTES, read_size: int = STREAM_READ_SIZE):
+    """Yield the non-blank lines of a binary stream as they arrive.
+
+    A line longer than ``max_bytes`` is discarded as it is read rather than buffered, and None is yielded in its
+    place.
+    """
+    read = getattr(stream, "read1", stream.read)
+    buffer = bytearray()
+    too_long = False
+    while True:
+        chunk = read(read_size)
+        if not chunk:
+            if too_long:
+                yield None
+            elif buffer.strip():
+                yield bytes(buffer)
+            return
+        # the buffer holds no line break before the new chunk, so only the chunk is searched, and a long line is
+        # scanned once rather than once per read
+        search = len(buffer)
+        buffer += chunk
+        start = 0
+        while (end := buffer.find(b"\n", search)) >= 0:
+            if too_long or end - start > max_bytes:
+                too_long = False
+                yield None
+            elif buffer[start:end].strip():
+                yield bytes(buffer[start:end])
+            start = search = end + 1
+        # deleting from the front of a bytearray does not copy the rest
+        del buffer[:start]
+        if len(buffer) > max_bytes:
+            too_long = True
+            buffer.clear()
+
+
+@app.route('/hdd-lifetime-prediction/stream/', methods=['POST'])
+def predict_stream():
+    """Score a stream of newline delimited records, writing one NDJSON result line per record as it is scored.
+
+    Each record is a smartctl JSON document or an ``{"id": ..., "smartctl": ...}`` record. The body is read one line
+    at a time and the next line is only read once the previous result has been handed to the server, so memory stays
+    bounded and a slow reader slows down the reading of the body. A record that cannot be scored produces an
+    ``{"id": ..., "error": ...}`` line instead, and the stream carries on.
+    """
+    stopwatch = g.stopwatch
+    loaded = registry.get(LONG_TERM_PARAMS)
+    stopwatch.lap("load")
+    stream = request.stream
+    endpoint = route()
+
+    def generate():
+        # the response is streamed after the request has been recorded, so each record gets its own stopwatch
+        for i, line in enumerate(iter_lines(stream)):
+            key = str(i)
+            record_stopwatch = STAGE_SECONDS.stopwatch((endpoint,))
+            try:
+                if line is None:
+                    raise ValueError(f"Record is longer than {MAX_RECORD_BYTES} bytes")
+                record = record_document(json.loads(line), key)
+                if record is None:
+                    raise ValueError("Expected a smartctl JSON document or an {\"id\": ..., \"smartctl\": ...} record")
+                key, smart_output = record
+                record_stopwatch.lap("decode")
+                if isinstance(check_output(smart_output), dict):
+                    smart_attributes = parse_smartctl_json(smart_output)
+                else:
+                    smart_attributes = parse_smartctl(smart_output)
+                record_stopwatch.lap("parse")
+                node = predict_full(smart_attributes, loaded.model)
+                record_stopwatch.lap("predict")
+                result = {"id": key, "predicted_lifetime": node.expected_lifetime, "predicted_stats": asdict(node)}
+            except Exception as e:
+                count_error(e, endpoint)
+                result = {"id": key, "error": str(e)}
+            line = json.dumps(result) + "\n"
+            record_stopwatch.lap("serialize")
+            record_stopwatch.stop()
+            yield line
+
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"X-Model-Version": loaded.version},
+    )
+
+
+# a result file of fleet.backblaze, served by the fleet endpoints
+FLEET_PATH = os.environ.get("HDD_LIFETIME_FLEET")
+FLEET_VIEWS = ("summary", "percentiles", "histogram", "top", "leaves")
+# query arguments of the fleet endpoints that are not filters on a metadata column
+FLEET_ARGUMENTS = ("column", "by", "q", "bins", "k", "largest")
+
+_fleet = (None, None)
+
+
+def scored_fleet() -> Fleet:
+    """The fleet in the file named by HDD_LIFETIME_FLEET, read again only when the file changes."""
+    global _fleet
+    mtime_ns = os.stat(FLEET_PATH).st_mtime_ns
+    fleet, fleet_mtime_ns = _fleet
+    if fleet_mtime_ns != mtime_ns:
+        fleet = Fleet.read(FLEET_PATH)
+        _fleet = (fleet, mtime_ns)
+    return fleet
+
+
+@app.route('/hdd-lifetime-prediction/fleet/<view>', methods=['GET'])
+def fleet_view(view):
+    """Aggregates over the scored fleet, e.g. ``GET /hdd-lifetime-prediction/fleet/summary?by=vendor``.
+
+    Views: ``summary`` and ``percentiles`` (``column``, ``by``, ``q`` as comma separated percentiles), ``histogram``
+    (``column``, ``by``, ``bins``), ``top`` (``column``, ``k``, ``largest``) and ``leaves`` (``by``). Any other query
+    argument selects the drives whose metadata column of that name has one of the comma separated values, e.g.
+    ``vendor=HGST,Toshiba``.
+    """
+    if not FLEET_PATH:
+        return jsonify({"error": "no fleet to aggregate, set HDD_LIFETIME_FLEET to a scored result file"}), 404
+    if view not in FLEET_VIEWS:
+        return jsonify({"error": f"Unknown view {view!r}, expected one of {list(FLEET_VIEWS)}"}), 404
+    stopwatch = g.stopwatch
+    try:
+        fleet = scored_fleet()
+        stopwatch.lap("load")
+        args = request.args
+        filters = {name: value.split(",") for name, value in args.items() if name not in FLEET_ARGUMENTS}
+        if filters:
+            fleet = fleet.where(**filters)
+        by = args.get("by")
+        if view in ("summary", "percentiles"):
+            q = [float(p) for p in args["q"].split(",")] if "q" in args else DEFAULT_PERCENTILES
+            aggregate = getattr(fleet, view)
+            result = aggregate(args.get("column", "expected_lifetime"), by=by, q=q)
+        elif view == "histogram":
+            result = fleet.histogram(args.get("column", "expected_lifetime"), bins=int(args.get("bins", 20)), by=by)
+        elif view == "top":
+            largest = args.get("largest", "0").lower() in ("1", "true")
+            result = fleet.top_k(args.get("column", "lower_lifetime"), k=int(args.get("k", 10)), largest=largest)
+        else:
+            result = fleet.leaf_counts(by=by)
+        stopwatch.lap("aggregate")
+        response = jsonify({"drives": len(fleet), "result": result})
+        stopwatch.lap("serialize")
+        return response
+
+    except (OSError, ValueError) as e:
+        count_error(e)
+        return jsonify({"error": str(e)}), 400
+
+
+def model_metrics() -> list[Family]:
+    """Node and split feature hit counts of the loaded trees, and the response cache statistics."""
+    node_hits, compared, missing = [], [], []
+    for loaded in registry.loaded():
+        model = loaded.model
+        for node_id, hits in sorted(model.node_hits.snapshot().items()):
+            leaf = "true" if model.config[node_id].split_feature is None else "false"
+            node_hits.append(("hdd_lifetime_node_hits_total", {"model": loaded.version, "node": node_id, "leaf": leaf},
+                              hits))
+        compared_hits, missing_hits = model.split_feature_hits()
+        for feature in model.feature_names:
+            labels = {"model": loaded.version, "feature": feature}
+            compared.append(("hdd_lifetime_split_feature_hits_total", labels, compared_hits[feature]))
+            missing.append(("hdd_lifetime_split_feature_missing_total", labels, missing_hits[feature]))
+
+    cache = [
+        ("hdd_lifetime_response_cache_total", {"level": level, "result": result}, value)
+        for (level, result), value in {
+            ("node", "hit"): response_cache.node_hits,
+            ("node", "miss"): response_cache.node_misses,
+            ("features", "hit"): response_cache.feature_hits,
+            ("features", "miss"): response_cache.feature_misses,
+        }.items()
+    ]
+    return [
+        Family("hdd_lifetime_node_hits_total", "Predictions that ended at each node of a tree.", "counter", node_hits),
+        Family("hdd_lifetime_split_feature_hits_total",
+               "Predictions that compared each split feature against a threshold.", "counter", compared),
+        Family("hdd_lifetime_split_feature_missing_total",
+               "Predictions that stopped early because the drive did not report a split feature.", "counter", missing),
+        Family("hdd_lifetime_response_cache_total", "Single-drive response cache lookups.", "counter", cache),
+    ]
+
+
+metrics.registry.add_collector(model_metrics)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """The metrics in the Prometheus text exposition format. 404 when instrumentation is off."""
+    if not metrics.ENABLED:
+        return jsonify({"error": "metrics are disabled, unset HDD_LIFETIME_METRICS=0 to enable them"}), 404
+    return app.response_class(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080, debug=True)
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+
+from hdd_lifetime_prediction.model.registry import LoadedModel
+from hdd_lifetime_prediction.model.smartctl import SMARTAttributes
+
+
+class ResponseCache:
+    """Serialized prediction responses, keyed by the node a drive lands in.
+
+    A response only depends on the node a drive reaches, so each node's response body is serialized once. An
+    optional LRU keyed by the drive's projected feature values (``TreeModel.project``) also skips the traversal for
+    repeat queries. Everything is dropped when the model version changes.
+
+    Args:
+        serialize: turns a response payload into the response body bytes.
+        maxsize: the number of feature tuples kept in the LRU. 0 disables it.
+    """
+
+    def __init__(self, serialize, maxsize: int = 4096):
+        self.serialize = serialize
+        self.maxsize = maxsize
+        self.version = None
+        self._nodes: dict[int, bytes] = {}
+        self._features: OrderedDict[tuple, tuple[int, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.node_hits = self.node_misses = 0
+        self.feature_hits = self.feature_misses = 0
+
+    def clear(self):
+        with self._lock:
+            self._nodes.clear()
+            self._features.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "node_hits": self.node_hits,
+            "node_misses": self.node_misses,
+            "feature_hits": self.feature_hits,
+            "feature_misses": self.feature_misses,
+            "node_entries": len(self._nodes),
+            "feature_entries": len(self._features),
+        }
+
+    def response(self, loaded: LoadedModel, smart_attributes: SMARTAttributes) -> bytes:
+        """The response body for a drive, serialized at most once per node and model version."""
+        with self._lock:
+            if loaded.version != self.version:
+                self._nodes = {}
+                self._features = OrderedDict()
+                self.version = loaded.version
+            # hold on to this version's maps, so a reload during the request cannot mix models
+            nodes, features = self._nodes, self._features
+
+        model = loaded.model
+        values = model.project(smart_attributes)
+        if self.maxsize:
+            with self._lock:
+                cached = features.get(values)
+                if cached is None:
+                    self.feature_misses += 1
+                else:
+                    features.move_to_end(values)
+                    self.feature_hits += 1
+            if cached is not None:
+                node_id, body = cached
+                # the traversal is skipped, but the drive still counts towards the node it lands in
+                model.node_hits.add(node_id)
+                return body
+
+        node_id = model.predict_node_id(values)
+        body = nodes.get(node_id)
+        if body is None:
+            self.node_misses += 1
+            node = model.config[node_id]
+            body = self.serialize({"predicted_lifetime": node.expected_lifetime, "predicted_stats": asdict(node)})
+            nodes[node_id] = body
+        else:
+            self.node_hits += 1
+
+        if self.maxsize:
+            with self._lock:
+                features[values] = (node_id, body)
+                if len(features) > self.maxsize:
+                    features.popitem(last=False)
+        return body
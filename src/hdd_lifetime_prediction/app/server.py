@@ -0,0 +1,403 @@
+"""A pre-forking server for production, in place of Flask's single-process development server.
+
+    python -m hdd_lifetime_prediction.app.server [--bind 0.0.0.0:8080] [-w 4] [--max-requests 10000]
+
+The parent process imports the app and loads the trees (and the scored fleet, if any), then forks the workers, so
+everything is read once and shared copy-on-write. It is frozen out of the garbage collector's reach before forking,
+so collections in the workers do not write to its pages, and the model file is memory-mapped, so the tree arrays are
+shared through the page cache. Each worker serves one request at a time from the listening socket they all inherit,
+so throughput scales with the number of workers up to the number of cores.
+
+A stream request (``POST /hdd-lifetime-prediction/stream/``) holds its connection open for as long as its client
+feeds it, so a worker serves each one on a thread of its own, up to ``--max-streams`` at a time, and carries on with
+other requests; past that, stream requests are answered 503 with a Retry-After header. A worker that is stopped or
+recycled takes no new connections and lets its open streams run for up to ``--graceful-timeout`` seconds, then ends
+them: a stream client should expect its connection to close on a reload and reconnect.
+
+The parent only manages the workers, and answers to signals:
+    SIGHUP: reload the models, then fork fresh workers that share the new models and drain the old ones. The params
+        files are also polled every ``HDD_LIFETIME_MODEL_POLL_INTERVAL`` seconds and reloaded this way when they
+        change, rather than by each worker on its own, which would give every worker a private copy.
+    SIGTERM, SIGINT: stop accepting connections, let the workers finish the requests they are serving (for up to
+        ``--graceful-timeout`` seconds) and exit.
+A worker that has served ``--max-requests`` requests (plus up to 10% more, so that workers do not all recycle at
+once) exits after its current request and is replaced, as is a worker that dies.
+
+Each process writes its metrics to a temporary directory about once a second, and ``/metrics`` adds up those of all
+of them, so it reports the whole server whichever worker answers the scrape. The counts of a worker that exits are
+kept when it is reaped; a worker that has to be killed loses what it recorded since it last wrote them.
+"""
+import argparse
+import gc
+import os
+import random
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from hdd_lifetime_prediction.app.app import FLEET_PATH, LONG_TERM_PARAMS, app, combined_engine, scored_fleet
+from hdd_lifetime_prediction.model import codegen
+from hdd_lifetime_prediction.model.registry import registry
+from hdd_lifetime_prediction.utils import metrics
+
+# how long an idle worker waits for a connection before checking whether it has been asked to stop
+WORKER_POLL_INTERVAL = 0.5
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+PARENT_SIGNALS = (*SHUTDOWN_SIGNALS, signal.SIGHUP, signal.SIGCHLD)
+STREAM_PATH = "/hdd-lifetime-prediction/stream/"
+# the start of the request line of a stream request, whose connection is served on a thread
+STREAM_REQUEST = f"POST {STREAM_PATH}".encode()
+# how long to wait for the rest of a request line that arrives in pieces, before deciding it is not a stream request
+PEEK_TIMEOUT = 1.0
+STREAMS_BUSY = (
+    b"HTTP/1.0 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Type: application/json\r\nConnection: close\r\n"
+    b"\r\n{\"error\": \"too many open streams, retry later\"}\n"
+)
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Serves one request per connection, as a worker serves one connection at a time and an idle kept-alive one
+    would hold it up. The access log line per request costs more than a prediction, so it is left out unless the
+    server asks for it; errors are logged either way."""
+    protocol_version = "HTTP/1.0"
+
+    def log_request(self, code="-", size="-"):
+        if self.server.access_log:
+            super().log_request(code, size)
+
+
+class WorkerServer(BaseWSGIServer):
+    """The WSGI server of one worker, on the listening socket inherited from the parent. Counts the requests served.
+
+    Stream requests are served on threads, at most ``max_streams`` at a time, and any other request in turn on the
+    calling thread.
+    """
+    multiprocess = True
+    multithread = True
+
+    def __init__(self, app, host: str, port: int, fd: int, access_log: bool = False, max_streams: int = 16):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.access_log = access_log
+        self.timeout = WORKER_POLL_INTERVAL
+        self.served = 0
+        self.streams: list[threading.Thread] = []
+        self._stream_slots = threading.BoundedSemaphore(max_streams)
+
+    def process_request(self, request, client_address):
+        if not is_stream(request):
+            super().process_request(request, client_address)
+        elif self._stream_slots.acquire(blocking=False):
+            self.streams = [thread for thread in self.streams if thread.is_alive()]
+            thread = threading.Thread(target=self.process_stream, args=(request, client_address), daemon=True)
+            self.streams.append(thread)
+            thread.start()
+        else:
+            try:
+                request.sendall(STREAMS_BUSY)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            metrics.REQUESTS.inc((STREAM_PATH, "503"))
+        self.served += 1
+
+    def process_stream(self, request, client_address):
+        """Serve a stream connection, on a thread of its own."""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._stream_slots.release()
+
+    def join_streams(self, timeout: float):
+        """Wait up to ``timeout`` seconds for the open streams to end."""
+        deadline = time.monotonic() + timeout
+        for thread in self.streams:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+
+def is_stream(request: socket.socket) -> bool:
+    """Whether a connection carries a stream request, from a peek at its request line, which is left to be read."""
+    deadline = time.monotonic() + PEEK_TIMEOUT
+    while True:
+        try:
+            start = request.recv(len(STREAM_REQUEST), socket.MSG_PEEK)
+        except OSError:
+            return False
+        if len(start) == len(STREAM_REQUEST) or b"\n" in start or not start or time.monotonic() > deadline:
+            return start == STREAM_REQUEST
+        # the request line has only partly arrived
+        time.sleep(0.001)
+
+
+def listen(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    """The listening socket shared by the workers.
+
+    It is non-blocking, so that when several idle workers wake up for one connection, those that lose the race to
+    accept it go back to waiting instead of blocking in ``accept``, where they would not notice being asked to stop.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.create_server((host, port), family=family, backlog=backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def preload():
+    """Load what the workers use in the parent, so that they share it: the trees with their scalar tables (or
+    generated code), the combined engine and the scored fleet."""
+    engine, _ = combined_engine()
+    for model in (registry.get(LONG_TERM_PARAMS).model, *engine.models.values()):
+        model.scalar_tables
+        model._split_path
+        if codegen.ENABLED:
+            model.generated
+    if FLEET_PATH:
+        scored_fleet()
+
+
+class PreforkServer:
+    """Forks worker processes serving a WSGI app from one listening socket, and keeps them running.
+
+    Args:
+        app: the WSGI application.
+        host, port: the address to listen on. Port 0 picks a free port, see ``port`` once ``run`` has started.
+        workers: the number of worker processes.
+        max_requests: the requests a worker serves before it is replaced, 0 for no limit.
+        graceful_timeout: how long a draining worker may take to finish its request, and its open streams, before it
+            is killed.
+        poll_interval: how often the params files are checked for changes, 0 to only reload on SIGHUP.
+        access_log: log a line per request.
+        max_streams: the stream requests a worker serves at a time.
+    """
+
+    def __init__(self, app, host: str = "0.0.0.0", port: int = 8080, workers: int = 4, max_requests: int = 0,
+                 graceful_timeout: float = 30.0, poll_interval: float = 5.0, access_log: bool = False,
+                 max_streams: int = 16):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.n_workers = workers
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.poll_interval = poll_interval
+        self.access_log = access_log
+        self.max_streams = max_streams
+        self.generation = 0
+        # pid -> the generation it was forked in. A reload starts a new generation and drains the older ones
+        self.workers: dict[int, int] = {}
+        # pid -> when it was asked to stop
+        self.draining: dict[int, float] = {}
+        self.socket = None
+        self.shared_metrics = None
+        self._signals = []
+        self._wakeup = None
+
+    def log(self, message: str):
+        print(f"[{os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+    def run(self):
+        """Serve until SIGTERM or SIGINT, then drain the workers."""
+        # the parent polls the params files for the workers, and a watcher thread would not survive the fork anyway
+        registry.poll_interval = 0
+        self.socket = listen(self.host, self.port)
+        self.port = self.socket.getsockname()[1]
+        self.shared_metrics = metrics.SharedMetrics(metrics.registry, tempfile.mkdtemp(prefix="hdd-lifetime-metrics-"))
+        metrics.registry.shared = self.shared_metrics
+        preload()
+        gc.freeze()
+
+        # signals only set flags; the wakeup fd interrupts the wait in the loop below
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            os.set_blocking(fd, False)
+        signal.set_wakeup_fd(self._wakeup[1])
+        for signum in PARENT_SIGNALS:
+            signal.signal(signum, self._on_signal)
+        self.log(f"listening on {self.host}:{self.port} with {self.n_workers} workers")
+
+        next_poll = time.monotonic() + self.poll_interval
+        try:
+            while True:
+                self.reap_workers()
+                self.spawn_workers()
+                self.kill_overdue()
+                self.shared_metrics.flush()
+                select.select([self._wakeup[0]], [], [], self._timeout(next_poll))
+                try:
+                    os.read(self._wakeup[0], 4096)
+                except BlockingIOError:
+                    pass
+                signals, self._signals = self._signals, []
+                if any(signum in SHUTDOWN_SIGNALS for signum in signals):
+                    break
+                if signal.SIGHUP in signals:
+                    self.reload()
+                elif self.poll_interval and time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + self.poll_interval
+                    if registry.reload():
+                        self.log("params file changed, replacing the workers")
+                        self.replace_workers()
+        finally:
+            self.shutdown()
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _timeout(self, next_poll: float) -> float | None:
+        timeouts = [1.0] if self.draining else []
+        if self.poll_interval:
+            timeouts.append(max(0.0, next_poll - time.monotonic()))
+        return min(timeouts, default=None)
+
+    def spawn_workers(self):
+        """Fork workers of the current generation until there are ``workers`` of them."""
+        current = sum(1 for generation in self.workers.values() if generation == self.generation)
+        for _ in range(self.n_workers - current):
+            pid = os.fork()
+            if pid == 0:
+                self.run_worker()
+            self.workers[pid] = self.generation
+
+    def run_worker(self):
+        """The body of a worker process. Never returns."""
+        status = 0
+        try:
+            signal.set_wakeup_fd(-1)
+            for fd in self._wakeup:
+                os.close(fd)
+            for signum in PARENT_SIGNALS:
+                signal.signal(signum, signal.SIG_DFL)
+            # ^C reaches the whole process group: leave it to the parent, which drains the workers with SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            stopping = []
+            signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+            self.shared_metrics.forked()
+
+            max_requests = self.max_requests + random.randint(0, self.max_requests // 10)
+            server = WorkerServer(
+                self.app, self.host, self.port, self.socket.fileno(), self.access_log, self.max_streams
+            )
+            while not stopping and not (self.max_requests and server.served >= max_requests):
+                # serves one connection, if one arrives within the server's timeout
+                server.handle_request()
+                self.shared_metrics.flush()
+            # the parent kills a draining worker past the graceful timeout anyway
+            server.join_streams(self.graceful_timeout)
+            self.shared_metrics.flush(force=True)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+    def reap_workers(self):
+        """Collect the workers that exited."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            # a worker of the current generation that exits is replaced by the next spawn_workers, whether it was
+            # recycled (status 0) or died
+            del self.workers[pid]
+            self.shared_metrics.retire(pid)
+            drained = self.draining.pop(pid, None) is not None
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0 and not drained:
+                self.log(f"worker {pid} exited with status {code}")
+
+    def reload(self):
+        """Reload every model, then replace the workers. A model that fails to load keeps the current workers."""
+        try:
+            for loaded in registry.loaded():
+                registry.reload(loaded.path)
+        except Exception as e:
+            self.log(f"reload failed, keeping the current workers: {e}")
+            return
+        self.log("models reloaded, replacing the workers")
+        self.replace_workers()
+
+    def replace_workers(self):
+        """Fork a new generation of workers from the reloaded parent, then drain the previous ones."""
+        preload()
+        gc.freeze()
+        self.generation += 1
+        old = [pid for pid in self.workers if pid not in self.draining]
+        self.spawn_workers()
+        self.drain(old)
+
+    def drain(self, pids):
+        now = time.monotonic()
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                continue
+            self.draining.setdefault(pid, now)
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, since in list(self.draining.items()):
+            if now - since > self.graceful_timeout:
+                self.log(f"worker {pid} did not finish within {self.graceful_timeout:g}s, killing it")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.draining[pid] = float("inf")
+
+    def shutdown(self):
+        """Stop accepting connections, and wait for the workers to finish their requests."""
+        for signum in PARENT_SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        for fd in self._wakeup or ():
+            os.close(fd)
+        self.socket.close()
+        self.log(f"draining {len(self.workers)} workers")
+        self.drain(list(self.workers))
+        while self.workers:
+            self.reap_workers()
+            self.kill_overdue()
+            time.sleep(0.05)
+        metrics.registry.shared = None
+        shutil.rmtree(self.shared_metrics.directory, ignore_errors=True)
+        self.log("stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the app from pre-forked worker processes.")
+    parser.add_argument("-b", "--bind", default="0.0.0.0:8080", help="host:port to listen on (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--max-requests", type=int, default=10000,
+                        help="requests a worker serves before it is replaced, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="seconds a worker may take to finish its request when stopped (default: %(default)s)")
+    parser.add_argument("--max-streams", type=int, default=16,
+                        help="stream requests a worker serves at a time, each on a thread (default: %(default)s)")
+    parser.add_argument("--access-log", action="store_true", help="log a line per request")
+    args = parser.parse_args(argv)
+
+    host, _, port = args.bind.rpartition(":")
+    server = PreforkServer(
+        app, host.strip("[]") or "0.0.0.0", int(port), args.workers, args.max_requests, args.graceful_timeout,
+        poll_interval=float(os.environ.get("HDD_LIFETIME_MODEL_POLL_INTERVAL", 5.0)), access_log=args.access_log,
+        max_streams=args.max_streams,
+    )
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
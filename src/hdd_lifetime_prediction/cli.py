@@ -0,0 +1,120 @@
+"""``hdd-lifetime-predict``: score smartctl output from stdin or files, e.g. from a cron job.
+
+    sudo smartctl -A /dev/sda | hdd-lifetime-predict
+    sudo smartctl -A -j /dev/sda | hdd-lifetime-predict --model short-term
+    hdd-lifetime-predict /var/lib/smart/*.txt
+
+Each input holds a ``smartctl -A`` output, several of them each introduced by a ``==> key <==`` line (as ``tail -n +1``
+prints them), or one or more ``smartctl -A -j`` documents. A single drive is printed as the single-drive endpoint
+responds; several drives, or any number with ``--batch``, as the batch endpoint does, keyed by file name, ``==>`` key or
+serial number.
+
+Startup is what a cron job pays on every run, so only the standard library is imported on the way: the tree is read
+from the model file built next to its params yaml (see ``model.scalar``), and NumPy and PyYAML are only loaded when
+that file is missing or out of date.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+
+from .model.scalar import load
+from .model.smartctl import (
+    DOCUMENT_SEPARATOR, iter_smartctl_json, parse_smartctl, parse_smartctl_json, smartctl_json_key,
+    split_smartctl_documents,
+)
+
+MODELS = ("long-term", "short-term")
+
+
+def dumps(payload) -> str:
+    # as the endpoints serialize it
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"))
+
+
+def params_path(model: str) -> str:
+    """The params yaml of a shipped tree by name, or ``model`` itself as a path."""
+    if model in MODELS:
+        return os.path.join(os.path.dirname(__file__), "model", f"{model}-params.yaml")
+    return model
+
+
+def read_documents(name: str, data: bytes):
+    """``(drive key, SMARTAttributes or the exception parsing it raised)`` for each drive in an input."""
+    if data.lstrip()[:1] in (b"{", b"["):
+        try:
+            for i, document in enumerate(iter_smartctl_json(io.BytesIO(data))):
+                key = smartctl_json_key(document, f"{name}:{i}") if isinstance(document, dict) else f"{name}:{i}"
+                try:
+                    yield key, parse_smartctl_json(document)
+                except ValueError as e:
+                    yield key, e
+        except ValueError as e:
+            yield name, e
+        return
+
+    text = data.decode(errors="replace")
+    if any(DOCUMENT_SEPARATOR.match(line) for line in text.splitlines()):
+        documents = split_smartctl_documents(text)
+    else:
+        documents = {name: text}
+    for key, document in documents.items():
+        try:
+            yield key, parse_smartctl(document)
+        except ValueError as e:
+            yield key, e
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="hdd-lifetime-predict", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("files", nargs="*", default=["-"], help="smartctl outputs to score, - for stdin (default)")
+    parser.add_argument("-m", "--model", default="long-term",
+                        help=f"one of {', '.join(MODELS)}, or the path of a params yaml (default: long-term)")
+    parser.add_argument("--batch", action="store_true",
+                        help="print the batch response, with model_version, results and errors, even for one drive")
+    args = parser.parse_args(argv)
+
+    drives = {}
+    for name in args.files:
+        if name == "-":
+            data = sys.stdin.buffer.read()
+        else:
+            try:
+                with open(name, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                parser.error(f"cannot read {name}: {e.strerror}")
+        drives.update(read_documents(name, data))
+    if not drives:
+        print("no smartctl output to score", file=sys.stderr)
+        return 1
+
+    try:
+        tree, version = load(params_path(args.model))
+    except OSError as e:
+        parser.error(f"cannot load the {args.model} model: {e}")
+    results = {}
+    errors = {}
+    for key, smart_attributes in drives.items():
+        if isinstance(smart_attributes, Exception):
+            errors[key] = str(smart_attributes)
+            continue
+        node = tree.nodes[tree.predict_node_id(tree.project(smart_attributes.by_id))]
+        results[key] = {"predicted_lifetime": node["expected_lifetime"], "predicted_stats": node}
+
+    if len(drives) == 1 and not args.batch:
+        if errors:
+            print(dumps({"error": next(iter(errors.values()))}))
+            return 1
+        print(dumps(next(iter(results.values()))))
+        return 0
+    print(dumps({"model_version": version, "results": results, "errors": errors}))
+    # some drives, e.g. NVMe ones without an ATA attribute table, are expected to fail, but not every one of them
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""Fleet-level views over batch scoring output: summaries, percentiles and histograms per group, top-K and leaf counts.
+
+``Fleet`` holds the scores column by column: the lifetime statistics as float arrays, the node as an integer array,
+and the metadata (serial number, drive model, vendor, ...) factorized once into integer codes. Every view is then a
+handful of NumPy operations over whole columns, group-bys included, so a dashboard can query a fleet of hundreds of
+thousands of drives interactively:
+
+    fleet = Fleet.read("scores/2023-01-02.csv")  # as written by hdd_lifetime_prediction.fleet.backblaze
+    fleet.summary("expected_lifetime", by="vendor")
+    fleet.where(model="ST4000DM000").top_k("lower_lifetime", k=100)
+
+Results are plain dicts and lists, ready to be serialized as JSON.
+"""
+import csv
+from pathlib import Path
+
+import numpy as np
+
+from hdd_lifetime_prediction.model.compiled import BatchPrediction
+
+LIFETIME_COLUMNS = ("expected_lifetime", "median_lifetime", "lower_lifetime", "upper_lifetime", "n_samples")
+DEFAULT_PERCENTILES = (5.0, 25.0, 50.0, 75.0, 95.0)
+# the vendor of a drive by the prefix of its model name, as Backblaze reports it. The first match wins
+VENDOR_PREFIXES = (
+    ("HGST", "HGST"), ("Hitachi", "HGST"), ("TOSHIBA", "Toshiba"), ("WDC", "WDC"), ("WD", "WDC"),
+    ("Seagate", "Seagate"), ("ST", "Seagate"), ("Micron", "Micron"), ("CT", "Crucial"), ("SAMSUNG", "Samsung"),
+)
+
+
+def vendor(model: str) -> str:
+    """The vendor of a drive model, e.g. "Seagate" for "ST4000DM000", or the model's first word if unknown."""
+    for prefix, name in VENDOR_PREFIXES:
+        if model.startswith(prefix):
+            return name
+    return model.split(" ", 1)[0] if model else ""
+
+
+def factorize(values) -> tuple[np.ndarray, np.ndarray, dict[str, int]]:
+    """Integer codes for a column of labels, compared as strings.
+
+    Returns: the codes, the labels they stand for, and the code of each label.
+    """
+    index = {}
+    codes = np.fromiter((index.setdefault(str(value), len(index)) for value in values), dtype=np.intp)
+    labels = np.empty(len(index), dtype=object)
+    labels[:] = list(index)
+    return codes, labels, index
+
+
+def group_quantiles(values: np.ndarray, codes: np.ndarray, n_groups: int, q) -> np.ndarray:
+    """Percentiles of ``values`` within each group, as ``np.percentile`` computes them (linear interpolation).
+
+    Returns: an array of shape (n_groups, len(q)), NaN for empty groups.
+    """
+    # sort by value, then stably by group: a stable sort of 16-bit integers is a radix sort, several times faster
+    # than np.lexsort on both keys
+    order = np.argsort(values)
+    group_codes = codes.astype(np.uint16) if n_groups <= 1 << 16 else codes
+    sorted_values = values[order[np.argsort(group_codes[order], kind="stable")]]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    positions = starts[:, None] + (np.asarray(q, dtype=np.float64) / 100.0)[None, :] * (counts[:, None] - 1)
+    positions = np.clip(positions, 0, max(len(values) - 1, 0))
+    low = np.floor(positions).astype(np.intp)
+    high = np.ceil(positions).astype(np.intp)
+    if not len(values):
+        return np.full(positions.shape, np.nan)
+    result = sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (positions - low)
+    result[counts == 0] = np.nan
+    return result
+
+
+class Fleet:
+    """Scores of a fleet, one entry per drive in each column.
+
+    Args:
+        columns: the columns by name. ``LIFETIME_COLUMNS`` are taken as floats and ``node`` as integers, as in
+            ``BatchPrediction``; any other column is metadata, compared and grouped by its string value. A ``vendor``
+            column is derived from ``model`` unless given.
+    """
+
+    def __init__(self, columns: dict):
+        self.values: dict[str, np.ndarray] = {}
+        self.codes: dict[str, np.ndarray] = {}
+        self.labels: dict[str, np.ndarray] = {}
+        self._label_codes: dict[str, dict[str, int]] = {}
+        for name, column in columns.items():
+            if name in LIFETIME_COLUMNS:
+                self.values[name] = np.asarray(column, dtype=np.float64)
+            elif name == "node":
+                self.values[name] = np.asarray(column, dtype=np.int64)
+            else:
+                self.codes[name], self.labels[name], self._label_codes[name] = factorize(column)
+        if "model" in self.codes and "vendor" not in self.codes:
+            # vendors of the distinct models, then of every drive through its model's code
+            vendor_codes, self.labels["vendor"], self._label_codes["vendor"] = factorize(
+                map(vendor, self.labels["model"])
+            )
+            self.codes["vendor"] = vendor_codes[self.codes["model"]]
+        lengths = {len(column) for column in (*self.values.values(), *self.codes.values())}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        self._length = lengths.pop() if lengths else 0
+
+    @classmethod
+    def from_prediction(cls, prediction: BatchPrediction, **metadata) -> "Fleet":
+        """A fleet from ``predict_batch`` output and metadata columns in the same row order, e.g. serial_number."""
+        columns = {name: getattr(prediction, name) for name in ("node", *LIFETIME_COLUMNS)}
+        return cls({**columns, **metadata})
+
+    @classmethod
+    def read(cls, path) -> "Fleet":
+        """A fleet from a result file of ``fleet.backblaze``, CSV or Parquet (which needs pyarrow).
+
+        Raises:
+            ValueError: a CSV file is empty, has a row with a different number of fields than its header, or has a
+                lifetime that is not a number.
+        """
+        if Path(path).suffix == ".parquet":
+            try:
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError(
+                    "Parquet input requires pyarrow: pip install hdd-lifetime-prediction[parquet]"
+                ) from None
+            table = pyarrow.parquet.read_table(path)
+            return cls({name: table.column(name).to_numpy() for name in table.column_names})
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                raise ValueError(f"{path} is empty, expected a header row")
+            rows = list(reader)
+        for line, row in enumerate(rows, start=2):
+            if len(row) != len(header):
+                raise ValueError(f"{path}, line {line}: {len(row)} fields, expected {len(header)}")
+        columns = {}
+        for i, name in enumerate(header):
+            if name in LIFETIME_COLUMNS:
+                columns[name] = [float(row[i]) if row[i] else np.nan for row in rows]
+            else:
+                columns[name] = [row[i] for row in rows]
+        return cls(columns)
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def columns(self) -> list[str]:
+        return [*self.values, *self.codes]
+
+    def _subset(self, mask: np.ndarray) -> "Fleet":
+        # the labels are shared, so codes keep their meaning and groups their order
+        fleet = Fleet.__new__(Fleet)
+        fleet.values = {name: column[mask] for name, column in self.values.items()}
+        fleet.codes = {name: codes[mask] for name, codes in self.codes.items()}
+        fleet.labels = self.labels
+        fleet._label_codes = self._label_codes
+        fleet._length = int(np.count_nonzero(mask))
+        return fleet
+
+    def where(self, **equals) -> "Fleet":
+        """The drives whose metadata (or node) equals the given values, e.g. ``where(vendor="HGST")``. A list of
+        values matches any of them."""
+        mask = np.ones(len(self), dtype=bool)
+        for name, wanted in equals.items():
+            wanted = list(wanted) if isinstance(wanted, (list, tuple, set)) else [wanted]
+            if name == "node" and "node" in self.values:
+                mask &= np.isin(self.values["node"], np.asarray(wanted, dtype=np.int64))
+            elif name in self.codes:
+                label_codes = self._label_codes[name]
+                matching = [label_codes[str(value)] for value in wanted if str(value) in label_codes]
+                mask &= np.isin(self.codes[name], matching)
+            else:
+                raise ValueError(f"Unknown column {name!r}, expected one of {self.columns}")
+        return self._subset(mask)
+
+    def _column(self, column: str) -> np.ndarray:
+        if column not in self.values:
+            raise ValueError(f"Unknown column {column!r}, expected one of {list(self.values)}")
+        return self.values[column]
+
+    def _node_codes(self) -> tuple[np.ndarray, np.ndarray]:
+        # the node ids present, and the position of each drive's node among them. Node ids are small positive
+        # integers, so counting beats np.unique's sort
+        if "node" not in self.values:
+            raise ValueError(f"The fleet has no node column, only {self.columns}")
+        counts = np.bincount(self.values["node"])
+        node_ids = np.flatnonzero(counts)
+        return node_ids, (np.cumsum(counts > 0) - 1)[self.values["node"]]
+
+    def _groups(self, by: str | None) -> tuple[np.ndarray, list]:
+        # the group code of each drive, and the label of each code
+        if by is None:
+            return np.zeros(len(self), dtype=np.intp), ["all"]
+        if by == "node":
+            node_ids, codes = self._node_codes()
+            return codes, node_ids.tolist()
+        if by not in self.codes:
+            raise ValueError(f"Cannot group by {by!r}, expected one of {['node', *self.codes]}")
+        return self.codes[by], self.labels[by].tolist()
+
+    def summary(self, column: str = "expected_lifetime", by: str | None = None, q=DEFAULT_PERCENTILES) -> dict:
+        """Count, mean, min, max and percentiles ``q`` of a column, over the fleet or per group.
+
+        Drives missing the column (NaN) are left out. Returns: ``{group: {"count": ..., "mean": ..., "min": ...,
+        "max": ..., "percentiles": {q: value}}}`` for each non-empty group, keyed "all" without ``by``.
+        """
+        values = self._column(column).astype(np.float64)
+        codes, labels = self._groups(by)
+        present = ~np.isnan(values)
+        values, codes = values[present], codes[present]
+        n_groups = len(labels)
+        counts = np.bincount(codes, minlength=n_groups)
+        sums = np.bincount(codes, weights=values, minlength=n_groups)
+        minima = np.full(n_groups, np.inf)
+        np.minimum.at(minima, codes, values)
+        maxima = np.full(n_groups, -np.inf)
+        np.maximum.at(maxima, codes, values)
+        quantiles = group_quantiles(values, codes, n_groups, q)
+
+        result = {}
+        for i in np.flatnonzero(counts).tolist():
+            result[str(labels[i])] = {
+                "count": int(counts[i]),
+                "mean": float(sums[i] / counts[i]),
+                "min": float(minima[i]),
+                "max": float(maxima[i]),
+                "percentiles": dict(zip(map(str, q), quantiles[i].tolist())),
+            }
+        return result
+
+    def percentiles(self, column: str = "expected_lifetime", by: str | None = None, q=DEFAULT_PERCENTILES) -> dict:
+        """``{group: {q: value}}``, the percentiles part of ``summary``."""
+        return {group: stats["percentiles"] for group, stats in self.summary(column, by, q).items()}
+
+    def histogram(self, column: str = "expected_lifetime", bins: int = 20, range: tuple[float, float] | None = None,
+                  by: str | None = None) -> dict:
+        """Counts of a column over ``bins`` equal-width bins shared by every group, as ``np.histogram`` bins them.
+
+        Returns: ``{"edges": [...], "counts": {group: [...]}}``, keyed "all" without ``by``.
+        """
+        values = self._column(column).astype(np.float64)
+        codes, labels = self._groups(by)
+        present = ~np.isnan(values)
+        values, codes = values[present], codes[present]
+        edges = np.histogram_bin_edges(values, bins=bins, range=range)
+        inside = (values >= edges[0]) & (values <= edges[-1])
+        values, codes = values[inside], codes[inside]
+        # the last bin is closed on the right, as in np.histogram
+        bin_index = np.minimum(np.searchsorted(edges, values, side="right") - 1, bins - 1)
+        counts = np.bincount(codes * bins + bin_index, minlength=len(labels) * bins).reshape(len(labels), bins)
+        return {
+            "edges": edges.tolist(),
+            "counts": {str(labels[i]): counts[i].tolist() for i in np.flatnonzero(counts.sum(axis=1)).tolist()},
+        }
+
+    def top_k(self, column: str = "lower_lifetime", k: int = 10, largest: bool = False) -> list[dict]:
+        """The ``k`` drives with the lowest (or ``largest``) values of a column, in order, each as a dict of its
+        columns. Selected with ``argpartition``, so only the ``k`` selected drives are sorted."""
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        values = self._column(column).astype(np.float64)
+        candidates = np.flatnonzero(~np.isnan(values))
+        keys = -values[candidates] if largest else values[candidates]
+        if k < len(candidates):
+            # the k-th smallest key, found by partitioning; drives tied with it are taken in drive order, so the
+            # result does not depend on how the partition breaks ties
+            kth = keys[np.argpartition(keys, k - 1)[k - 1]]
+            below = np.flatnonzero(keys < kth)
+            selected = np.concatenate((below, np.flatnonzero(keys == kth)[:k - len(below)]))
+            candidates, keys = candidates[selected], keys[selected]
+        rows = candidates[np.lexsort((candidates, keys))]
+        return self.rows(rows)
+
+    def rows(self, index) -> list[dict]:
+        """The given drives, each as a dict of its columns."""
+        columns = {name: column[index].tolist() for name, column in self.values.items()}
+        columns.update((name, self.labels[name][codes[index]].tolist()) for name, codes in self.codes.items())
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+    def leaf_counts(self, by: str | None = None) -> dict:
+        """The number of drives in each node, ``{group: {node id: count}}``, keyed "all" without ``by``."""
+        node_ids, node_codes = self._node_codes()
+        codes, labels = self._groups(by)
+        counts = np.bincount(codes * len(node_ids) + node_codes, minlength=len(labels) * len(node_ids))
+        counts = counts.reshape(len(labels), len(node_ids))
+        return {
+            str(labels[i]): {str(node_id): int(count) for node_id, count in zip(node_ids.tolist(), counts[i]) if count}
+            for i in np.flatnonzero(counts.sum(axis=1)).tolist()
+        }
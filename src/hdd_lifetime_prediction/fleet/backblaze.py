@@ -0,0 +1,218 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.resources import files
+from pathlib import Path
+
+import numpy as np
+
+from hdd_lifetime_prediction.model.registry import load_model
+
+# columns copied from the input to the output, when present
+PASSTHROUGH_COLUMNS = ("date", "serial_number", "model")
+PREDICTION_COLUMNS = ("node", "expected_lifetime", "median_lifetime", "lower_lifetime", "upper_lifetime")
+DEFAULT_PARAMS = files("hdd_lifetime_prediction.model").joinpath("long-term-params.yaml")
+
+
+def read_column(rows: list[list[str]], i: int, default: str = "") -> list[str]:
+    """Column ``i`` of ``rows``, with ``default`` for the rows too short to have it."""
+    try:
+        return [row[i] for row in rows]
+    except IndexError:
+        return [row[i] if i < len(row) else default for row in rows]
+
+
+def read_floats(rows: list[list[str]], i: int) -> tuple[list[float], int]:
+    """Column ``i`` of ``rows`` as floats, NaN where empty.
+
+    Returns: the values, and the number of cells that were not numbers or were missing from a short row, also NaN.
+    """
+    try:
+        return [float(row[i]) if row[i] else np.nan for row in rows], 0
+    except (ValueError, IndexError):
+        pass
+    values = []
+    invalid = 0
+    for row in rows:
+        try:
+            values.append(float(row[i]) if row[i] else np.nan)
+        except (ValueError, IndexError):
+            values.append(np.nan)
+            invalid += 1
+    return values, invalid
+
+
+def read_chunks(path: Path, feature_names, chunk_size: int = 100_000, invalid_cells: Counter | None = None):
+    """Stream a Backblaze daily CSV, keeping only the passthrough columns and ``feature_names``.
+
+    Args:
+        path: a CSV with a header row, such as a Backblaze ``YYYY-MM-DD.csv``.
+        feature_names: the feature columns to load, e.g. ("smart_5_raw", "smart_3_normalized").
+        chunk_size: the number of rows per chunk.
+        invalid_cells: if given, counts the feature cells that were not numbers or were missing from a short row, by
+            column name.
+
+    Yields: ``(passthrough, features)`` per chunk, where passthrough maps each passthrough column found in the file
+        to a list of strings, and features is a float matrix with one column per feature name. Empty and invalid
+        cells are NaN.
+
+    Raises:
+        ValueError: if the header has no column for one of ``feature_names``. Every drive would stop at the first
+            split on it, so the whole file would get the predictions of the nodes above.
+    """
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        index = {name: i for i, name in enumerate(header)}
+        missing = [name for name in feature_names if name not in index]
+        if missing:
+            raise ValueError(f"{path} has no column for the split features {', '.join(missing)}")
+        passthrough_columns = [name for name in PASSTHROUGH_COLUMNS if name in index]
+        passthrough_indices = [index[name] for name in passthrough_columns]
+        feature_indices = [index[name] for name in feature_names]
+
+        while True:
+            rows = [row for _, row in zip(range(chunk_size), reader)]
+            if not rows:
+                return
+            passthrough = {
+                name: read_column(rows, i) for name, i in zip(passthrough_columns, passthrough_indices)
+            }
+            features = np.empty((len(rows), len(feature_names)))
+            for j, (name, i) in enumerate(zip(feature_names, feature_indices)):
+                features[:, j], invalid = read_floats(rows, i)
+                if invalid and invalid_cells is not None:
+                    invalid_cells[name] += invalid
+            yield passthrough, features
+
+
+class CSVResultWriter:
+    def __init__(self, path: Path):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.header_written = False
+
+    def write(self, columns: dict[str, list]):
+        if not self.header_written:
+            self.writer.writerow(columns)
+            self.header_written = True
+        self.writer.writerows(zip(*columns.values()))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetResultWriter:
+    """Writes each chunk as a row group. Requires the optional pyarrow dependency."""
+
+    def __init__(self, path: Path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow: pip install hdd-lifetime-prediction[parquet]") from None
+        self.pyarrow = pyarrow
+        self.path = path
+        self.writer = None
+
+    def write(self, columns: dict[str, list]):
+        table = self.pyarrow.table(columns)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+WRITERS = {"csv": CSVResultWriter, "parquet": ParquetResultWriter}
+
+
+def score_file(path: Path, output: Path, params: Path = DEFAULT_PARAMS, chunk_size: int = 100_000,
+               output_format: str = "csv") -> tuple[int, Counter]:
+    """Score every row of a Backblaze CSV, writing the predictions to ``output`` one chunk at a time.
+
+    Returns: the number of rows scored, and the number of feature cells read as NaN because they were not numbers, by
+        column name.
+    """
+    model = load_model(params).model
+    writer = WRITERS[output_format](output)
+    n_rows = 0
+    invalid_cells = Counter()
+    try:
+        for passthrough, features in read_chunks(path, model.feature_names, chunk_size, invalid_cells):
+            prediction = model.predict_batch(features)
+            columns = dict(passthrough)
+            for name in PREDICTION_COLUMNS:
+                columns[name] = getattr(prediction, name).tolist()
+            writer.write(columns)
+            n_rows += len(prediction)
+    finally:
+        writer.close()
+    return n_rows, invalid_cells
+
+
+def score_files(paths, output_dir: Path, params: Path = DEFAULT_PARAMS, chunk_size: int = 100_000,
+                output_format: str = "csv", workers: int | None = None):
+    """Score many Backblaze CSVs across a process pool, one output file per input file.
+
+    Memory stays bounded by ``workers * chunk_size`` rows, however many or large the inputs are.
+
+    Yields: ``(input path, output path, rows scored, invalid cells by column)`` as each file completes.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for path in paths:
+            output = output_dir / f"{Path(path).stem}.{output_format}"
+            futures[pool.submit(score_file, path, output, params, chunk_size, output_format)] = (path, output)
+        for future in as_completed(futures):
+            path, output = futures[future]
+            yield path, output, *future.result()
+
+
+def describe_invalid(invalid_cells: Counter) -> str:
+    """``invalid_cells`` for a progress line, empty if there are none."""
+    if not invalid_cells:
+        return ""
+    columns = ", ".join(f"{name}: {n}" for name, n in invalid_cells.most_common())
+    return f", {sum(invalid_cells.values())} invalid cells read as missing ({columns})"
+
+
+def expand_paths(paths) -> list[Path]:
+    """Replace directories by the CSVs they contain."""
+    expanded = []
+    for path in map(Path, paths):
+        expanded += sorted(path.glob("*.csv")) if path.is_dir() else [path]
+    return expanded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score Backblaze-format daily SMART CSVs in bulk.")
+    parser.add_argument("inputs", nargs="+", help="CSV files, or directories of them")
+    parser.add_argument("-o", "--output-dir", required=True, help="where to write one result file per input")
+    parser.add_argument("--params", default=DEFAULT_PARAMS, help="params yaml of the model (default: long-term)")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="rows per chunk (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    total = 0
+    for path, output, n_rows, invalid_cells in score_files(
+        expand_paths(args.inputs), args.output_dir, args.params, args.chunk_size, args.format, args.workers
+    ):
+        total += n_rows
+        print(f"{path} -> {output}: {n_rows} rows{describe_invalid(invalid_cells)}", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    print(f"scored {total} rows in {elapsed:.1f}s ({total / elapsed * 3600:,.0f} rows/hour)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Collect ``smartctl -A`` from every disk of the local host concurrently, and score the drives as one batch.
+
+A serial sweep of a host with dozens of disks takes minutes, and a single hung disk stalls it indefinitely. Here
+smartctl runs on up to ``workers`` devices at a time, each with its own timeout, and each output is parsed as soon as
+it arrives. A device that times out or fails is reported under ``errors`` and does not hold up the others.
+
+    python -m hdd_lifetime_prediction.fleet.collector [/dev/sda ...] [--timeout 30] [-j 16]
+
+prints the same JSON as the batch endpoint. With ``--url``, the outputs are posted to that server's batch endpoint
+instead of being scored locally, as NDJSON records with ``--json``. The smartctl binary is ``--smartctl``, or the
+``HDD_LIFETIME_SMARTCTL`` environment variable, or ``smartctl`` on the PATH, so a fake script can stand in for it.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from importlib.resources import files
+
+from hdd_lifetime_prediction.model.infer import batch_results
+from hdd_lifetime_prediction.model.registry import load_model
+from hdd_lifetime_prediction.model.smartctl import parse_smartctl, parse_smartctl_json
+
+SMARTCTL = os.environ.get("HDD_LIFETIME_SMARTCTL", "smartctl")
+DEFAULT_PARAMS = files("hdd_lifetime_prediction.model").joinpath("long-term-params.yaml")
+# block devices without SMART attributes: optical drives. Virtual devices (loop, ram, dm-, md, zram, ...) have no
+# "device" link in sysfs and are skipped on that account
+SKIPPED_PREFIXES = ("sr",)
+# how long to wait for a killed smartctl to exit. A process stuck in the kernel on a hung disk cannot be killed, and
+# is left behind rather than holding up the sweep
+KILL_GRACE = 1.0
+
+
+def list_devices(sys_block: str = "/sys/block") -> list[str]:
+    """The physical block devices of the host, e.g. ["/dev/sda", "/dev/sdb", "/dev/nvme0n1"]."""
+    devices = []
+    for name in sorted(os.listdir(sys_block)):
+        if name.startswith(SKIPPED_PREFIXES) or not os.path.exists(os.path.join(sys_block, name, "device")):
+            continue
+        devices.append(f"/dev/{name}")
+    return devices
+
+
+def run_smartctl(device: str, smartctl: str = SMARTCTL, timeout: float = 30.0, json_output: bool = False) -> str:
+    """The output of ``smartctl -A`` for one device.
+
+    Raises:
+        TimeoutError: smartctl did not finish within ``timeout`` seconds. It is killed.
+        RuntimeError: smartctl could not open the device or did not understand its command line. The other bits of
+            its exit status report the health of the disk, and leave the output usable.
+    """
+    argv = [smartctl, "-A", *(["-j"] if json_output else []), device]
+    process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        try:
+            process.communicate(timeout=KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            pass
+        raise TimeoutError(f"smartctl did not finish within {timeout:g}s") from None
+    if process.returncode & 0b11:
+        message = smartctl_message(stdout.decode(errors="replace"), stderr.decode(errors="replace"), json_output)
+        raise RuntimeError(f"smartctl exited with status {process.returncode}" + (f": {message}" if message else ""))
+    return stdout.decode(errors="replace")
+
+
+def smartctl_message(stdout: str, stderr: str, json_output: bool = False) -> str | None:
+    """Why smartctl failed, from what it printed.
+
+    With ``-j`` it reports to ``smartctl.messages`` in the JSON document on stdout; otherwise it explains itself on
+    the last line it prints.
+    """
+    if json_output:
+        try:
+            messages = json.loads(stdout)["smartctl"]["messages"]
+            return "; ".join(message["string"] for message in messages) or None
+        except (ValueError, KeyError, TypeError):
+            pass
+    lines = (stderr or stdout).strip().splitlines()
+    return lines[-1] if lines else None
+
+
+def collect(devices, smartctl: str = SMARTCTL, timeout: float = 30.0, workers: int = 16, json_output: bool = False):
+    """Run smartctl on ``devices``, at most ``workers`` at a time.
+
+    Yields: ``(device, output or the exception raised collecting it)`` as each device completes.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smartctl") as pool:
+        futures = {pool.submit(run_smartctl, device, smartctl, timeout, json_output): device for device in devices}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+
+def score(outputs, params=DEFAULT_PARAMS) -> dict:
+    """Score collected outputs as one batch.
+
+    Args:
+        outputs: ``(device, output or exception)`` pairs, as yielded by ``collect``. Outputs are parsed as they are
+            yielded, so parsing overlaps with collection.
+        params: the params yaml of the model.
+
+    Returns: the batch endpoint's response: the model version, the single-drive response of each device under
+        ``results``, and the reason each remaining device could not be scored under ``errors``.
+    """
+    loaded = load_model(params)
+    model = loaded.model
+    features = {}
+    errors = {}
+    for device, output in outputs:
+        try:
+            if isinstance(output, Exception):
+                raise output
+            if output.lstrip().startswith("{"):
+                features[device] = model.features(parse_smartctl_json(output))
+            else:
+                features[device] = model.features(parse_smartctl(output))
+        except Exception as e:
+            errors[device] = str(e)
+
+    results = {}
+    if features:
+        results = batch_results(list(features), model.predict_batch(list(features.values())), model)
+    return {"model_version": loaded.version, "results": dict(sorted(results.items())), "errors": errors}
+
+
+def post(outputs, url: str, json_output: bool = False) -> dict:
+    """Send collected outputs to the batch endpoint of a server at ``url`` in one request, and return its response.
+
+    Text outputs are sent as ``==> device <==`` sections. ``smartctl -j`` outputs are sent as NDJSON records
+    ``{"id": device, "smartctl": output}``, the form of the batch endpoint that keys each document by its id. Devices
+    that could not be collected, or whose JSON output does not decode, are added to the response's ``errors``. When
+    no output is left to send, nothing is posted; when the server cannot be reached or answers with an error status,
+    the reason is under ``error`` and ``results`` is empty.
+    """
+    body = []
+    errors = {}
+    for device, output in outputs:
+        if isinstance(output, Exception):
+            errors[device] = str(output)
+        elif json_output:
+            try:
+                document = json.loads(output)
+            except ValueError as e:
+                errors[device] = f"invalid smartctl -j output: {e}"
+                continue
+            body.append(json.dumps({"id": device, "smartctl": document}) + "\n")
+        else:
+            body.append(f"==> {device} <==\n{output}\n")
+    if not body:
+        return {"results": {}, "errors": errors}
+    content_type = "application/x-ndjson" if json_output else "text/plain"
+    request = urllib.request.Request(
+        url.rstrip("/") + "/hdd-lifetime-prediction/batch/", data="".join(body).encode(),
+        headers={"Content-Type": content_type},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            result = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return {"error": f"{url} answered {e.code}: {error_message(e.read())}", "results": {}, "errors": errors}
+    except urllib.error.URLError as e:
+        return {"error": f"could not reach {url}: {e.reason}", "results": {}, "errors": errors}
+    result["errors"] = {**result.get("errors", {}), **errors}
+    return result
+
+
+def error_message(body: bytes) -> str:
+    """The ``error`` of a JSON error response, else its text."""
+    text = body.decode(errors="replace").strip()
+    try:
+        return str(json.loads(text)["error"])
+    except (ValueError, KeyError, TypeError):
+        return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collect and score the SMART attributes of every local disk.")
+    parser.add_argument("devices", nargs="*", help="devices to collect (default: every disk in /sys/block)")
+    parser.add_argument("--smartctl", default=SMARTCTL, help="the smartctl binary (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds per device (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=16, help="devices at a time (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="collect smartctl -A -j rather than the text output")
+    parser.add_argument("--params", default=DEFAULT_PARAMS, help="params yaml of the model (default: long-term)")
+    parser.add_argument("--url", help="post to the batch endpoint of this server instead of scoring locally")
+    args = parser.parse_args(argv)
+
+    devices = args.devices or list_devices()
+    start = time.perf_counter()
+    outputs = collect(devices, args.smartctl, args.timeout, args.workers, args.json)
+    result = post(outputs, args.url, args.json) if args.url else score(outputs, args.params)
+    print(json.dumps(result, sort_keys=True))
+    if "error" in result:
+        print(result["error"], file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    print(f"scored {len(result['results'])} of {len(devices)} devices in {elapsed:.1f}s", file=sys.stderr)
+    return 0 if result["results"] or not devices else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""The last scored state of each drive, so a sweep only re-evaluates the drives whose split features changed.
+
+Between daily sweeps most drives report the same values for the few attributes the tree splits on, and land in the
+same node. ``DriveStateStore`` keeps, per serial number, the projected feature vector (``TreeModel.feature_names``)
+a drive was last scored with, the node it reached and when, in SQLite. ``rescore`` compares a sweep against it and
+evaluates only the new and changed drives, and reports those that moved to another node, so the work done and the
+rows written are proportional to the changes rather than to the fleet.
+
+    python -m hdd_lifetime_prediction.fleet.state state.sqlite data_Q1_2023/2023-01-02.csv [...]
+
+rescored Backblaze-format CSVs in order, and prints the drives that moved as CSV.
+"""
+import argparse
+import csv
+import sqlite3
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from importlib.resources import files
+from pathlib import Path
+
+import numpy as np
+
+from hdd_lifetime_prediction.model.registry import LoadedModel, load_model
+from .backblaze import describe_invalid, expand_paths, read_chunks
+
+DEFAULT_PARAMS = files("hdd_lifetime_prediction.model").joinpath("long-term-params.yaml")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drives (
+    serial TEXT PRIMARY KEY,
+    model_version TEXT NOT NULL,
+    features BLOB NOT NULL,
+    node INTEGER NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+
+@dataclass
+class DriveState:
+    """What a drive was last scored with. ``features`` follows the model's ``feature_names``, with None if missing."""
+    serial: str
+    model_version: str
+    features: tuple[float | None, ...]
+    node: int
+    updated: float
+
+
+@dataclass
+class Rescore:
+    """The outcome of rescoring a sweep.
+
+    Attributes:
+        evaluated: the node of each drive that was evaluated, i.e. new to the store (or scored with another model
+            version) or with changed split features, by serial.
+        moved: ``(previous node, node)`` of each evaluated drive that landed in another node than before, by serial.
+        unchanged: the number of drives skipped because their split features were the same as when last scored.
+    """
+    model_version: str
+    evaluated: dict[str, int] = field(default_factory=dict)
+    moved: dict[str, tuple[int, int]] = field(default_factory=dict)
+    unchanged: int = 0
+
+    def update(self, other: "Rescore"):
+        """Add the outcome of the next chunk of the same sweep."""
+        self.evaluated.update(other.evaluated)
+        self.moved.update(other.moved)
+        self.unchanged += other.unchanged
+
+
+def feature_blobs(feature_matrix: np.ndarray) -> list[bytes]:
+    """Each row of a feature matrix as float64 bytes, with a single NaN bit pattern for missing values, so two rows
+    hold the same values exactly when their bytes are equal."""
+    X = np.array(feature_matrix, dtype="<f8")
+    X[np.isnan(X)] = np.nan
+    data = X.tobytes()
+    width = X.shape[1] * 8
+    return [data[i:i + width] for i in range(0, len(data), width)]
+
+
+class DriveStateStore:
+    """Per-drive state in a SQLite database, keyed by serial number.
+
+    The state recorded under a model version is read into memory by the first ``rescore`` with that version, and kept
+    in step with the database from then on, so the store should be the only writer to the file while it is open.
+
+    Args:
+        path: the database file, created if needed. ":memory:" keeps the state for the life of the object.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+        self._version = None
+        self._state = {}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM drives").fetchone()[0]
+
+    def get(self, serial: str) -> DriveState | None:
+        row = self.connection.execute(
+            "SELECT serial, model_version, features, node, updated FROM drives WHERE serial = ?", (serial,)
+        ).fetchone()
+        if row is None:
+            return None
+        serial, model_version, features, node, updated = row
+        values = np.frombuffer(features, dtype="<f8").tolist()
+        return DriveState(serial, model_version, tuple(None if v != v else v for v in values), node, updated)
+
+    def _stored(self, model_version: str) -> dict[str, tuple[bytes, int]]:
+        # the features and node of every drive last scored with this model version, read once and then kept up to
+        # date by rescore, so a sweep costs a dictionary lookup per unchanged drive
+        if self._version != model_version:
+            rows = self.connection.execute(
+                "SELECT serial, features, node FROM drives WHERE model_version = ?", (model_version,)
+            )
+            self._state = {serial: (features, node) for serial, features, node in rows}
+            self._version = model_version
+        return self._state
+
+    def rescore(self, loaded: LoadedModel, serials, feature_matrix, now: float | None = None) -> Rescore:
+        """Evaluate the drives of a sweep that are new or whose split features changed, and store their state.
+
+        Args:
+            loaded: the model, whose version the state is recorded under. State recorded under another version is
+                ignored, and replaced.
+            serials: the serial number of each row of ``feature_matrix``.
+            feature_matrix: the drives' features, shape (len(serials), len(model.feature_names)), NaN if missing, as
+                for ``TreeModel.predict_batch``.
+            now: the time to record, by default the current time.
+        """
+        serials = list(serials)
+        X = np.asarray(feature_matrix, dtype=np.float64)
+        blobs = feature_blobs(X)
+        stored = self._stored(loaded.version)
+
+        changed = [i for i, (serial, blob) in enumerate(zip(serials, blobs)) if stored.get(serial, (None,))[0] != blob]
+        result = Rescore(loaded.version, unchanged=len(serials) - len(changed))
+        if not changed:
+            return result
+
+        nodes = loaded.model.predict_batch(X[changed]).node.tolist()
+        now = time.time() if now is None else now
+        rows = []
+        for i, node in zip(changed, nodes):
+            serial = serials[i]
+            result.evaluated[serial] = node
+            previous = stored.get(serial)
+            if previous is not None and previous[1] != node:
+                result.moved[serial] = (previous[1], node)
+            rows.append((serial, loaded.version, blobs[i], node, now))
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO drives (serial, model_version, features, node, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (serial) DO UPDATE SET model_version = excluded.model_version, "
+                "features = excluded.features, node = excluded.node, updated = excluded.updated",
+                rows,
+            )
+        stored.update((serial, (blob, node)) for serial, _, blob, node, _ in rows)
+        return result
+
+
+def rescore_file(store: DriveStateStore, loaded: LoadedModel, path: Path, chunk_size: int = 100_000,
+                 invalid_cells: Counter | None = None) -> Rescore:
+    """Rescore the drives of a Backblaze CSV, which needs a ``serial_number`` column, a chunk at a time.
+
+    ``invalid_cells`` counts the feature cells read as missing because they were not numbers, see ``read_chunks``.
+    """
+    result = Rescore(loaded.version)
+    for passthrough, features in read_chunks(path, loaded.model.feature_names, chunk_size, invalid_cells):
+        if "serial_number" not in passthrough:
+            raise ValueError(f"{path} has no serial_number column")
+        result.update(store.rescore(loaded, passthrough["serial_number"], features))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rescore Backblaze-format daily CSVs against the stored drive state, "
+                                                 "and print the drives that moved to another node.")
+    parser.add_argument("state", help="the SQLite state file, created if needed")
+    parser.add_argument("inputs", nargs="+", help="CSV files, or directories of them, rescored in order")
+    parser.add_argument("--params", default=DEFAULT_PARAMS, help="params yaml of the model (default: long-term)")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="rows per chunk (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    loaded = load_model(args.params)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(("file", "serial_number", "previous_node", "node"))
+    with DriveStateStore(args.state) as store:
+        for path in expand_paths(args.inputs):
+            start = time.perf_counter()
+            invalid_cells = Counter()
+            result = rescore_file(store, loaded, path, args.chunk_size, invalid_cells)
+            writer.writerows((path, serial, previous, node) for serial, (previous, node) in result.moved.items())
+            n_drives = len(result.evaluated) + result.unchanged
+            print(f"{path}: {n_drives} drives, {len(result.evaluated)} evaluated, {len(result.moved)} moved, "
+                  f"{result.unchanged} unchanged in {time.perf_counter() - start:.1f}s"
+                  f"{describe_invalid(invalid_cells)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
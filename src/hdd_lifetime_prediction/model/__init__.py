@@ -0,0 +1,18 @@
+from ..utils.lazy import lazy_exports
+
+TYPE_CHECKING = False
+
+# imported on first use, see the package __init__
+_EXPORTS = {
+    "BatchPrediction": ".compiled",
+    "Model": ".model",
+    "SMARTAttributes": ".smartctl",
+    "TreeModel": ".model",
+}
+
+if TYPE_CHECKING:
+    from .compiled import BatchPrediction  # noqa: F401
+    from .model import Model, TreeModel  # noqa: F401
+    from .smartctl import SMARTAttributes  # noqa: F401
+
+__getattr__, __dir__ = lazy_exports(globals(), _EXPORTS)
@@ -0,0 +1,101 @@
+"""A compact struct-of-arrays file format for models.
+
+Layout, all little-endian:
+    header:  magic (8 bytes), format version (u32), number of sections (u32), CRC32 of the data region (u32),
+             padding (u32)
+    table:   per section, its name (32 bytes, NUL padded), array typecode (1 byte, as used by `array`/`struct`),
+             padding (7 bytes), offset from the start of the file (u64) and number of items (u64)
+    data:    the sections, each starting on an 8 byte boundary
+
+The "meta" section holds UTF-8 JSON. Files are memory-mapped on read, so loading is cheap and the pages are shared
+between the processes that map the same file. This module only uses the standard library; `CompiledTree` turns the
+sections into NumPy arrays.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+MAGIC = b"HDDTREE\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIII")
+SECTION = struct.Struct("<32sc7xQQ")
+ALIGNMENT = 8
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_sections(path, meta: dict, sections: dict[str, tuple[str, bytes]]):
+    """Write ``meta`` and ``{name: (typecode, little-endian bytes)}`` sections to ``path``.
+
+    The file is written next to ``path`` and renamed over it, so processes that have the old file mapped keep a
+    consistent view of it.
+    """
+    sections = {"meta": ("B", json.dumps(meta, sort_keys=True).encode()), **sections}
+
+    offset = _aligned(HEADER.size + SECTION.size * len(sections))
+    data_start = offset
+    table = []
+    data = bytearray()
+    for name, (typecode, payload) in sections.items():
+        if len(name.encode()) > 32:
+            raise ValueError(f"Section name {name!r} is longer than 32 bytes")
+        itemsize = struct.calcsize(typecode)
+        if len(payload) % itemsize:
+            raise ValueError(f"Section {name!r} is not a whole number of {typecode!r} items")
+        table.append(SECTION.pack(name.encode(), typecode.encode(), offset, len(payload) // itemsize))
+        data += payload
+        padding = _aligned(len(payload)) - len(payload)
+        data += b"\0" * padding
+        offset += len(payload) + padding
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), zlib.crc32(data), 0)
+    head = header + b"".join(table)
+    head += b"\0" * (data_start - len(head))
+
+    tmp_path = f"{os.fspath(path)}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(head)
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_sections(path) -> tuple[dict, dict[str, memoryview]]:
+    """Memory-map a file written by ``write_sections``.
+
+    Returns: the meta dictionary, and each section as a read-only memoryview cast to its typecode.
+
+    Raises:
+        ValueError: the file is not a valid model file, or this machine is big-endian and cannot map it. Loaders
+            fall back to the params yaml either way.
+    """
+    if sys.byteorder != "little":
+        raise ValueError(f"{path} cannot be mapped on a big-endian machine")
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buffer)
+
+    if len(view) < HEADER.size:
+        raise ValueError(f"{path} is not a model file")
+    magic, version, n_sections, checksum, _ = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a model file")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {version}, expected {FORMAT_VERSION}")
+    data_start = _aligned(HEADER.size + SECTION.size * n_sections)
+    if zlib.crc32(view[data_start:]) != checksum:
+        raise ValueError(f"{path} is corrupt: checksum mismatch")
+
+    sections = {}
+    for i in range(n_sections):
+        name, typecode, offset, length = SECTION.unpack_from(view, HEADER.size + i * SECTION.size)
+        typecode = typecode.decode()
+        stop = offset + length * struct.calcsize(typecode)
+        sections[name.rstrip(b"\0").decode()] = view[offset:stop].cast(typecode)
+
+    meta = json.loads(bytes(sections.pop("meta")))
+    return meta, sections
@@ -0,0 +1,52 @@
+import hashlib
+from importlib.resources import files
+from pathlib import Path
+
+from .model import TreeModel
+
+PARAMS = ("long-term-params.yaml", "short-term-params.yaml")
+
+
+def binary_path(config_yaml: Path) -> Path:
+    """Where the model file built from a params yaml lives: next to it, with a .bin suffix."""
+    return Path(config_yaml).with_suffix(".bin")
+
+
+def source_digest(config_yaml: Path) -> str:
+    with open(config_yaml, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def verify_binary(config_yaml: Path, binary: Path):
+    """Check that a model file describes exactly the same tree as the params yaml it was built from."""
+    from_yaml = TreeModel(config_yaml)
+    from_binary = TreeModel.from_binary(binary, source_sha256=source_digest(config_yaml))
+    if from_binary.config != from_yaml.config:
+        raise AssertionError(f"{binary} does not match {config_yaml}")
+    if from_binary.feature_names != from_yaml.feature_names:
+        raise AssertionError(f"{binary} orders its features differently from {config_yaml}")
+    if (from_binary.has_survival_curves != from_yaml.has_survival_curves
+            or from_binary.compiled.curves() != from_yaml.compiled.curves()):
+        raise AssertionError(f"{binary} has different lifetime curves from {config_yaml}")
+
+
+def build_binary(config_yaml: Path, binary: Path | None = None) -> Path:
+    """Compile a params yaml into a model file and verify the result.
+
+    Args:
+        config_yaml: the params yaml, which stays the editable source of truth.
+        binary: where to write the model file. Defaults to ``binary_path(config_yaml)``.
+
+    Returns: the path of the model file.
+    """
+    binary = binary or binary_path(config_yaml)
+    TreeModel(config_yaml).to_binary(binary, source_sha256=source_digest(config_yaml))
+    verify_binary(config_yaml, binary)
+    return binary
+
+
+if __name__ == "__main__":
+    # rebuild the model files shipped with the package
+    for name in PARAMS:
+        config_yaml = Path(files("hdd_lifetime_prediction.model").joinpath(name))
+        print(f"{config_yaml} -> {build_binary(config_yaml)}")
@@ -0,0 +1,154 @@
+"""Predictors generated as Python source from a compiled tree.
+
+The tree is fixed once loaded, so instead of walking its tables, each split can be written out as an ``if`` on a
+literal threshold, with the node id of every place a prediction can stop returned as a constant. The source is
+compiled once with ``compile``/``exec``; identical trees share the compiled functions.
+
+Three functions are generated per tree:
+
+- ``node_id(values)``, over the feature values returned by ``TreeModel.project``, with None for a missing value.
+- ``node_id_from_attributes(by_id)``, over ``SMARTAttributes.by_id``, reading only the attributes on the path taken.
+- ``apply(X)``, over a feature matrix, as a chain of ``np.where`` with NaN for a missing value. It evaluates every
+  split for every row, without the fancy indexing of ``CompiledTree.apply``, and returns the same positions.
+
+All three stop where ``TreeModel.predict_full`` and ``CompiledTree.apply`` stop, including at a node whose feature
+is missing. ``TreeModel`` and ``MultiModelEngine`` predict with them instead of walking the tree when the
+``HDD_LIFETIME_CODEGEN`` environment variable is set to 1, or ``set_enabled(True)`` is called.
+"""
+import math
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from .compiled import BatchPrediction, CompiledTree
+from .smartctl import split_feature_name
+
+ENABLED = os.environ.get("HDD_LIFETIME_CODEGEN", "0") == "1"
+
+FILENAME = "<generated tree>"
+
+
+def set_enabled(enabled: bool):
+    """Predict with the generated predictors, or by walking the tree, for the whole process."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def _literal(value: float) -> str:
+    # repr round-trips a float exactly. the names of the non-finite values are bound in the namespace of the source
+    if math.isnan(value):
+        return "nan"
+    if math.isinf(value):
+        return "inf" if value > 0 else "-inf"
+    return repr(float(value))
+
+
+def scalar_source(tree: CompiledTree, columns=None) -> str:
+    """The source of ``node_id`` and ``node_id_from_attributes`` for a tree.
+
+    Args:
+        tree: the tree.
+        columns: where each of ``tree.feature_names`` sits in the value tuples passed to ``node_id``, if not in the
+            same order, e.g. ``MultiModelEngine.columns``.
+    """
+    feature, threshold, lower, upper, node_ids = tree.scalar_tables(columns)
+    lookups = [split_feature_name(name) for name in tree.feature_names]
+    attribute_feature = tree.feature.tolist()
+
+    def split(i: int, depth: int, lines: list[str], load):
+        pad = "    " * depth
+        if feature[i] < 0:
+            lines.append(f"{pad}return {node_ids[i]}")
+            return
+        lines += [f"{pad}{line}" for line in load(i)]
+        lines.append(f"{pad}if x < {_literal(threshold[i])}:")
+        split(lower[i], depth + 1, lines, load)
+        lines.append(f"{pad}else:")
+        split(upper[i], depth + 1, lines, load)
+
+    def load_value(i: int) -> list[str]:
+        return [f"x = values[{feature[i]}]", "if x is None:", f"    return {node_ids[i]}"]
+
+    def load_attribute(i: int) -> list[str]:
+        smart_flag_id, smart_flag_key = lookups[attribute_feature[i]]
+        return [
+            f"a = by_id.get({smart_flag_id!r})",
+            "if a is None:",
+            f"    return {node_ids[i]}",
+            f"x = a.{smart_flag_key}",
+            "if x is None:",
+            f"    return {node_ids[i]}",
+        ]
+
+    lines = ["def node_id(values):"]
+    split(0, 1, lines, load_value)
+    lines += ["", "", "def node_id_from_attributes(by_id):"]
+    split(0, 1, lines, load_attribute)
+    return "\n".join(lines) + "\n"
+
+
+def batch_source(tree: CompiledTree) -> str:
+    """The source of ``apply`` for a tree: the position each row of a feature matrix stops at."""
+    feature = tree.feature.tolist()
+    threshold = tree.threshold.tolist()
+    lower = tree.lower.tolist()
+    upper = tree.upper.tolist()
+
+    def expression(i: int) -> str:
+        if feature[i] < 0:
+            return str(i)
+        f = feature[i]
+        lower_expression, upper_expression = expression(lower[i]), expression(upper[i])
+        return f"where(m{f}, {i}, where(c{f} < {_literal(threshold[i])}, {lower_expression}, {upper_expression}))"
+
+    lines = ["def apply(X):"]
+    if feature[0] < 0:
+        lines.append("    return zeros(X.shape[0], dtype=intp)")
+        return "\n".join(lines) + "\n"
+    # each column, and where it is missing, is read once however many splits use it
+    for f in sorted(set(f for f in feature if f >= 0)):
+        lines += [f"    c{f} = X[:, {f}]", f"    m{f} = isnan(c{f})"]
+    lines.append(f"    return asarray({expression(0)}, dtype=intp)")
+    return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=64)
+def compile_source(source: str) -> dict:
+    """Compile and run generated source, returning the namespace it defines. Cached by source."""
+    namespace = {
+        "nan": math.nan, "inf": math.inf,
+        "where": np.where, "isnan": np.isnan, "asarray": np.asarray, "zeros": np.zeros, "intp": np.intp,
+    }
+    exec(compile(source, FILENAME, "exec"), namespace)
+    return namespace
+
+
+class GeneratedTree:
+    """The generated predictors of a tree.
+
+    Args:
+        tree: the tree.
+        columns: where each of ``tree.feature_names`` sits in the value tuples passed to ``node_id``, if not in the
+            same order. ``apply`` always takes the tree's own columns.
+    """
+
+    def __init__(self, tree: CompiledTree, columns=None):
+        self.tree = tree
+        self.source = scalar_source(tree, columns) + "\n\n" + batch_source(tree)
+        namespace = compile_source(self.source)
+        self.node_id = namespace["node_id"]
+        self.node_id_from_attributes = namespace["node_id_from_attributes"]
+        self._apply = namespace["apply"]
+
+    def apply(self, feature_matrix) -> np.ndarray:
+        """Like ``CompiledTree.apply``: the position each row of ``feature_matrix`` stops at."""
+        X = np.asarray(feature_matrix, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != len(self.tree.feature_names):
+            raise ValueError(
+                f"Expected a feature matrix of shape (n, {len(self.tree.feature_names)}), got {X.shape}"
+            )
+        return self._apply(X)
+
+    def predict_batch(self, feature_matrix) -> BatchPrediction:
+        return self.tree.predictions(self.apply(feature_matrix))
@@ -0,0 +1,259 @@
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+from hdd_lifetime_prediction.utils.node import ParsedNode
+from .binary import read_sections, write_sections
+from .scalar import COLUMNS, node_fields
+
+
+@dataclass
+class BatchPrediction:
+    """Per-drive predictions for a batch, one array entry per row of the feature matrix."""
+    node: np.ndarray
+    expected_lifetime: np.ndarray
+    median_lifetime: np.ndarray
+    lower_lifetime: np.ndarray
+    upper_lifetime: np.ndarray
+    n_samples: np.ndarray
+
+    def __len__(self):
+        return len(self.node)
+
+
+def quantile_curve(node: ParsedNode) -> tuple[list[float], list[float]]:
+    """A coarse lifetime curve through the quantiles stored on a node, for models built without curves."""
+    return (
+        [0.0, node.lower_lifetime, node.median_lifetime, node.upper_lifetime],
+        [0.0, 0.025, 0.5, 0.975],
+    )
+
+
+@dataclass
+class CompiledTree:
+    """A tree flattened into parallel arrays, indexed by position rather than node id.
+
+    Leaves have a ``feature`` of -1. ``lower``/``upper`` hold the positions of the children, and ``node_ids`` maps a
+    position back to the node id used in the params yaml. A ``threshold`` of NaN stands for a split_threshold of None.
+
+    Each node's lifetime curve is stored as ``curve_times[curve_offsets[i]:curve_offsets[i + 1]]`` and the matching
+    ``curve_coefs``, the cumulative probability that the drive has failed by that time.
+    """
+    feature_names: tuple[str, ...]
+    node_ids: np.ndarray
+    feature: np.ndarray
+    threshold: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+    expected_lifetime: np.ndarray
+    median_lifetime: np.ndarray
+    lower_lifetime: np.ndarray
+    upper_lifetime: np.ndarray
+    n_samples: np.ndarray
+    curve_offsets: np.ndarray
+    curve_times: np.ndarray
+    curve_coefs: np.ndarray
+
+    @classmethod
+    def from_nodes(cls, nodes: dict[int, ParsedNode], root: int = 1,
+                   curves: dict[int, tuple[list[float], list[float]]] | None = None) -> "CompiledTree":
+        """Flatten a ``{node_id: ParsedNode}`` mapping. The root is always placed at position 0.
+
+        ``curves`` maps node ids to their ``(times, coefs)`` lifetime curve. A node without one gets a coarse curve
+        through its lower (2.5%), median and upper (97.5%) lifetimes.
+        """
+        node_ids = [root] + sorted(k for k in nodes if k != root)
+        position = {node_id: i for i, node_id in enumerate(node_ids)}
+
+        feature_names = []
+        for node_id in node_ids:
+            name = nodes[node_id].split_feature
+            if name is not None and name not in feature_names:
+                feature_names.append(name)
+
+        n = len(node_ids)
+        feature = np.full(n, -1, dtype=np.intp)
+        threshold = np.full(n, np.nan, dtype=np.float64)
+        lower = np.full(n, -1, dtype=np.intp)
+        upper = np.full(n, -1, dtype=np.intp)
+        for i, node_id in enumerate(node_ids):
+            node = nodes[node_id]
+            if node.split_threshold is not None:
+                threshold[i] = node.split_threshold
+            if node.split_feature is None:
+                continue
+            feature[i] = feature_names.index(node.split_feature)
+            lower[i] = position[node.lower_node]
+            upper[i] = position[node.upper_node]
+
+        curve_times = []
+        curve_coefs = []
+        curve_offsets = [0]
+        for node_id in node_ids:
+            times, coefs = (curves or {}).get(node_id) or quantile_curve(nodes[node_id])
+            curve_times += times
+            curve_coefs += coefs
+            curve_offsets.append(len(curve_times))
+
+        def column(attr, dtype=np.float64):
+            return np.array([getattr(nodes[node_id], attr) for node_id in node_ids], dtype=dtype)
+
+        return cls(
+            feature_names=tuple(feature_names),
+            node_ids=np.array(node_ids, dtype=np.int64),
+            feature=feature,
+            threshold=threshold,
+            lower=lower,
+            upper=upper,
+            expected_lifetime=column("expected_lifetime"),
+            median_lifetime=column("median_lifetime"),
+            lower_lifetime=column("lower_lifetime"),
+            upper_lifetime=column("upper_lifetime"),
+            n_samples=column("n_samples", np.int64),
+            curve_offsets=np.array(curve_offsets, dtype=np.int64),
+            curve_times=np.array(curve_times, dtype=np.float64),
+            curve_coefs=np.array(curve_coefs, dtype=np.float64),
+        )
+
+    def curves(self) -> dict[int, tuple[list[float], list[float]]]:
+        """The ``(times, coefs)`` lifetime curve of every node, by node id."""
+        return {
+            node_id: (self.curve_times[start:stop].tolist(), self.curve_coefs[start:stop].tolist())
+            for node_id, start, stop in zip(
+                self.node_ids.tolist(), self.curve_offsets[:-1].tolist(), self.curve_offsets[1:].tolist()
+            )
+        }
+
+    def positions(self, node_ids) -> np.ndarray:
+        """Map node ids, e.g. ``BatchPrediction.node``, back to positions."""
+        order = np.argsort(self.node_ids)
+        return order[np.searchsorted(self.node_ids, node_ids, sorter=order)]
+
+    def lifetime_quantiles(self, positions, quantiles) -> np.ndarray:
+        """Times by which each drive has failed with the given probabilities.
+
+        Args:
+            positions: the tree position of each drive, shape (n_drives,).
+            quantiles: probabilities in [0, 1], shape (n_quantiles,).
+
+        Returns: an array of shape (n_drives, n_quantiles), NaN for the probabilities outside the node's curve, e.g.
+            above 0.975 for a ``quantile_curve``.
+        """
+        quantiles = np.atleast_1d(np.asarray(quantiles, dtype=np.float64))
+        return self._per_node(
+            positions, lambda times, coefs: np.interp(quantiles, coefs, times, left=np.nan, right=np.nan),
+            len(quantiles),
+        )
+
+    def survival_probability(self, positions, horizons) -> np.ndarray:
+        """The probability that each drive is still alive after each horizon (in days).
+
+        Args:
+            positions: the tree position of each drive, shape (n_drives,).
+            horizons: times in days, shape (n_horizons,).
+
+        Returns: an array of shape (n_drives, n_horizons), NaN for the horizons outside the node's curve, e.g. past
+            the upper lifetime for a ``quantile_curve``. The curve says nothing of how many drives last that long.
+        """
+        horizons = np.atleast_1d(np.asarray(horizons, dtype=np.float64))
+        return self._per_node(
+            positions, lambda times, coefs: 1.0 - np.interp(horizons, times, coefs, left=np.nan, right=np.nan),
+            len(horizons),
+        )
+
+    def _per_node(self, positions, evaluate, n_columns: int) -> np.ndarray:
+        # drives only reach a handful of nodes, so evaluate each node's curve once and fan the rows out
+        unique, inverse = np.unique(np.asarray(positions), return_inverse=True)
+        if not len(unique):
+            return np.empty((0, n_columns))
+        rows = np.stack([
+            evaluate(
+                self.curve_times[self.curve_offsets[i]:self.curve_offsets[i + 1]],
+                self.curve_coefs[self.curve_offsets[i]:self.curve_offsets[i + 1]],
+            )
+            for i in unique.tolist()
+        ])
+        return rows[inverse.reshape(-1)]
+
+    def to_nodes(self) -> dict[int, ParsedNode]:
+        """The inverse of ``from_nodes``."""
+        columns = {name: getattr(self, name).tolist() for name in COLUMNS}
+        return {node_id: ParsedNode(**fields) for node_id, fields in node_fields(self.feature_names, columns).items()}
+
+    def to_binary(self, path, **meta):
+        """Write the arrays to a model file (see ``binary``). ``meta`` is stored alongside the feature names."""
+        sections = {}
+        for f in fields(self):
+            if f.name == "feature_names":
+                continue
+            array = getattr(self, f.name)
+            typecode = "d" if array.dtype.kind == "f" else "q"
+            sections[f.name] = (typecode, array.astype("<" + typecode).tobytes())
+        write_sections(path, {**meta, "feature_names": list(self.feature_names)}, sections)
+
+    @classmethod
+    def from_binary(cls, path) -> tuple["CompiledTree", dict]:
+        """Memory-map a model file written by ``to_binary``. The arrays are read-only views of the mapping.
+
+        Returns: the tree, and the meta dictionary it was written with.
+        """
+        meta, sections = read_sections(path)
+        missing = {f.name for f in fields(cls)} - {"feature_names"} - set(sections)
+        if missing:
+            raise ValueError(f"{path} is missing the sections {sorted(missing)}, rebuild it")
+        arrays = {
+            f.name: np.frombuffer(sections[f.name], dtype=np.float64 if sections[f.name].format == "d" else np.int64)
+            for f in fields(cls)
+            if f.name != "feature_names"
+        }
+        return cls(feature_names=tuple(meta.pop("feature_names")), **arrays), meta
+
+    def scalar_tables(self, columns=None) -> tuple[list, list, list, list, list]:
+        """The arrays as plain lists for ``walk``, which is faster than NumPy for a single drive.
+
+        Args:
+            columns: where each of ``feature_names`` sits in the value tuples that will be walked, if not in the
+                same order.
+        """
+        feature = self.feature.tolist()
+        if columns is not None:
+            feature = [columns[f] if f >= 0 else -1 for f in feature]
+        return feature, self.threshold.tolist(), self.lower.tolist(), self.upper.tolist(), self.node_ids.tolist()
+
+    def apply(self, feature_matrix) -> np.ndarray:
+        """Route every row of ``feature_matrix`` through the tree and return the position each row stops at.
+
+        Rows are moved down one level at a time. A NaN feature value means the attribute is missing, and the row
+        stops at the node that needed it, as ``TreeModel.predict`` does.
+        """
+        X = np.asarray(feature_matrix, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != len(self.feature_names):
+            raise ValueError(
+                f"Expected a feature matrix of shape (n, {len(self.feature_names)}), got {X.shape}"
+            )
+
+        position = np.zeros(X.shape[0], dtype=np.intp)
+        active = np.arange(X.shape[0]) if self.feature[0] >= 0 else np.empty(0, dtype=np.intp)
+        while active.size:
+            current = position[active]
+            values = X[active, self.feature[current]]
+            missing = np.isnan(values)
+            child = np.where(values < self.threshold[current], self.lower[current], self.upper[current])
+            position[active] = np.where(missing, current, child)
+            active = active[~missing]
+            active = active[self.feature[position[active]] >= 0]
+        return position
+
+    def predict_batch(self, feature_matrix) -> BatchPrediction:
+        return self.predictions(self.apply(feature_matrix))
+
+    def predictions(self, position) -> BatchPrediction:
+        """The statistics of the nodes at ``position``, e.g. as returned by ``apply``."""
+        return BatchPrediction(
+            node=self.node_ids[position],
+            expected_lifetime=self.expected_lifetime[position],
+            median_lifetime=self.median_lifetime[position],
+            lower_lifetime=self.lower_lifetime[position],
+            upper_lifetime=self.upper_lifetime[position],
+            n_samples=self.n_samples[position],
+        )
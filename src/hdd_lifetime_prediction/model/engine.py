@@ -0,0 +1,101 @@
+from functools import cached_property
+from importlib.resources import files
+
+import numpy as np
+
+from hdd_lifetime_prediction.utils.node import ParsedNode
+from . import codegen
+from .codegen import GeneratedTree
+from .compiled import BatchPrediction
+from .model import TreeModel
+from .registry import registry
+from .scalar import walk
+from .smartctl import SMARTAttributes, smartctl_json_features, split_feature_name
+
+DEFAULT_PARAMS = {
+    "long-term": files("hdd_lifetime_prediction.model").joinpath("long-term-params.yaml"),
+    "short-term": files("hdd_lifetime_prediction.model").joinpath("short-term-params.yaml"),
+}
+
+
+class MultiModelEngine:
+    """Evaluates several trees over one shared feature vector.
+
+    The SMART attributes of a drive are projected once onto the union of the split features of all the trees, and
+    each tree then reads its own columns of that vector, so adding a tree costs one traversal and no extra attribute
+    lookups.
+
+    Args:
+        models: the trees to evaluate, by name. Results are returned under the same names.
+    """
+
+    def __init__(self, models: dict[str, TreeModel]):
+        self.models = dict(models)
+        feature_names = []
+        for model in self.models.values():
+            feature_names += [name for name in model.feature_names if name not in feature_names]
+        self.feature_names = tuple(feature_names)
+        # the columns of the shared feature vector each tree reads, in the tree's own feature order
+        self.columns = {
+            name: [self.feature_names.index(feature) for feature in model.feature_names]
+            for name, model in self.models.items()
+        }
+        # each tree's scalar tables, indexing straight into the shared feature vector
+        self._tables = {
+            name: model.compiled.scalar_tables(self.columns[name]) for name, model in self.models.items()
+        }
+        self._lookups = [split_feature_name(name) for name in self.feature_names]
+
+    @cached_property
+    def _generated(self) -> dict[str, GeneratedTree]:
+        # each tree's generated predictors, reading straight from the shared feature vector
+        return {name: GeneratedTree(model.compiled, self.columns[name]) for name, model in self.models.items()}
+
+    @classmethod
+    def from_params(cls, params: dict[str, str] | None = None) -> "MultiModelEngine":
+        """Load an engine from params yaml paths by name, defaulting to the shipped long- and short-term trees."""
+        return cls({name: registry.get(path).model for name, path in (params or DEFAULT_PARAMS).items()})
+
+    def project(self, smart_attributes: SMARTAttributes) -> tuple[float | None, ...]:
+        """The values of ``feature_names`` for a drive, None where missing."""
+        by_id = smart_attributes.by_id
+        values = []
+        for smart_flag_id, smart_flag_key in self._lookups:
+            attr = by_id.get(smart_flag_id)
+            values.append(None if attr is None else getattr(attr, smart_flag_key))
+        return tuple(values)
+
+    def predict_full(self, smart_attributes: SMARTAttributes) -> dict[str, ParsedNode]:
+        """The node each tree reaches for a drive, by tree name."""
+        values = self.project(smart_attributes)
+        result = {}
+        generated = self._generated if codegen.ENABLED else None
+        for name, model in self.models.items():
+            node_id = generated[name].node_id(values) if generated else walk(self._tables[name], values)
+            model.node_hits.add(node_id)
+            result[name] = model.config[node_id]
+        return result
+
+    def predict(self, smart_attributes: SMARTAttributes) -> dict[str, float]:
+        """The expected lifetime of a drive according to each tree, by tree name."""
+        return {name: node.expected_lifetime for name, node in self.predict_full(smart_attributes).items()}
+
+    def features(self, smart_attributes: SMARTAttributes) -> np.ndarray:
+        """The shared feature vector of a drive. Missing attributes are NaN."""
+        return np.array([np.nan if v is None else v for v in self.project(smart_attributes)], dtype=np.float64)
+
+    def features_from_json(self, document) -> np.ndarray:
+        """Like ``features``, but read straight from a ``smartctl -A -j`` document."""
+        return np.array(smartctl_json_features(document, self.feature_names), dtype=np.float64)
+
+    def feature_matrix(self, smart_attributes_list) -> np.ndarray:
+        """Stack ``features`` for many drives into a matrix suitable for ``predict_batch``."""
+        matrix = np.full((len(smart_attributes_list), len(self.feature_names)), np.nan)
+        for i, smart_attributes in enumerate(smart_attributes_list):
+            matrix[i] = self.features(smart_attributes)
+        return matrix
+
+    def predict_batch(self, feature_matrix) -> dict[str, BatchPrediction]:
+        """Predict every row of a shared feature matrix with every tree, by tree name."""
+        X = np.asarray(feature_matrix, dtype=np.float64)
+        return {name: model.predict_batch(X[:, self.columns[name]]) for name, model in self.models.items()}
@@ -1,5 +1,10 @@
+from dataclasses import asdict
+
+import numpy as np
+
 from .smartctl import SMARTAttributes
-from .model import Model
+from .model import Model, TreeModel
+from .compiled import BatchPrediction
 
 def predict_lifetime(
     smart_attributes: SMARTAttributes,
@@ -33,6 +38,48 @@ def predict_full(
     return model.predict_full(smart_attributes)
 
 
+def predict_batch(
+    smart_attributes_list: list[SMARTAttributes],
+    model: TreeModel
+) -> BatchPrediction:
+    """Predict the lifetimes of many hard drives at once.
+
+    Args:
+        smart_attributes_list (list[SMARTAttributes]): The SMART attributes of each hard drive.
+        model (TreeModel): The model used to predict the lifetimes.
+
+    Returns:
+        BatchPrediction: The predicted lifetime statistics, one entry per hard drive.
+    """
+    return model.predict_batch(model.feature_matrix(smart_attributes_list))
+
+
+def batch_results(
+    keys: list,
+    prediction: BatchPrediction,
+    model: TreeModel
+) -> dict:
+    """The single-drive response of each hard drive of a batch, as the batch endpoint returns them.
+
+    Args:
+        keys (list): The key of each hard drive, in the order of the prediction.
+        prediction (BatchPrediction): The prediction of the hard drives.
+        model (TreeModel): The model that made the prediction.
+
+    Returns:
+        dict: ``{key: {"predicted_lifetime": ..., "predicted_stats": ...}}``.
+    """
+    # Drives share a handful of nodes, so build each node's response once and reuse it
+    node_results = {}
+    for node_id in np.unique(prediction.node).tolist():
+        node = model.config[node_id]
+        node_results[node_id] = {
+            "predicted_lifetime": node.expected_lifetime,
+            "predicted_stats": asdict(node),
+        }
+    return {key: node_results[node_id] for key, node_id in zip(keys, prediction.node.tolist())}
+
+
 if __name__ == "__main__":
     from .smartctl import parse_smartctl
     from .model import TreeModel
@@ -1,10 +1,21 @@
 from abc import ABC, abstractmethod
+from functools import cached_property
 
+from hdd_lifetime_prediction.utils import metrics
+from hdd_lifetime_prediction.utils.metrics import Tally
 from hdd_lifetime_prediction.utils.node import ParsedNode
-from .smartctl import SMARTAttributes
+from . import codegen
+from .codegen import GeneratedTree
+from .compiled import BatchPrediction, CompiledTree
+from .scalar import walk
+from .smartctl import SMARTAttributes, smartctl_json_features, split_feature_name
+import numpy as np
 import yaml
 from pathlib import Path
 
+# the libyaml parser, when PyYAML was built with it, reads params with full lifetime curves many times faster
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 class Model(ABC):
     @abstractmethod
@@ -13,59 +24,245 @@ class Model(ABC):
 
 class TreeModel(Model):
     def __init__(self, config_yaml: Path):
-        self.config = {}
+        config = {}
+        curves = {}
         with open(config_yaml) as f:
             # load the yaml config and change the config items to ParsedNode
-            _config = yaml.safe_load(f)
+            _config = yaml.load(f, Loader=SafeLoader)
             for key, value in _config.items():
-                self.config[key] = ParsedNode(**value)
+                # the lifetime curve, if the params were extracted with it, is kept out of the ParsedNode
+                times = value.pop("survival_times", None)
+                coefs = value.pop("survival_coefs", None)
+                if times is not None and coefs is not None:
+                    curves[key] = (times, coefs)
+                config[key] = ParsedNode(**value)
+        self._set_nodes(config, curves)
+
+    @classmethod
+    def from_nodes(cls, nodes: dict[int, ParsedNode],
+                   curves: dict[int, tuple[list[float], list[float]]] | None = None) -> "TreeModel":
+        """Build a model straight from parsed nodes, e.g. those extracted by ``nodeparser``, without a params yaml.
+
+        Args:
+            nodes: the nodes by node id, the root being node 1.
+            curves: the ``(times, coefs)`` lifetime curve of each node, by node id.
+        """
+        model = cls.__new__(cls)
+        model._set_nodes(dict(nodes), curves or {})
+        return model
+
+    def _set_nodes(self, config: dict[int, ParsedNode], curves: dict[int, tuple[list[float], list[float]]]):
+        self.config = config
+        # without curves for every node, the curves are approximated from the stored quantiles
+        self.has_survival_curves = len(curves) == len(self.config)
+        self.compiled = CompiledTree.from_nodes(self.config, curves=curves if self.has_survival_curves else None)
+        # how many predictions ended at each node, by node id
+        self.node_hits = Tally()
+
+    @classmethod
+    def from_binary(cls, path: Path, source_sha256: str | None = None) -> "TreeModel":
+        """Load a model file written by ``to_binary``. The file is memory-mapped rather than parsed.
+
+        Args:
+            path: the model file.
+            source_sha256: if given, the file must have been built from a params yaml with this SHA-256 hex digest,
+                otherwise a ValueError is raised because the file is stale.
+        """
+        compiled, meta = CompiledTree.from_binary(path)
+        if source_sha256 is not None and meta.get("source_sha256") != source_sha256:
+            raise ValueError(f"{path} was not built from the given params yaml")
+        model = cls.__new__(cls)
+        model.config = compiled.to_nodes()
+        model.has_survival_curves = meta.get("has_survival_curves", False)
+        model.compiled = compiled
+        model.node_hits = Tally()
+        return model
+
+    def to_binary(self, path: Path, source_sha256: str | None = None):
+        """Write the model to a memory-mappable model file, recording the digest of the yaml it was built from."""
+        self.compiled.to_binary(path, source_sha256=source_sha256, has_survival_curves=self.has_survival_curves)
+
+    @property
+    def feature_names(self) -> tuple[str, ...]:
+        """The split features of the tree, in the column order expected by ``predict_batch``."""
+        return self.compiled.feature_names
 
     @staticmethod
-    def get_attribute(attr_name, smart_attributes: SMARTAttributes) -> str | None:
-        """ from an attr_name like "smart_5_raw" or "smart_7_normalized" get the value from the SMARTAttributes object
+    def get_attribute(attr_name, smart_attributes: SMARTAttributes) -> float | None:
+        """ from an attr_name like "smart_5_raw" or "smart_7_normalized" get the numeric value from the SMARTAttributes
+        object, or None if the drive does not report it
         """
-        smart_flag_id = attr_name.split("_")[1]
-        smart_flag_key = attr_name.split("_")[2]
-        for attr in smart_attributes.attributes:
-            if attr.id == smart_flag_id:
-                return getattr(attr, smart_flag_key)
-        return None
+        smart_flag_id, smart_flag_key = split_feature_name(attr_name)
+        attr = smart_attributes.by_id.get(smart_flag_id)
+        if attr is None:
+            return None
+        return getattr(attr, smart_flag_key)
 
 
     def predict(self, smart_attributes: SMARTAttributes):
+        if codegen.ENABLED:
+            node_id = self.generated.node_id_from_attributes(smart_attributes.by_id)
+            self.node_hits.add(node_id)
+            return self.config[node_id].expected_lifetime
+
         # Initialize the lifetime prediction to the root node
-        current_node: ParsedNode = self.config[1]
+        node_id = 1
+        current_node: ParsedNode = self.config[node_id]
 
         # Traverse the tree until a leaf node is reached
         while current_node.split_feature is not None:
             # Get the attribute value from the SMART attributes
             attr_value = self.get_attribute(current_node.split_feature, smart_attributes)
-            if not attr_value:
-                return current_node.expected_lifetime
+            if attr_value is None:
+                break
             # Determine which child node to traverse to
-            if float(attr_value) < current_node.split_threshold:
-                current_node = self.config[current_node.lower_node]
+            if attr_value < current_node.split_threshold:
+                node_id = current_node.lower_node
             else:
-                current_node = self.config[current_node.upper_node]
+                node_id = current_node.upper_node
+            current_node = self.config[node_id]
 
+        self.node_hits.add(node_id)
         # Return the predicted lifetime
         return current_node.expected_lifetime
 
     def predict_full(self, smart_attributes: SMARTAttributes):
+        if codegen.ENABLED:
+            node_id = self.generated.node_id_from_attributes(smart_attributes.by_id)
+            self.node_hits.add(node_id)
+            return self.config[node_id]
+
         # Initialize the lifetime prediction to the root node
-        current_node: ParsedNode = self.config[1]
+        node_id = 1
+        current_node: ParsedNode = self.config[node_id]
 
         # Traverse the tree until a leaf node is reached
         while current_node.split_feature is not None:
             # Get the attribute value from the SMART attributes
             attr_value = self.get_attribute(current_node.split_feature, smart_attributes)
-            if not attr_value:
-                return current_node
+            if attr_value is None:
+                break
             # Determine which child node to traverse to
-            if float(attr_value) < current_node.split_threshold:
-                current_node = self.config[current_node.lower_node]
+            if attr_value < current_node.split_threshold:
+                node_id = current_node.lower_node
             else:
-                current_node = self.config[current_node.upper_node]
+                node_id = current_node.upper_node
+            current_node = self.config[node_id]
 
+        self.node_hits.add(node_id)
         # Return the predicted lifetime
         return current_node
+
+    def project(self, smart_attributes: SMARTAttributes) -> tuple[float | None, ...]:
+        """The values of ``feature_names`` for a drive, None where missing. This is all a prediction depends on."""
+        return tuple(self.get_attribute(name, smart_attributes) for name in self.feature_names)
+
+    @cached_property
+    def scalar_tables(self):
+        return self.compiled.scalar_tables()
+
+    def predict_node_id(self, values: tuple[float | None, ...]) -> int:
+        """The id of the node ``predict_full`` stops at, for the values returned by ``project``."""
+        node_id = self.generated.node_id(values) if codegen.ENABLED else walk(self.scalar_tables, values)
+        self.node_hits.add(node_id)
+        return node_id
+
+    @cached_property
+    def generated(self) -> GeneratedTree:
+        """The tree as straight-line Python (see ``codegen``), generated and compiled on first use."""
+        return GeneratedTree(self.compiled)
+
+    def features(self, smart_attributes: SMARTAttributes) -> np.ndarray:
+        """Project the SMART attributes onto ``feature_names``. Missing attributes are NaN."""
+        row = np.full(len(self.feature_names), np.nan)
+        for i, name in enumerate(self.feature_names):
+            attr_value = self.get_attribute(name, smart_attributes)
+            if attr_value is not None:
+                row[i] = attr_value
+        return row
+
+    def features_from_json(self, document) -> np.ndarray:
+        """Like ``features``, but read straight from a ``smartctl -A -j`` document without building SMARTAttributes."""
+        return np.array(smartctl_json_features(document, self.feature_names), dtype=np.float64)
+
+    def feature_matrix(self, smart_attributes_list) -> np.ndarray:
+        """Stack ``features`` for many drives into a matrix suitable for ``predict_batch``."""
+        matrix = np.full((len(smart_attributes_list), len(self.feature_names)), np.nan)
+        for i, smart_attributes in enumerate(smart_attributes_list):
+            matrix[i] = self.features(smart_attributes)
+        return matrix
+
+    def predict_batch(self, feature_matrix) -> BatchPrediction:
+        """Predict every row of a feature matrix at once.
+
+        Args:
+            feature_matrix: array of shape (n_drives, len(feature_names)), with NaN for missing attributes.
+
+        Returns:
+            BatchPrediction: arrays of the reached node ids and their lifetime statistics, matching
+            ``predict``/``predict_full`` for each row.
+        """
+        if codegen.ENABLED:
+            prediction = self.generated.predict_batch(feature_matrix)
+        else:
+            prediction = self.compiled.predict_batch(feature_matrix)
+        if metrics.ENABLED:
+            node_ids, counts = np.unique(prediction.node, return_counts=True)
+            self.node_hits.update(dict(zip(node_ids.tolist(), counts.tolist())))
+        return prediction
+
+    def split_feature_hits(self) -> tuple[dict[str, int], dict[str, int]]:
+        """How often each split feature was read, derived from ``node_hits``.
+
+        Returns: per feature, the number of times a prediction compared it against a threshold, and the number of
+            times a prediction stopped because the drive did not report it.
+        """
+        compared = dict.fromkeys(self.feature_names, 0)
+        missing = dict.fromkeys(self.feature_names, 0)
+        for node_id, hits in self.node_hits.snapshot().items():
+            for feature in self._split_path[node_id]:
+                compared[feature] += hits
+            split_feature = self.config[node_id].split_feature
+            if split_feature is not None:
+                missing[split_feature] += hits
+        return compared, missing
+
+    @cached_property
+    def _split_path(self) -> dict[int, tuple[str, ...]]:
+        # the split features compared on the way from the root to each node
+        paths = {1: ()}
+        stack = [1]
+        while stack:
+            node = self.config[stack[-1]]
+            path = paths[stack.pop()] + (node.split_feature,)
+            for child in (node.lower_node, node.upper_node):
+                if child is not None:
+                    paths[child] = path
+                    stack.append(child)
+        return paths
+
+    def lifetime_quantiles(self, node_ids, quantiles) -> np.ndarray:
+        """Times (in days) by which each drive has failed with each probability, e.g. 0.5 for the median lifetime.
+
+        Args:
+            node_ids: the node each drive reached, e.g. ``BatchPrediction.node``.
+            quantiles: the failure probabilities, in [0, 1].
+
+        Returns:
+            np.ndarray: shape (len(node_ids), len(quantiles)). Without ``has_survival_curves`` the curves are
+            interpolated between the 2.5%, 50% and 97.5% lifetimes. Probabilities beyond a node's curve are NaN.
+        """
+        return self.compiled.lifetime_quantiles(self.compiled.positions(node_ids), quantiles)
+
+    def survival_probability(self, node_ids, horizons) -> np.ndarray:
+        """Probability that each drive is still alive after each horizon.
+
+        Args:
+            node_ids: the node each drive reached, e.g. ``BatchPrediction.node``.
+            horizons: the horizons, in days.
+
+        Returns:
+            np.ndarray: shape (len(node_ids), len(horizons)). Horizons beyond a node's curve, past the 97.5% lifetime
+            without ``has_survival_curves``, are NaN.
+        """
+        return self.compiled.survival_probability(self.compiled.positions(node_ids), horizons)
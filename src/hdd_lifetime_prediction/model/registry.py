@@ -0,0 +1,113 @@
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from hdd_lifetime_prediction.utils.metrics import MODEL_LOAD_SECONDS
+from .build import binary_path
+from .model import TreeModel
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    """A model together with the file state it was loaded from."""
+    model: TreeModel
+    path: str
+    mtime_ns: int
+    version: str
+
+
+def load_model(path) -> LoadedModel:
+    """Load a TreeModel and tag it with a version derived from the file name and contents.
+
+    When the model file built from the params yaml (see ``build``) is up to date it is memory-mapped instead of
+    parsing the yaml.
+    """
+    path = os.fspath(path)
+    mtime_ns = os.stat(path).st_mtime_ns
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    start = time.perf_counter()
+    try:
+        model = TreeModel.from_binary(binary_path(path), source_sha256=digest)
+        model_format = "binary"
+    except (OSError, ValueError):
+        model = TreeModel(path)
+        model_format = "yaml"
+    MODEL_LOAD_SECONDS.observe(time.perf_counter() - start, (model_format,))
+    return LoadedModel(
+        model=model,
+        path=path,
+        mtime_ns=mtime_ns,
+        version=f"{Path(path).stem}:{digest[:12]}",
+    )
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded models, keyed by params file path.
+
+    Each file is loaded once. A daemon thread polls the modification times of the loaded files and, when one changes,
+    loads the new model off the request path and swaps it in with a single assignment. Callers should fetch the
+    ``LoadedModel`` once per request so the model and its version always agree.
+    """
+
+    def __init__(self, poll_interval: float = 5.0):
+        self.poll_interval = poll_interval
+        self._models: dict[str, LoadedModel] = {}
+        self._lock = threading.Lock()
+        self._watcher: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def get(self, path) -> LoadedModel:
+        path = os.fspath(path)
+        loaded = self._models.get(path)
+        if loaded is not None:
+            return loaded
+        with self._lock:
+            loaded = self._models.get(path)
+            if loaded is None:
+                loaded = load_model(path)
+                self._models[path] = loaded
+            if self.poll_interval and self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="model-registry-watcher", daemon=True)
+                self._watcher.start()
+        return loaded
+
+    def loaded(self) -> list[LoadedModel]:
+        """The models currently loaded."""
+        return list(self._models.values())
+
+    def reload(self, path=None) -> list[LoadedModel]:
+        """Reload the models whose file changed since they were loaded, or ``path`` unconditionally.
+
+        Returns the newly loaded models. When polling, a file that fails to load (e.g. it is half written) keeps
+        serving its previous model and is retried on the next poll.
+        """
+        if path is not None:
+            loaded = load_model(path)
+            self._models[loaded.path] = loaded
+            return [loaded]
+
+        reloaded = []
+        for p, current in list(self._models.items()):
+            try:
+                if os.stat(p).st_mtime_ns == current.mtime_ns:
+                    continue
+                loaded = load_model(p)
+            except Exception:
+                continue
+            self._models[p] = loaded
+            reloaded.append(loaded)
+        return reloaded
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch(self):
+        while not self._stopped.wait(self.poll_interval):
+            self.reload()
+
+
+registry = ModelRegistry(poll_interval=float(os.environ.get("HDD_LIFETIME_MODEL_POLL_INTERVAL", 5.0)))
@@ -0,0 +1,112 @@
+"""Single-drive prediction from a model file, with the standard library only.
+
+``CompiledTree`` turns a model file (see ``binary``) into NumPy arrays. Here the same sections are read into plain
+lists, which is all predicting a handful of drives needs, so short-lived processes such as the
+``hdd-lifetime-predict`` command do not pay for importing NumPy and PyYAML.
+"""
+import hashlib
+import os
+
+from .binary import read_sections
+from .smartctl import split_feature_name
+
+# the per-node statistics of a model file, named as on ParsedNode
+STATISTICS = ("expected_lifetime", "n_samples", "median_lifetime", "lower_lifetime", "upper_lifetime")
+COLUMNS = ("node_ids", "feature", "threshold", "lower", "upper") + STATISTICS
+
+
+def walk(tables: tuple[list, list, list, list, list], values) -> int:
+    """The node id a single drive reaches, given ``CompiledTree.scalar_tables`` and its feature values.
+
+    A value of None means the attribute is missing, and the walk stops at the node that needed it.
+    """
+    feature, threshold, lower, upper, node_ids = tables
+    i = 0
+    while (f := feature[i]) >= 0:
+        value = values[f]
+        if value is None:
+            break
+        i = lower[i] if value < threshold[i] else upper[i]
+    return node_ids[i]
+
+
+def node_fields(feature_names: tuple[str, ...], columns: dict[str, list]) -> dict[int, dict]:
+    """The fields of each node's ``ParsedNode``, by node id, from the ``COLUMNS`` of a model file as lists."""
+    node_ids = columns["node_ids"]
+    feature = columns["feature"]
+    threshold = columns["threshold"]
+    lower = columns["lower"]
+    upper = columns["upper"]
+
+    nodes = {}
+    for i, node_id in enumerate(node_ids):
+        is_leaf = feature[i] < 0
+        nodes[node_id] = {
+            "split_feature": None if is_leaf else feature_names[feature[i]],
+            "split_threshold": None if threshold[i] != threshold[i] else threshold[i],
+            "lower_node": None if is_leaf else node_ids[lower[i]],
+            "upper_node": None if is_leaf else node_ids[upper[i]],
+            **{name: columns[name][i] for name in STATISTICS},
+        }
+    return nodes
+
+
+class ScalarTree:
+    """A tree held in plain lists: its walk tables and the fields of every node.
+
+    Args:
+        feature_names: the split features, in the order ``predict_node_id`` takes their values.
+        columns: the ``COLUMNS`` of a model file, as lists.
+    """
+
+    def __init__(self, feature_names: tuple[str, ...], columns: dict[str, list]):
+        self.feature_names = feature_names
+        self.tables = tuple(columns[name] for name in ("feature", "threshold", "lower", "upper", "node_ids"))
+        self.nodes = node_fields(feature_names, columns)
+        self._lookups = [split_feature_name(name) for name in feature_names]
+
+    @classmethod
+    def from_binary(cls, path, source_sha256: str | None = None) -> "ScalarTree":
+        """Read a model file. As for ``TreeModel.from_binary``, a ValueError is raised if it was not built from the
+        params yaml with the SHA-256 hex digest ``source_sha256``."""
+        meta, sections = read_sections(path)
+        if source_sha256 is not None and meta.get("source_sha256") != source_sha256:
+            raise ValueError(f"{path} was not built from the given params yaml")
+        missing = set(COLUMNS) - set(sections)
+        if missing:
+            raise ValueError(f"{path} is missing the sections {sorted(missing)}, rebuild it")
+        return cls(tuple(meta["feature_names"]), {name: sections[name].tolist() for name in COLUMNS})
+
+    @classmethod
+    def from_compiled(cls, compiled) -> "ScalarTree":
+        """The lists of a ``CompiledTree``."""
+        return cls(compiled.feature_names, {name: getattr(compiled, name).tolist() for name in COLUMNS})
+
+    def project(self, by_id: dict) -> tuple[float | None, ...]:
+        """The values of ``feature_names`` for a drive, from ``SMARTAttributes.by_id``, None where missing."""
+        values = []
+        for smart_flag_id, smart_flag_key in self._lookups:
+            attr = by_id.get(smart_flag_id)
+            values.append(None if attr is None else getattr(attr, smart_flag_key))
+        return tuple(values)
+
+    def predict_node_id(self, values: tuple[float | None, ...]) -> int:
+        return walk(self.tables, values)
+
+
+def load(config_yaml) -> tuple[ScalarTree, str]:
+    """Load a params yaml from the model file built next to it, tagged with a version as ``registry.load_model`` does.
+
+    When the model file is missing or out of date, the yaml is parsed instead, which imports NumPy and PyYAML.
+    """
+    config_yaml = os.fspath(config_yaml)
+    with open(config_yaml, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    try:
+        # see build.binary_path, which needs pathlib
+        tree = ScalarTree.from_binary(os.path.splitext(config_yaml)[0] + ".bin", source_sha256=digest)
+    except (OSError, ValueError):
+        from .model import TreeModel
+        tree = ScalarTree.from_compiled(TreeModel(config_yaml).compiled)
+    stem = os.path.splitext(os.path.basename(config_yaml))[0]
+    return tree, f"{stem}:{digest[:12]}"
@@ -1,19 +1,90 @@
+import codecs
+import json
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 
+HEADER_PATTERN = re.compile(r"ID#.*ATTRIBUTE_NAME.*VALUE.*RAW_VALUE")
+DOCUMENT_SEPARATOR = re.compile(r"^==> (.+) <==\s*$")
+# the leading number of a raw value such as "33 (Min/Max 23/37)"
+LEADING_NUMBER = re.compile(r"[-+]?\d+(?:\.\d*)?")
+# a line break followed by what can only start a top-level value: smartctl -j indents everything in a document but
+# its opening and closing braces, and newline delimited documents start at column 0
+TOP_LEVEL_LINE = re.compile(r"\n(?=[^\s}\],])")
 
-@dataclass
+
+def parse_number(value: str) -> float | None:
+    """Convert a SMART value column to a number, or None if it is empty or not numeric.
+
+    Raw values may carry a vendor-specific suffix, e.g. "33 (Min/Max 23/37)", in which case the leading number is
+    used.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        match = LEADING_NUMBER.match(value)
+        return float(match.group()) if match else None
+
+
+@lru_cache(maxsize=None)
+def split_feature_name(attr_name: str) -> tuple[str, str]:
+    """ "smart_5_raw" -> ("5", "raw_value"): the SMART ID and the SMARTAttribute field holding the value """
+    _, smart_flag_id, smart_flag_key = attr_name.split("_")
+    return smart_flag_id, f"{smart_flag_key}_value"
+
+
+@dataclass(slots=True)
 class SMARTAttribute:
     id: str
     name: str
     raw: str
     normalized: str
     worst: str
+    # numeric versions of raw/normalized/worst, parsed once on construction
+    raw_value: float | None = field(init=False, repr=False)
+    normalized_value: float | None = field(init=False, repr=False)
+    worst_value: float | None = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.raw_value = parse_number(self.raw)
+        self.normalized_value = parse_number(self.normalized)
+        self.worst_value = parse_number(self.worst)
 
 
 @dataclass
 class SMARTAttributes:
     attributes: list[SMARTAttribute]
+    # attributes by ID, built on construction. If an ID repeats, the first attribute wins.
+    by_id: dict[str, SMARTAttribute] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.by_id = {}
+        for attr in self.attributes:
+            self.by_id.setdefault(attr.id, attr)
+
+
+@lru_cache(maxsize=64)
+def column_layout(header: str) -> tuple[slice, slice, slice, slice, slice]:
+    """Slices of the ID#, ATTRIBUTE_NAME, RAW_VALUE, VALUE and WORST columns for a header line.
+
+    Drives only emit a handful of distinct headers, so layouts are cached by the header string.
+    """
+    # Parse the header lines to name: (start, stop)
+    colnames = header.split()
+    column_indices = {}
+    for i, colname in enumerate(colnames):
+        start = header.index(colname)
+        next_colname = colnames[i + 1] if i + 1 < len(colnames) else None
+        stop = header.index(next_colname) - 1 if next_colname else None
+        column_indices[colname] = slice(start, stop)
+
+    return (
+        column_indices["ID#"],
+        column_indices["ATTRIBUTE_NAME"],
+        column_indices["RAW_VALUE"],
+        column_indices["VALUE"],
+        column_indices["WORST"],
+    )
 
 
 def parse_smartctl(smartctl_output: str) -> SMARTAttributes:
@@ -24,62 +95,206 @@ def parse_smartctl(smartctl_output: str) -> SMARTAttributes:
 
     Returns: a SMARTAttributes object containing the parsed data.
     """
-    # Initialize the dictionary to store the parsed data
-    parsed_data = {}
-
-    # Split the output into lines
-    lines = smartctl_output.splitlines()
-
-    relevant_lines = []
     # Look for the line that looks like ID# Attribute_Name ...
-    # and between there and the next blank line
-    _relevant = False
-    header = ""
-    for line in lines:
-        if re.match(r"ID#.*ATTRIBUTE_NAME.*VALUE.*RAW_VALUE", line):
-            _relevant = True
-            header = line
-            continue
-        if not _relevant:
-            continue
-        if not line:
+    # and parse the lines between there and the next blank line
+    lines = smartctl_output.splitlines()
+    for header_index, header in enumerate(lines):
+        if header.startswith("ID#") and HEADER_PATTERN.match(header):
             break
-        relevant_lines.append(line)
-
-    if not header:
+    else:
         raise ValueError("Could not parse SMART data")
 
-    # Parse the header lines to name: (start, stop)
-    colnames = header.split()
-    column_indices = {}
-    for i, colname in enumerate(colnames):
-        start = header.index(colname)
-        next_colname = colnames[i + 1] if i + 1 < len(colnames) else None
-        stop = header.index(next_colname) - 1 if next_colname else None
-        column_indices[colname] = (start, stop)
+    id_column, name_column, raw_column, normalized_column, worst_column = column_layout(header)
 
     # Iterate over the lines containing the attribute data
     attributes = []
-    for line in relevant_lines:
-        # Extract the attribute data
-        attribute_id = line[slice(*column_indices["ID#"])].strip()
-        attribute_name = line[slice(*column_indices["ATTRIBUTE_NAME"])].strip()
-        raw_value = line[slice(*column_indices["RAW_VALUE"])].strip()
-        normalized_value = line[slice(*column_indices["VALUE"])].strip()
-        worst_value = line[slice(*column_indices["WORST"])].strip()
-
-        # Store the attribute data in a new SMARTAttribute
-        attribute = SMARTAttribute(
-            id=attribute_id,
-            name=attribute_name,
-            raw=raw_value,
-            normalized=normalized_value,
-            worst=worst_value,
+    for line in lines[header_index + 1:]:
+        if not line:
+            break
+        attributes.append(SMARTAttribute(
+            id=line[id_column].strip(),
+            name=line[name_column].strip(),
+            raw=line[raw_column].strip(),
+            normalized=line[normalized_column].strip(),
+            worst=line[worst_column].strip(),
+        ))
+
+    return SMARTAttributes(attributes)
+
+
+def split_smartctl_documents(text: str) -> dict[str, str]:
+    """Split several concatenated 'smartctl' outputs into one document per drive.
+
+    Each document is introduced by a ``==> key <==`` line, where the key is the drive serial or device path. This is
+    the format `tail -n +1` and `head` produce for several files, e.g. ``tail -n +1 /var/lib/smart/*``.
+
+    Args:
+        text: The concatenated outputs.
+
+    Returns: a dictionary mapping each key to its 'smartctl' output.
+    """
+    documents = {}
+    key = None
+    lines = []
+    for line in text.splitlines():
+        match = DOCUMENT_SEPARATOR.match(line)
+        if match:
+            if key is not None:
+                documents[key] = "\n".join(lines)
+            key = match.group(1)
+            lines = []
+        elif key is not None:
+            lines.append(line)
+    if key is not None:
+        documents[key] = "\n".join(lines)
+
+    if not documents:
+        raise ValueError("Could not find any '==> key <==' document separators")
+    return documents
+
+
+def smartctl_json_table(document: str | bytes | dict) -> list[dict]:
+    """The ``ata_smart_attributes.table`` entries of a 'smartctl --json' document."""
+    if isinstance(document, (str, bytes)):
+        document = json.loads(document)
+    try:
+        return document["ata_smart_attributes"]["table"]
+    except (KeyError, TypeError):
+        raise ValueError("Could not find ata_smart_attributes.table in the smartctl JSON output") from None
+
+
+def json_raw_string(entry: dict) -> str:
+    # "string" is what the text output prints in RAW_VALUE; older smartctl versions only give the number
+    raw = entry["raw"]
+    return raw["string"] if "string" in raw else str(raw["value"])
+
+
+def parse_smartctl_json(document: str | bytes | dict) -> SMARTAttributes:
+    """Parse the JSON output of the 'smartctl' command.
+
+    Args:
+        document: The output of the 'smartctl' command, as text or already decoded. This command should be run as
+            `smartctl -A -j /dev/sdx`
+
+    Returns: a SMARTAttributes object containing the parsed data, equal to what parse_smartctl gives for the text
+        output of the same drive, except that normalized and worst values are not zero-padded.
+    """
+    return SMARTAttributes([
+        SMARTAttribute(
+            id=str(entry["id"]),
+            name=entry.get("name", ""),
+            raw=json_raw_string(entry),
+            normalized=str(entry["value"]),
+            worst=str(entry["worst"]),
         )
+        for entry in smartctl_json_table(document)
+    ])
 
-        attributes += [attribute]
 
-    return SMARTAttributes(attributes)
+def smartctl_json_features(document: str | bytes | dict, feature_names) -> list[float]:
+    """Read the values of ``feature_names`` (e.g. "smart_5_raw") straight from a 'smartctl --json' document.
+
+    Returns: one float per feature name, NaN where the drive does not report the attribute.
+    """
+    table = {str(entry["id"]): entry for entry in smartctl_json_table(document)}
+    values = []
+    for name in feature_names:
+        smart_flag_id, smart_flag_key = split_feature_name(name)
+        entry = table.get(smart_flag_id)
+        if entry is None:
+            value = None
+        elif smart_flag_key == "raw_value":
+            value = parse_number(json_raw_string(entry))
+        elif smart_flag_key == "normalized_value":
+            value = entry["value"]
+        else:
+            value = entry["worst"]
+        values.append(float("nan") if value is None else float(value))
+    return values
+
+
+def smartctl_json_key(document: dict, default: str) -> str:
+    """The drive serial number of a 'smartctl --json' document, else its device path, else ``default``."""
+    return str(document.get("serial_number") or document.get("device", {}).get("name") or default)
+
+
+def iter_smartctl_json(stream, chunk_size: int = 1 << 16, skip_invalid: bool = False):
+    """Decode 'smartctl --json' documents one at a time from a file-like object.
+
+    The stream may hold a JSON array of documents, or documents one after another (e.g. newline delimited). Only the
+    document being decoded is held in memory, so arbitrarily long streams can be processed.
+
+    Args:
+        stream: a binary or text file-like object with a ``read(size)`` method.
+        chunk_size: how much to read at a time.
+        skip_invalid: yield the ``ValueError`` of a document that cannot be decoded in its place, instead of raising
+            it, and carry on from the next line after the document's start that starts a top-level value, i.e. does
+            not start with whitespace or a closing bracket. That is the next line in newline delimited input, and
+            the opening brace of the next document in pretty-printed ``smartctl -j`` output, so a truncated document
+            gives one error and the documents after it are still decoded. In an array of indented documents, the
+            rest of the array gives one error.
+
+    Yields: each decoded document.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    in_array = None
+    eof = False
+    while True:
+        # skip whitespace, and the brackets and commas of an enclosing array
+        while position < len(buffer):
+            char = buffer[position]
+            if char.isspace() or (in_array and char == ","):
+                position += 1
+            elif in_array is None and char == "[":
+                in_array = True
+                position += 1
+            elif in_array and char == "]":
+                return
+            else:
+                in_array = bool(in_array)
+                break
+
+        if position < len(buffer):
+            try:
+                document, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                if not skip_invalid:
+                    if eof:
+                        raise
+                # a syntax error is only known to be one, rather than the end of the buffer, once a line break
+                # follows it, as no JSON token spans lines
+                elif buffer.find("\n", error.pos) >= 0 or eof:
+                    # searched from the document's start, as a document cut short may have swallowed the next one
+                    resync = TOP_LEVEL_LINE.search(buffer, position)
+                    if resync is not None or eof:
+                        yield error
+                        if resync is None:
+                            return
+                        position = resync.end()
+                        continue
+            else:
+                yield document
+                continue
+
+        if eof:
+            if in_array:
+                error = ValueError("Unterminated JSON array of smartctl documents")
+                if not skip_invalid:
+                    raise error
+                yield error
+            return
+        buffer = buffer[position:]
+        position = 0
+        # read at least as much as is already buffered, so a document larger than chunk_size is decoded a
+        # logarithmic rather than linear number of times
+        chunk = stream.read(max(chunk_size, len(buffer)))
+        if isinstance(chunk, bytes):
+            chunk = text_decoder.decode(chunk, final=not chunk)
+        eof = not chunk
+        buffer += chunk
 
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+"""Module attributes imported on first use (PEP 562), so that importing a package does not import what it exports."""
+import importlib
+
+
+def lazy_exports(namespace: dict, exports: dict[str, str]):
+    """``__getattr__`` and ``__dir__`` functions for a package that exports names from its modules lazily.
+
+    Args:
+        namespace: the ``globals()`` of the package. An attribute is stored there once imported, so that the next
+            access does not go through ``__getattr__``.
+        exports: the name of each exported attribute, and the module defining it, relative to the package.
+
+    Returns: ``(__getattr__, __dir__)``, to assign in the package.
+    """
+    package = namespace["__name__"]
+
+    def __getattr__(name: str):
+        if name not in exports:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(exports[name], package), name)
+        namespace[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(namespace) | set(exports))
+
+    return __getattr__, __dir__
@@ -0,0 +1,467 @@
+"""Counters and latency histograms, rendered in the Prometheus text exposition format.
+
+Instrumentation is on unless the ``HDD_LIFETIME_METRICS`` environment variable is set to 0, or ``set_enabled(False)``
+is called. When it is off every recording call returns straight away, and stopwatches are a shared no-op object.
+Only the standard library is used, so the model layer can record without pulling in a metrics client.
+
+Under the pre-forking server each process records its own values, and ``SharedMetrics`` adds up those of every
+process, including workers that have since exited, so that a scrape of ``/metrics`` from any worker sees them all.
+"""
+import fcntl
+import glob
+import json
+import os
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from time import monotonic, perf_counter
+
+ENABLED = os.environ.get("HDD_LIFETIME_METRICS", "1") != "0"
+
+# in seconds, from a tree traversal up to a slow batch request
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0,
+)
+# observations a histogram queues before counting them into its buckets
+MAX_PENDING = 1024
+# how often a process of the pre-forking server writes its values for the others to add up, in seconds
+FLUSH_INTERVAL = 1.0
+
+
+def set_enabled(enabled: bool):
+    """Turn recording on or off for the whole process. Values recorded so far are kept."""
+    global ENABLED
+    ENABLED = enabled
+
+
+class Tally:
+    """A thread-safe count per hashable key.
+
+    Each thread counts into a dict of its own, which no other thread writes to, so recording takes no lock and no
+    increment is lost to a concurrent one; ``snapshot`` adds the dicts up. The dict of a thread that has exited is
+    folded into a shared total when the next thread starts counting, so a server with a thread per request keeps one
+    dict per live thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        # (thread, its counts) for every thread that has counted since the last fold
+        self._threads: list[tuple[threading.Thread, dict]] = []
+        self._exited: dict = {}
+        self._lock = threading.Lock()
+
+    def _start_thread(self) -> dict:
+        """The counts of the calling thread, which has not counted yet."""
+        with self._lock:
+            self._fold_exited()
+            counts = self._local.counts = {}
+            self._threads.append((threading.current_thread(), counts))
+        return counts
+
+    def _fold_exited(self):
+        running = []
+        for thread, counts in self._threads:
+            if thread.is_alive():
+                running.append((thread, counts))
+            else:
+                for key, value in counts.items():
+                    self._exited[key] = self._exited.get(key, 0) + value
+        self._threads = running
+
+    def add(self, key, amount: int = 1):
+        if not ENABLED:
+            return
+        try:
+            counts = self._local.counts
+        except AttributeError:
+            counts = self._start_thread()
+        counts[key] = counts.get(key, 0) + amount
+
+    def update(self, counts: dict):
+        """Add ``{key: amount}`` in one go."""
+        if not ENABLED:
+            return
+        try:
+            totals = self._local.counts
+        except AttributeError:
+            totals = self._start_thread()
+        for key, amount in counts.items():
+            totals[key] = totals.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._fold_exited()
+            totals = dict(self._exited)
+            # a copy of each running thread's dict, taken in one step, as the thread may be counting into it
+            copies = [dict(counts) for _, counts in self._threads]
+        for counts in copies:
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def clear(self):
+        with self._lock:
+            # threads start new dicts on their next count, so none of them is written to while being emptied
+            self._local = threading.local()
+            self._threads = []
+            self._exited = {}
+
+
+class Counter:
+    """A monotonically increasing count per combination of label values."""
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = Tally()
+
+    def inc(self, labels: tuple = (), amount: int = 1):
+        self._values.add(labels, amount)
+
+    def samples(self):
+        for labels, value in sorted(self._values.snapshot().items()):
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Stopwatch:
+    """Times the consecutive stages of one piece of work, e.g. a request, into a histogram.
+
+    ``lap(stage)`` ends the running stage and starts the next one. The laps are kept on the stopwatch and handed to
+    the histogram together by ``stop()``.
+    """
+    __slots__ = ("histogram", "labels", "start", "last", "laps")
+    recording = True
+
+    def __init__(self, histogram: "Histogram", labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = self.last = perf_counter()
+        self.laps = []
+
+    def lap(self, stage: str, excluding: float = 0.0):
+        """End ``stage``, less ``excluding`` seconds of it already recorded with ``add``."""
+        now = perf_counter()
+        self.laps.append((stage, now - self.last - excluding))
+        self.last = now
+
+    def add(self, stage: str, seconds: float):
+        """Record a stage timed separately, e.g. one interleaved with another."""
+        self.laps.append((stage, seconds))
+
+    def stop(self):
+        self.histogram.observe_laps(self.labels, self.laps)
+        self.laps = []
+
+
+class _NullStopwatch:
+    recording = False
+
+    def lap(self, stage: str, excluding: float = 0.0):
+        pass
+
+    def add(self, stage: str, seconds: float):
+        pass
+
+    def stop(self):
+        pass
+
+
+_NULL_STOPWATCH = _NullStopwatch()
+
+
+class Histogram:
+    """Observations counted into cumulative ``le`` buckets, with their sum and count, per combination of labels.
+
+    Recording an observation only appends it to a queue, which is thread-safe without a lock. The queue is counted
+    into the buckets in bulk, under the lock, when it reaches ``MAX_PENDING`` observations or the samples are read,
+    which costs a fraction of counting each observation on the request path.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # per labels: [count per bucket, the last one for +Inf], sum
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+        # (labels, value), or (labels, [(stage, value), ...]) from a stopwatch, not counted yet
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: tuple = ()):
+        if not ENABLED:
+            return
+        self._queue((labels, value))
+
+    def observe_laps(self, labels: tuple, laps: list[tuple[str, float]]):
+        """Record ``(stage, seconds)`` pairs, each with ``labels`` followed by the stage."""
+        if not ENABLED:
+            return
+        self._queue((labels, laps))
+
+    def _queue(self, item):
+        pending = self._pending
+        pending.append(item)
+        if len(pending) >= MAX_PENDING:
+            with self._lock:
+                self._count_pending()
+
+    def _count_pending(self):
+        """Count the queued observations into the buckets. Called with the lock held, so that a single thread pops
+        from the queue while others may append to it."""
+        pending = self._pending
+        values = self._values
+        buckets = self.buckets
+        while pending:
+            labels, value = pending.popleft()
+            if isinstance(value, list):
+                observations = [(labels + (stage,), seconds) for stage, seconds in value]
+            else:
+                observations = [(labels, value)]
+            for labels, value in observations:
+                entry = values.get(labels)
+                if entry is None:
+                    entry = values[labels] = ([0] * (len(buckets) + 1), [0.0])
+                entry[0][bisect_left(buckets, value)] += 1
+                entry[1][0] += value
+
+    def stopwatch(self, labels: tuple = ()) -> Stopwatch:
+        """A ``Stopwatch`` recording each stage with ``labels`` followed by the stage name."""
+        return Stopwatch(self, labels) if ENABLED else _NULL_STOPWATCH
+
+    def samples(self):
+        with self._lock:
+            self._count_pending()
+            values = {labels: (list(counts), total[0]) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            label_dict = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                yield f"{self.name}_bucket", {**label_dict, "le": format_value(bound)}, cumulative
+            yield f"{self.name}_sum", label_dict, total
+            yield f"{self.name}_count", label_dict, cumulative
+
+
+class Family:
+    """Samples computed when the metrics are rendered, for values kept elsewhere, e.g. cache statistics."""
+
+    def __init__(self, name: str, documentation: str, type: str, samples):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self._samples = samples
+
+    def samples(self):
+        return self._samples
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_sample(name: str, labels: dict, value: float) -> str:
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(v)}"' for key, v in labels.items())
+        return f"{name}{{{label_text}}} {format_value(value)}"
+    return f"{name} {format_value(value)}"
+
+
+def render_families(families) -> str:
+    """``Family``s (or metrics) in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family.name} {family.documentation}")
+        lines.append(f"# TYPE {family.name} {family.type}")
+        lines += [render_sample(*sample) for sample in family.samples()]
+    return "\n".join(lines) + "\n"
+
+
+class Registry:
+    """The metrics of a process. ``collect`` functions are called at render time and return extra ``Family``s.
+
+    ``shared`` is set by the pre-forking server, so that ``render`` adds up the metrics of all of its processes.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self.shared: SharedMetrics | None = None
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def collect(self) -> list[Family]:
+        """Every metric of this process, with its samples as they stand."""
+        families = list(self._metrics)
+        for collect in self._collectors:
+            families += collect()
+        return [Family(family.name, family.documentation, family.type, list(family.samples())) for family in families]
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        return render_families(self.shared.collect() if self.shared is not None else self.collect())
+
+
+class SharedMetrics:
+    """The metrics of the processes of a pre-forking server, added up.
+
+    Each process writes the values of its registry to ``<pid>.json`` in ``directory`` with ``flush``, and ``collect``
+    adds up the files of all of them, so a worker's values are at most ``interval`` seconds behind in another worker's
+    scrape. When a worker exits, the parent folds its file into ``retired.json`` with ``retire``, so that its counts
+    outlive it. Every metric is a counter or a histogram, which add up across processes.
+
+    Args:
+        registry: the registry of the process, the same in all of them.
+        directory: where the files are kept, which the processes share.
+        interval: the least time between two writes of the file of a process by ``flush``.
+    """
+
+    def __init__(self, registry: Registry, directory: str, interval: float = FLUSH_INTERVAL):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        # values this process inherited from its parent, which the parent's file already counts
+        self._inherited = {}
+        self._next_flush = 0.0
+
+    def forked(self):
+        """Call in a process just forked from one that records into the same directory, e.g. a worker."""
+        self._inherited = {
+            (family.name, sample, tuple(labels.items())): value
+            for family in self.registry.collect() for sample, labels, value in family.samples()
+        }
+        self._next_flush = 0.0
+
+    def flush(self, force: bool = False):
+        """Write the values of this process, unless it did less than ``interval`` seconds ago and not ``force``."""
+        if not ENABLED or (not force and monotonic() < self._next_flush):
+            return
+        self._next_flush = monotonic() + self.interval
+        inherited = self._inherited
+        families = [
+            (family.name, family.documentation, family.type, [
+                (sample, labels, value - inherited.get((family.name, sample, tuple(labels.items())), 0))
+                for sample, labels, value in family.samples()
+            ])
+            for family in self.registry.collect()
+        ]
+        self._write(self._path(os.getpid()), families)
+
+    def retire(self, pid: int):
+        """Fold the file of ``pid``, which has exited, into the values of the exited processes."""
+        path = self._path(pid)
+        with self._lock(fcntl.LOCK_EX):
+            try:
+                families = self._read(path)
+            except FileNotFoundError:
+                return
+            retired = self._path("retired")
+            try:
+                families = merge_families([self._read(retired), families])
+            except FileNotFoundError:
+                pass
+            self._write(retired, families)
+            os.unlink(path)
+
+    def collect(self) -> list[Family]:
+        """The metrics of every process, live or exited, added up."""
+        self.flush(force=True)
+        # under the lock, a retired file is either in retired.json or in its own, never in both
+        with self._lock(fcntl.LOCK_SH):
+            snapshots = []
+            for path in glob.glob(os.path.join(glob.escape(self.directory), "*.json")):
+                try:
+                    snapshots.append(self._read(path))
+                except (FileNotFoundError, ValueError):
+                    continue
+        return [Family(*family) for family in merge_families(snapshots)]
+
+    def _path(self, name) -> str:
+        return os.path.join(self.directory, f"{name}.json")
+
+    @contextmanager
+    def _lock(self, operation: int):
+        with open(os.path.join(self.directory, "lock"), "a") as file:
+            fcntl.flock(file, operation)
+            yield
+
+    @staticmethod
+    def _read(path: str) -> list:
+        with open(path) as file:
+            return json.load(file)
+
+    @staticmethod
+    def _write(path: str, families: list):
+        # a reader sees the previous file or this one, never a partly written one
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(families, file, separators=(",", ":"))
+        os.replace(temporary, path)
+
+
+def merge_families(snapshots) -> list[tuple]:
+    """Add up ``(name, documentation, type, [(sample, labels, value), ...])`` families by sample name and labels."""
+    merged = {}
+    for families in snapshots:
+        for name, documentation, type, samples in families:
+            if name not in merged:
+                merged[name] = (documentation, type, {})
+            totals = merged[name][2]
+            for sample, labels, value in samples:
+                key = (sample, tuple(labels.items()))
+                totals[key] = totals.get(key, 0) + value
+    return [
+        (name, documentation, type, [(sample, dict(labels), value) for (sample, labels), value in totals.items()])
+        for name, (documentation, type, totals) in merged.items()
+    ]
+
+
+registry = Registry()
+
+# model layer
+MODEL_LOAD_SECONDS = registry.histogram(
+    "hdd_lifetime_model_load_seconds", "Time spent loading a model, by the file it was loaded from.", ("format",)
+)
+# app layer
+REQUESTS = registry.counter(
+    "hdd_lifetime_requests_total", "HTTP requests handled, by route and status code.", ("endpoint", "status")
+)
+REQUEST_SECONDS = registry.histogram(
+    "hdd_lifetime_request_seconds",
+    "Time to produce a response, by route. Streamed bodies are counted up to their first byte.", ("endpoint",)
+)
+ERRORS = registry.counter(
+    "hdd_lifetime_errors_total", "Requests or drives that could not be scored, by route and exception type.",
+    ("endpoint", "error"),
+)
+STAGE_SECONDS = registry.histogram(
+    "hdd_lifetime_stage_seconds",
+    "Time spent in each stage of handling a request: decode, parse, load, predict and serialize.",
+    ("endpoint", "stage"),
+)
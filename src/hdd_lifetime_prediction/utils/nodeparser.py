@@ -1,95 +1,63 @@
+import hashlib
 import json
+import re
+import sys
+import time
 from importlib.resources import files
+from pathlib import Path
 
 import numpy as np
-from bs4 import BeautifulSoup
+import yaml
 
 from .node import ParsedNode
 
-def find_matching_brace(s, start_index):
-    """Finds the position of the matching closing brace for a given opening brace."""
-    open_braces = 0
-    for i in range(start_index, len(s)):
-        if s[i] == '{':
-            open_braces += 1
-        elif s[i] == '}':
-            open_braces -= 1
-            if open_braces == 0:
-                return i
-    return -1
-
-def extract_nodes_from_script(html_content: BeautifulSoup):
-    # Iterate over all <script> tags in the HTML
-    nodes = []
-    for script in html_content.find_all('script'):
-        # Extract and strip whitespace from the <script> tag content
-        script_content = script.string
-        if script_content and 'var treeinfo =' not in script_content:
-            continue
-        try:
-            # Isolate the JSON-like part of the script
-            # Find the position after 'var treeinfo ='
-            json_start = script_content.index('var treeinfo =') + len('var treeinfo =')
-
-            # Find the start index of the JSON section from there
-            json_str_start = script_content.index('{', json_start)
-
-            # Find the matching closing brace
-            json_str_end = find_matching_brace(script_content, json_str_start) + 1
-
-            if json_str_end != 0:  # Ensure an end was found
-                json_str = script_content[json_str_start:json_str_end]
-
-                # Convert the JSON string into a Python dictionary
-                script_data = json.loads(json_str)
-
-                # Extract nodes data
-                nodes = script_data.get("lnr", {}).get("tree_", {}).get("nodes", [])
-
-        except (ValueError, json.JSONDecodeError) as e:
-            print(f"Error parsing JSON from script: {e}")
-
-    # Return empty list if no matching <script> is found
-    return nodes
-
-def extract_features_from_script(html_content: BeautifulSoup):
-    features = []
-    for script in html_content.find_all('script'):
-        # Extract and strip whitespace from the <script> tag content
-        script_content = script.string
-        if script_content and 'var treeinfo =' not in script_content:
-            continue
-        try:
-            # Isolate the JSON-like part of the script
-            # Find the position after 'var treeinfo ='
-            json_start = script_content.index('var treeinfo =') + len('var treeinfo =')
-
-            # Find the start index of the JSON section from there
-            json_str_start = script_content.index('{', json_start)
-
-            # Find the matching closing brace
-            json_str_end = find_matching_brace(script_content, json_str_start) + 1
-
-            if json_str_end != 0:  # Ensure an end was found
-                json_str = script_content[json_str_start:json_str_end]
-
-                # Convert the JSON string into a Python dictionary
-                script_data = json.loads(json_str)
-
-                # Extract nodes data
-                features = (
-                    script_data
-                    .get("lnr", {})
-                    .get("prb_", {})
-                    .get("data", {})
-                    .get("features", {})
-                    .get("feature_names", [])
-                )
-
-        except (ValueError, json.JSONDecodeError) as e:
-            print(f"Error parsing JSON from script: {e}")
-
-    return features
+TREEINFO_MARKER = b"var treeinfo ="
+# the libyaml emitter, when PyYAML was built with it, writes the lifetime curves many times faster
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+
+def extract_treeinfo(html_content: bytes | str):
+    """extract the tree nodes and the feature names from a tree visualisation page in a single pass
+
+    the page is searched for ``var treeinfo =`` without parsing the html, and only the JSON value that follows it is
+    decoded, with ``json.JSONDecoder.raw_decode``, which stops at the end of the value
+
+    :param html_content: the page, as bytes or text
+
+    :return: (nodes, features), the list of nodes for parse_nodes and the list of feature names they refer to
+    :raises ValueError: if the page has no treeinfo, or it is not valid JSON
+    """
+    marker = TREEINFO_MARKER if isinstance(html_content, bytes) else TREEINFO_MARKER.decode()
+    marker_start = html_content.find(marker)
+    if marker_start < 0:
+        raise ValueError("Could not find 'var treeinfo =' in the page")
+    # only the part after the marker is decoded, and the decoder stops at the end of the JSON value
+    json_text = html_content[marker_start + len(marker):]
+    if isinstance(json_text, bytes):
+        json_text = json_text.decode("utf-8")
+    script_data, _ = _decoder.raw_decode(json_text, _whitespace.match(json_text).end())
+
+    lnr = script_data.get("lnr", {})
+    nodes = lnr.get("tree_", {}).get("nodes", [])
+    features = lnr.get("prb_", {}).get("data", {}).get("features", {}).get("feature_names", [])
+    return nodes, features
+
+def _extract_or_empty(html_content, index: int):
+    try:
+        # a BeautifulSoup document renders back to its html
+        return extract_treeinfo(html_content if isinstance(html_content, (bytes, str)) else str(html_content))[index]
+    except ValueError as e:
+        print(f"Error parsing JSON from script: {e}")
+        return []
+
+def extract_nodes_from_script(html_content):
+    """the nodes of the tree in a page, or an empty list if there are none. see extract_treeinfo"""
+    return _extract_or_empty(html_content, 0)
+
+def extract_features_from_script(html_content):
+    """the feature names of the tree in a page, or an empty list if there are none. see extract_treeinfo"""
+    return _extract_or_empty(html_content, 1)
 
 def parse_nodes(nodes, features):
     """parse these nodes into a nice dictionary
@@ -148,50 +116,77 @@ def parse_nodes(nodes, features):
 
     return parsed_nodes
 
-if __name__ == "__main__":
-    from pprint import pprint
-    import yaml
-
-    # Example HTML content
-    html_content = (
-        files('hdd_lifetime_prediction.utils')
-        .joinpath("Fig3. Optimal Survival Tree for predicting long-term health.html")
-        .read_text()
-    )
-    # Parse the HTML content with BeautifulSoup
-    soup = BeautifulSoup(html_content, 'html.parser')
-
-    nodes = extract_nodes_from_script(soup)
-    pprint([
-        (node.get("id"), node.keys())
+def parse_curves(nodes):
+    """the lifetime curve of each node, which parse_nodes reduces to a few quantiles
+
+    :param nodes: list of nodes, as for parse_nodes
+
+    :return: dictionary with the keys being the node id, and the values being a (times, coefs) tuple of lists
+    """
+    return {
+        node.get("id"): (
+            [float(t) for t in node.get('fit', {}).get('curve', {}).get('times')],
+            [float(c) for c in node.get('fit', {}).get('curve', {}).get('coefs')],
+        )
         for node in nodes
-    ])
-    features = extract_features_from_script(soup)
-    pprint(features)
+    }
 
+def nodes_to_dict(parsed_nodes, curves):
+    """the params yaml representation of parsed nodes and their curves"""
+    return {
+        k: {**v.__dict__, "survival_times": curves[k][0], "survival_coefs": curves[k][1]}
+        for k, v in parsed_nodes.items()
+    }
+
+def extract_params(html_path: Path, config_yaml: Path, binary: Path | None = None) -> dict[int, ParsedNode]:
+    """extract the tree from a page and write both its params yaml and its model file in one go
+
+    the model file is built from the extracted nodes directly, tagged with the digest of the yaml written alongside
+    it, and then checked against that yaml as ``python -m hdd_lifetime_prediction.model.build`` would
+
+    :param html_path: the tree visualisation page
+    :param config_yaml: where to write the params yaml
+    :param binary: where to write the model file, by default next to the yaml
+
+    :return: the parsed nodes
+    """
+    from hdd_lifetime_prediction.model.build import binary_path, verify_binary
+    from hdd_lifetime_prediction.model.model import TreeModel
+
+    nodes, features = extract_treeinfo(Path(html_path).read_bytes())
+    if not nodes:
+        raise ValueError(f"{html_path} has no tree nodes")
     parsed_nodes = parse_nodes(nodes, features)
-    pprint(parsed_nodes)
-
-    # save these nodes to long-term-params.yaml
-    with open("src/hdd_lifetime_prediction/model/long-term-params.yaml", "w") as f:
-        # convert the nodes to dicts
-        parsed_nodes_dict = {k: v.__dict__ for k, v in parsed_nodes.items()}
-        yaml.dump(parsed_nodes_dict, f)
-
-
-    # Repeat with the short term html
-    html_content = (
-        files('hdd_lifetime_prediction.utils')
-        .joinpath("Fig6. Optimal Survival Tree predicting short-term health.html")
-        .read_text()
-    )
-    # Parse the HTML content with BeautifulSoup
-    soup = BeautifulSoup(html_content, 'html.parser')
-
-    nodes = extract_nodes_from_script(soup)
-    features = extract_features_from_script(soup)
-    parsed_nodes = parse_nodes(nodes, features)
-    with open("src/hdd_lifetime_prediction/model/short-term-params.yaml", "w") as f:
-        # convert the nodes to dicts
-        parsed_nodes_dict = {k: v.__dict__ for k, v in parsed_nodes.items()}
-        yaml.dump(parsed_nodes_dict, f)
+    curves = parse_curves(nodes)
+
+    params = yaml.dump(nodes_to_dict(parsed_nodes, curves), Dumper=Dumper).encode()
+    Path(config_yaml).write_bytes(params)
+    binary = binary or binary_path(config_yaml)
+    TreeModel.from_nodes(parsed_nodes, curves).to_binary(binary, source_sha256=hashlib.sha256(params).hexdigest())
+    verify_binary(config_yaml, binary)
+    return parsed_nodes
+
+# the supplementary pages (see download_sources.sh) and the params they are extracted to
+SOURCES = {
+    "Fig3. Optimal Survival Tree for predicting long-term health.html": "long-term-params.yaml",
+    "Fig6. Optimal Survival Tree predicting short-term health.html": "short-term-params.yaml",
+}
+
+if __name__ == "__main__":
+    # extract the shipped params yaml and model files, or those of the given pages:
+    # python -m hdd_lifetime_prediction.utils.nodeparser [page.html params.yaml]...
+    args = sys.argv[1:]
+    if args:
+        pairs = list(zip(args[::2], args[1::2]))
+    else:
+        pairs = [
+            (
+                files('hdd_lifetime_prediction.utils').joinpath(page),
+                files('hdd_lifetime_prediction.model').joinpath(params),
+            )
+            for page, params in SOURCES.items()
+        ]
+    for html_path, config_yaml in pairs:
+        start = time.perf_counter()
+        parsed_nodes = extract_params(html_path, config_yaml)
+        print(f"{html_path} -> {config_yaml}: {len(parsed_nodes)} nodes in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,39 @@
+import io
+import json
+
+from hdd_lifetime_prediction.model.smartctl import iter_smartctl_json
+
+
+def smartctl_document(serial: str) -> dict:
+    return {
+        "json_format_version": [1, 0],
+        "smartctl": {"version": [7, 2], "exit_status": 0},
+        "device": {"name": f"/dev/disk/by-id/ata-{serial}", "type": "sat", "protocol": "ATA"},
+        "serial_number": serial,
+        "ata_smart_attributes": {"revision": 10, "table": [
+            {"id": 5, "name": "Reallocated_Sector_Ct", "value": 100, "worst": 100, "thresh": 10,
+             "raw": {"value": 0, "string": "0"}},
+            {"id": 9, "name": "Power_On_Hours", "value": 26, "worst": 26, "thresh": 0,
+             "raw": {"value": 65573, "string": "65573"}},
+        ]},
+    }
+
+
+def test_truncated_pretty_printed_document_is_one_error():
+    documents = [smartctl_document(f"ZA00{i}") for i in range(3)]
+    texts = [json.dumps(document, indent=2) for document in documents]
+    for cut in range(1, len(texts[1]) - 1, 7):
+        body = "\n".join([texts[0], texts[1][:cut], texts[2]]) + "\n"
+        for chunk_size in (16, 1 << 16):
+            decoded = list(iter_smartctl_json(io.BytesIO(body.encode()), chunk_size, skip_invalid=True))
+            assert len(decoded) == 3, (cut, chunk_size)
+            assert decoded[0] == documents[0]
+            assert isinstance(decoded[1], ValueError)
+            assert decoded[2] == documents[2]
+
+
+def test_malformed_ndjson_line_is_one_error():
+    lines = [json.dumps(smartctl_document(f"ZA00{i}")) for i in range(2)]
+    body = "\n".join([lines[0], lines[1][:40], "42", lines[1]]) + "\n"
+    decoded = list(iter_smartctl_json(io.StringIO(body), skip_invalid=True))
+    assert [type(value) for value in decoded] == [dict, json.JSONDecodeError, int, dict]